@@ -0,0 +1,31 @@
+" ============================================================================
+" File:        reco.vim
+" Description: Lazy start of Reco, called by stub auto-commands of
+"              plugin/reco.vim when g:reco_lazy is set
+" Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+" License:     GPLv2+ -- look it up.
+"
+" ============================================================================
+" Start Reco at first event which needs it, then run Reco for that event as
+" its own auto-commands are added too late for it. If Vim already entered,
+" Reco also gets VimEnter it missed, after the event so new buffer is not
+" counted twice.
+function! reco#load(event)
+    augroup RecoLazy
+        au!
+    augroup END
+    if exists('g:reco_loaded')
+        return
+    endif
+    let g:reco_loaded = 1
+    let entered = exists('v:vim_did_enter') ? v:vim_did_enter :
+                \ !has('vim_starting')
+    call Reco()
+    " session only needs Reco ready before its buffers are added
+    if a:event !=# 'SourcePre'
+        exe "python reco.dispatch('" . a:event . "')"
+    endif
+    if entered
+        python reco.dispatch('VimEnter')
+    endif
+endfunction
@@ -8,8 +8,74 @@
 
 import os
 import vim
-import re
-import shutil
+import time
+import reco_cache
+import reco_cleanup
+import reco_copy
+import reco_daemon
+import reco_diff
+import reco_journal
+import reco_names
+import reco_registry
+import reco_retention
+import reco_scratch
+import reco_stats
+import reco_store
+import reco_swap
+import reco_watch
+
+#Vim expressions used by stages
+AFILE = 'expand("<afile>:p")'
+AFILE_HEAD = 'expand("<afile>:p:h")'
+AFILE_TAIL = 'expand("<afile>:t")'
+LAST_BUF = 'bufnr("$")'
+ABUF = 'expand("<abuf>")'
+MODIFIED = '&modified'
+SESSION_LOAD = "exists('g:SessionLoad')"
+SWAPNAME = 'v:swapname'
+SWAP_OWNER = "exists('*swapinfo') ? get(swapinfo(v:swapname),'pid',0) : 0"
+#current tab page for journal, window ids in winlayout() with buffer names
+LAYOUT = "[tabpagenr(),tabpagenr('$'),winlayout(),winnr(),winrestcmd(),"\
+        "map(gettabinfo(tabpagenr())[0].windows,"\
+        "'[v:val,bufname(winbufnr(v:val))]')]"
+#values stages of event need, dispatch gets them all in one vim.eval
+EVENT_VALUES = {
+    'BufAdd':[LAST_BUF,MODIFIED,SESSION_LOAD],
+    'BufFilePost':[ABUF],
+    'BufWritePost':[LAST_BUF],
+    'SwapExists':[AFILE,AFILE_HEAD,AFILE_TAIL,SWAPNAME,SWAP_OWNER],
+}
+
+class EventContext(object):
+    """Values from Vim shared by all stages of one auto-command event"""
+    def __init__(self,event,exprs=()):
+        self.event = event
+        self.evals = 0
+        self._values = {}
+        self._memo = {}
+        if exprs:
+            self._prefetch(exprs)
+
+    def eval(self,expr):
+        if expr not in self._values:
+            self.evals += 1
+            self._values[expr] = vim.eval(expr)
+        return self._values[expr]
+
+    def memo(self,key,compute):
+        """Value derived from Vim values, computed once per event"""
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def _prefetch(self,exprs):
+        """Evaluate all exprs as one dictionary expression"""
+        values = vim.eval('{%s}' % ','.join(["'%d':%s" % (i,expr) \
+                for i,expr in enumerate(exprs)]))
+        self.evals += 1
+        for i,expr in enumerate(exprs):
+            self._values[expr] = values[str(i)]
+
 class Reco(object):
     def __init__(self,backup_dir='~',backup_prefix='reco_backup',\
             buffer_prefix='tmp_buf',nofile = False):
@@ -38,24 +104,175 @@ nofile -> Set only for unnamed buffers, read more in Vim docs about it. There
         self.buffer_pattern = r'(^[\\a-zA-Z0-9_\./]*%s\d+\.)(\d+)' % \
                 self.buffer_prefix
         self.nofile = nofile
+        self._names = None
+        self._buffer_index = None
+        #index was built in this recovery batch, miss doesn't rebuild it
+        self._buffer_index_fresh = False
         self._recovered_swap = None
+        self._recovered_file = None
         self._scratch_buffers_swaps = []
-        self._leave_cleanup = []
+        self._swap_index = None
+        self._leave_cleanup = reco_cleanup.CleanupSet()
         self._buffers_counter = 0
         self._unnamed_counter = 1
         self._vim_entered = False
         self._swap_recovered = False
+        #session snapshots, both values in ms. Layout changes only mark
+        #session dirty, snapshot is written after snapshot_delay of quiet or
+        #at once if last snapshot is older than snapshot_max_staleness
+        self.snapshot_delay = 500
+        self.snapshot_max_staleness = 5000
+        self._session_dirty = False
+        self._last_snapshot = 0
+        self._last_layout_change = 0
+        self._snapshot_timer = None
+        self._snapshot_timers = None
+        self._snapshot_requests = 0
+        self._snapshot_writes = 0
+        self._snapshot_pending = 0
+        self._snapshot_coalesced = 0
+        #with journal layout changes are appended to <backup_name>.journal
+        #and full session is written every journal_checkpoint records
+        self.journal = False
+        self.journal_checkpoint = 200
+        self._journal = None
+        #with scratch_journal changes of scratch buffers are appended to
+        #<backup_name>.scratch, synced at CursorHold and replayed by restored
+        #session instead of recovering their swaps. Scratch buffer is
+        #recorded whole at its first TextChanged, then listener_add() gives
+        #changed lines. Without listeners each TextChanged diffs whole buffer
+        self.scratch_journal = False
+        self._scratch_journal = None
+        self._scratch_listeners = None
+        #buffer number -> [name in journal,listener id or None]
+        self._scratch_tracked = {}
+        self._scratch_replays = {}
+        self._scratch_buffers_lines = []
+        #backups are copied by background threads, SwapExists only queues
+        #copy and file_recovery waits for copies it needs
+        self.copy_workers = 2
+        self.copy_queue_size = 32
+        self._copy_engine = None
+        #backup of source which didn't change since backup was made (same
+        #dev, inode, size and mtime, with copy_cache_checksum also crc32 of
+        #content) is not copied again. Cache is kept in
+        #<backup_dir>/reco_cache.json so backups left there are reused
+        self.copy_cache = True
+        self.copy_cache_checksum = False
+        self._copy_cache = None
+        #with dedup backups are blobs named by sha1 of content and mangled
+        #names in backup_dir are small refs to them
+        self.dedup = False
+        self._store = None
+        #with daemon copies and cleanup go to reco_daemon.py shared by all
+        #Vims using backup_dir, if it's not running Reco does them itself
+        self.daemon = False
+        self._daemon = None
+        #at VimLeave backups are written to reco_cleanup.<pid> manifest and
+        #removed by detached helper. Without python for helper cleanup_workers
+        #threads remove them for at most cleanup_deadline seconds, rest is
+        #removed by next Reco started with same backup_dir
+        self.cleanup_detach = True
+        self.cleanup_workers = 4
+        self.cleanup_deadline = 0.5
+        #each Reco keeps its entry (pid, start, session, backups, heartbeat)
+        #in <backup_dir>/reco_registry.json, sessions of dead Vims are found
+        #there at start. Heartbeat is written at CursorHold at most every
+        #registry_interval seconds or when backups changed
+        self.registry = True
+        self.registry_interval = 60
+        self._registry = None
+        self._registry_beat = 0
+        self._registry_backups = 0
+        self._start = time.time()
+        #with retention backups stay in backup_dir after Vim quits while
+        #they fit in retention_bytes and retention_files. Least recently used
+        #backups of dead Vims are evicted in background, diff_swap and
+        #before_recovery count as use. Session backup is still removed
+        self.retention = False
+        self.retention_bytes = 1024 * 1024 * 1024
+        self.retention_files = 1000
+        self._retention = None
+        self._retained = set()
+        #with prestage swaps of dead Vims in 'directory' are copied to
+        #backup_dir in background before SwapExists asks about them. Started
+        #at first BufAdd or VimEnter, uses inotify on Linux otherwise lists
+        #'directory' every prestage_interval seconds
+        self.prestage = False
+        self.prestage_interval = 1.0
+        self._stager = None
+        #None, 'zlib' or 'lzma'. With lzma only file copies (cold data, read
+        #only by diff_swap and before_recovery) use it, swaps still zlib
+        self.compression = None
+        self._compressors = {}
+        #diff_swap of files bigger than diff_threshold bytes runs diff in
+        #background thread and shows only hunks, smaller use diffsplit
+        self.diff_threshold = 2 * 1024 * 1024
+        self.diff_timeout = 10.0
+        self._diff_job = None
+        self._diff_timer = None
+        self._diff_jumps = {}
+        #instrumentation of auto-command events and their stages, see stats().
+        #With profile = '<stage>' that stage runs under cProfile, profile is
+        #written at VimLeave to profile_file (default reco_profile.<pid> in
+        #backup_dir), stats_file gets json of stats at VimLeave
+        self.instrument = False
+        self.stats_file = None
+        self.profile = None
+        self.profile_file = None
+        self._stats = None
+        self._profiler = None
+        #each event has one au which runs its stages, stage can be
+        #switched off by adding its name i.e. 'update_backup_session'
+        self.disabled_stages = set()
+        self._stages = {}
+        self._event = None
         self._add_au_cmd = 'au Reco %s * :python %s'
         self.setup_auto_commands()
 
 #Only auto-commands have public methods, rest of code should be private and are
 #meant to be use only in API
+    def dispatch(self,event):
+        """Run enabled stages of event in order, all of them share one
+EventContext so values from Vim are evaluated only once per event. Values
+in EVENT_VALUES are fetched at once before first stage. With instrument or
+profile on, event and each stage are timed and vim.eval and vim.command
+calls of reco.py are counted while event runs"""
+        global vim
+        if self.instrument or self.profile:
+            stats = self._get_stats()
+            module = vim
+            #nested event keeps counting vim of outer one
+            if not isinstance(vim,reco_stats.CountingVim):
+                vim = reco_stats.CountingVim(module,stats)
+            try:
+                stats.run('au %s' % event,self._run_stages,event,True)
+            finally:
+                vim = module
+            if event == 'VimLeave':
+                self._dump_stats()
+        else:
+            self._run_stages(event)
+
+    def stats(self):
+        """Show instrumentation stats in reco-stats scratch buffer"""
+        if self._stats is None:
+            print "Reco instrumentation is off: python reco.instrument = 1"
+            return
+        lines = ['Reco stats for %.1fs, time is wall time in ms' % \
+                (time.time() - self._stats.start)] + self._collect_stats()
+        vim.command("exe 'silent! botright new' fnameescape('reco-stats')")
+        buf = vim.current.buffer
+        for option,value in (('buftype','nofile'),('bufhidden','wipe'),\
+                ('swapfile',False),('modifiable',True)):
+            buf.options[option] = value
+        buf[:] = lines
+        buf.options['modifiable'] = False
+
     def check_swapfile(self):
         """Check if swapfile exists for buffer in current window and if unnamed
  buffer also check nofile flag and set if True"""
-        match = re.search(self.buffer_pattern,\
-                vim.current.window.buffer.name)
-        if match:
+        if self._scratch_name(vim.current.window.buffer):
             vim.current.window.buffer.options['swapfile'] = 1
             if self.nofile:
                 vim.current.window.buffer.options['bt'] = 'nofile'
@@ -65,36 +282,145 @@ nofile -> Set only for unnamed buffers, read more in Vim docs about it. There
     def check_last_buffer_name(self):
         """Vim always add buffers to the end of buffer list. Check if added
 buffer is unnamed if yes set name"""
-        last_buf_nr = int(vim.eval('bufnr("$")'))
-        buf = vim.buffers[last_buf_nr]
+        buf = vim.buffers[self._last_buf_nr()]
         self._set_name_if_unnamed_buffer(buf)
 
     def check_filename_after_write(self):
         """When we writing unnamed buffer, set name = filename"""
-        match = re.search(self.buffer_pattern,\
-                vim.current.window.buffer.name)
-        if match:
-            last_buf_nr = int(vim.eval('bufnr("$")'))
-            vim.current.buffer = vim.buffers[last_buf_nr]
+        if self._scratch_name(vim.current.window.buffer):
+            vim.current.buffer = vim.buffers[self._last_buf_nr()]
 
     def vim_enter_buffers_check(self):
         """First set vim_entered flag, then check if session was recovered if
 yes do unnamed buffers recovery. After that update unnamed buffers names, set
 _buffers_counter and do init_backup for new_session"""
         self._vim_entered = True
-        if self._session_recovered():
-            self._scratch_buffers_recovery()
-            self._update_pid_in_prev_session_buffers()
+        #swaps are only looked up before VimEnter
+        self._swap_index = None
+        self._session_sourced()
         self._update_unnamed_buffers()
         self._buffers_counter = len(vim.buffers)
         self._make_init_backup()
        
     def update_backup_session(self):
         """At BufAdd,BufWinEnter,BufWinLeave check if init_backup flag True if
-yes update backup as Vim layout might change"""
-        if self.init_backup:
-            backup_cmd = 'exe "mksession! %s"'
-            vim.command(backup_cmd % self.backup_name)
+yes mark session dirty as Vim layout might change. Snapshot is written at once
+only if last one is older than snapshot_max_staleness, otherwise it waits for
+quiet period. In journal mode changes go to journal instead"""
+        if self.init_backup and self._journal is None:
+            self._session_dirty = True
+            self._snapshot_requests += 1
+            self._snapshot_pending += 1
+            self._last_layout_change = time.time()
+            if self._ms_since(self._last_snapshot) >= \
+                    self.snapshot_max_staleness:
+                self.flush_backup_session()
+            else:
+                self._schedule_snapshot()
+
+    def flush_backup_session(self):
+        """At CursorHold,FocusLost and before recovery write session snapshot
+if layout changed since last one. In journal mode fsync journal and write
+checkpoint if journal has journal_checkpoint records. Scratch journal is
+synced too and compacted when it grew too big"""
+        if self._scratch_journal is not None:
+            self._scratch_journal.sync()
+            if self._scratch_journal.needs_compaction():
+                self._scratch_journal.compact()
+        if self._journal is not None:
+            self._journal.sync()
+            if self._journal.records >= self.journal_checkpoint:
+                self._write_session_snapshot()
+        elif self.init_backup and self._session_dirty:
+            self._write_session_snapshot()
+
+    def update_scratch_journal(self):
+        """At TextChanged,TextChangedI append change of current scratch buffer
+to scratch journal, only changed lines are written. Buffers with listener
+are only recorded here again after rename"""
+        buf = vim.current.buffer
+        if self._scratch_journal is None or not self._scratch_name(buf):
+            return
+        tracked = self._scratch_tracked.get(buf.number)
+        if tracked is not None and tracked[1] is not None:
+            #changes waiting for listener are applied before name is checked
+            vim.command('call listener_flush(%d)' % buf.number)
+            if tracked[0] == os.path.basename(buf.name):
+                return
+        self._track_scratch(buf)
+
+    def scratch_changed(self):
+        """Called by RecoScratchChanged listener of scratch buffer, lines from
+a:start to a:end were replaced and a:added lines were added, only new
+content of that range goes to scratch journal"""
+        nr,start,end,added = [int(value) for value in \
+                vim.eval('[a:bufnr,a:start,a:end,a:added]')]
+        buf = vim.buffers[nr]
+        tracked = self._scratch_tracked.get(nr)
+        if self._scratch_journal is None or tracked is None:
+            return
+        if tracked[0] != os.path.basename(buf.name):
+            if self._scratch_name(buf):
+                self._track_scratch(buf)
+            return
+        self._scratch_journal.change(tracked[0],start - 1,end - 1,\
+                buf[start - 1:end - 1 + added])
+
+    def forget_scratch_buffer(self):
+        """At BufWipeout drop wiped scratch buffer from scratch journal, it's
+not written again at compaction"""
+        tracked = self._scratch_tracked.pop(int(self._eval(ABUF)),None)
+        if tracked is not None and tracked[0] is not None:
+            self._scratch_journal.forget(tracked[0])
+
+    def update_backup_journal(self):
+        """In journal mode at BufAdd,BufDelete,BufWinEnter,WinEnter,TabEnter
+append record of the change to journal, layout records cover only current tab
+page"""
+        if self._journal is None:
+            return
+        event = self._event.event if self._event is not None else None
+        if event in ('BufAdd','BufDelete'):
+            nr = self._last_buf_nr() if event == 'BufAdd' else \
+                    int(self._eval(ABUF))
+            name = vim.buffers[nr].name
+            if name:
+                self._journal.append(reco_journal.buffer_record(\
+                        'badd' if event == 'BufAdd' else 'bdelete',name))
+        else:
+            tab,tabs,layout,current,sizes,windows = self._eval(LAYOUT)
+            self._journal.append(reco_journal.layout_record(tab,tabs,\
+                    layout,current,sizes,dict(windows)))
+
+    def snapshot_timer(self):
+        """Called by RecoSnapshotTimer, write snapshot if there was no layout
+change for snapshot_delay otherwise wait for rest of quiet period"""
+        self._snapshot_timer = None
+        if not self._session_dirty:
+            return
+        quiet = self._ms_since(self._last_layout_change)
+        if quiet >= self.snapshot_delay:
+            self.flush_backup_session()
+        else:
+            self._schedule_snapshot(self.snapshot_delay - quiet)
+
+    def snapshot_stats(self):
+        """Print how many session snapshots were requested, written and how
+many writes were coalesced, in journal mode also journal writes"""
+        print "Reco snapshots: %d requested, %d written, %d coalesced" % \
+                (self._snapshot_requests,self._snapshot_writes,\
+                self._snapshot_coalesced)
+        if self._journal is not None:
+            print "Reco journal: %d records, %d bytes, %d fsyncs, %d "\
+                    "checkpoints" % (self._journal.appended,\
+                    self._journal.bytes_written,self._journal.syncs,\
+                    self._journal.checkpoints)
+        if self._scratch_journal is not None:
+            print "Reco scratch journal: %d records, %d bytes, %d fsyncs, "\
+                    "%d compactions" % (self._scratch_journal.records,\
+                    self._scratch_journal.bytes_written,\
+                    self._scratch_journal.syncs,\
+                    self._scratch_journal.compactions)
 
     def vim_leave_buffers_check(self):
         """At VimLeave cleanup all backup files. Also check _buffers_counter
@@ -104,7 +430,88 @@ not positive, Vim unloaded all buffers and its safe to remove backups files.
 We not always have counter equal 0 that's why we check if _buffers_counter < 1.
 """
         if self._buffers_counter < 1 and self._leave_cleanup:
-            self._cleanup(self._leave_cleanup)
+            if self._copy_engine:
+                self._copy_engine.shutdown(cancel=True)
+            if self._stager is not None:
+                self._stager.stop()
+            if self._journal is not None:
+                self._journal.close()
+            if self._scratch_journal is not None:
+                self._scratch_journal.close()
+            self._retain_backups(leave=True)
+            if self.retention and self._copy_cache is not None:
+                self._copy_cache.save()
+            self._detach_cleanup()
+            if self._store:
+                self._store.release()
+            if self.registry and self._registry is not None:
+                self._registry.unregister(os.getpid())
+        else:
+            self.flush_backup_session()
+
+    def registry_heartbeat(self):
+        """At CursorHold and FocusLost update entry of this Vim in registry
+if its backups changed or heartbeat is older than registry_interval"""
+        if not self.registry or self._registry is None or (\
+                len(self._leave_cleanup) == self._registry_backups and \
+                time.time() - self._registry_beat < self.registry_interval):
+            return
+        self._registry.heartbeat(os.getpid(),self._leave_cleanup)
+        self._registry_beat = time.time()
+        self._registry_backups = len(self._leave_cleanup)
+
+    def retention_update(self):
+        """At CursorHold and FocusLost add new backups to retention store
+and evict old ones in background if store is over quota"""
+        if self.retention and self._retain_backups():
+            self._get_retention().start_evict(pid=os.getpid())
+
+    def restore_session(self,index=None):
+        """Restore session of dead Vim same as vim -S <session>. Sessions
+from registry are offered newest first, index is number in that list"""
+        orphans = self._get_registry().orphans(os.getpid())
+        if not orphans:
+            print "Reco: no sessions of dead Vim to restore"
+            return
+        if index is None:
+            choices = ['Reco session to restore:'] + ['%d. %s %s (%d '\
+                    'backups)' % (i + 1,time.strftime('%Y-%m-%d %H:%M',\
+                    time.localtime(entry.heartbeat)),entry.session,\
+                    len(entry.backups)) for i,entry in enumerate(orphans)]
+            index = int(vim.eval('inputlist([%s])' % ','.join(["'%s'" % \
+                    choice.replace("'","''") for choice in choices])))
+        if not 0 < index <= len(orphans):
+            return
+        entry = orphans[index - 1]
+        #scratch buffers of session are only recovered before VimEnter
+        self._vim_entered = False
+        try:
+            vim.command("exe 'silent! source' fnameescape('%s')" % \
+                    entry.session.replace("'","''"))
+        finally:
+            self._vim_entered = True
+        self._swap_index = None
+        self._session_sourced()
+        #buffers added while sourcing weren't counted with _vim_entered off
+        self._buffers_counter = len(vim.buffers)
+        for backup in entry.backups:
+            self._leave_cleanup.append(backup)
+        if self.dedup:
+            self._get_copy_engine()
+            if self._store is not None:
+                self._store.adopt(entry.pid)
+        self._get_registry().unregister(entry.pid)
+
+    def buffer_added(self):
+        """At BufAdd add buffer to buffer index if it's already built"""
+        if self._buffer_index is not None:
+            buf = vim.buffers[self._last_buf_nr()]
+            self._buffer_index.add(buf.number,buf.name)
+
+    def buffer_renamed(self):
+        """At BufFilePost forget classification of renamed buffer and update
+its name in buffer index"""
+        self._renamed(vim.buffers[int(self._eval(ABUF))])
 
     def increment_buffers_counter(self):
         """At BufAdd, only increment _buffers_counter after vim_enter auto-cmd"""
@@ -116,11 +523,27 @@ We not always have counter equal 0 that's why we check if _buffers_counter < 1.
         if self._vim_entered:
             self._buffers_counter -= 1
 
+    def prestage_swaps(self):
+        """At first BufAdd or VimEnter start copying swaps of dead Vims in
+background, swapcmd takes copy from there when it's ready"""
+        if not self.prestage or self._stager is not None:
+            return
+        #staged copy is plain file, it can't become dedup ref or compressed
+        #backup by rename
+        if self.dedup or self.compression:
+            return
+        names = self._get_names()
+        self._stager = reco_watch.SwapStager(vim.eval('&dir').split(','),\
+                self.backup_dir,self.copy_workers,self.prestage_interval,\
+                lambda name: names.scratch(name) is not None)
+        self._stager.start()
+
     def swapcmd(self):
         """For each SwapExists window, set _swap_recovered flag then make 
 copies of swap and if exists file in current state then set v:swapchoice=d to
 delete swap file as whole recovery process is done at BufWinEnter"""
         self._swap_recovered = True
+        self.flush_backup_session()
         self._copy_file_to_backup_dir()
         self._copy_swapfile_to_backup_dir()
         vim.command('let v:swapchoice = "d"')
@@ -129,67 +552,134 @@ delete swap file as whole recovery process is done at BufWinEnter"""
         """At BufWinEnter check if swap_recovered flag on and do recovery in 
 current window and write file if is not unnamed buffer"""
         if self._swap_recovered:
+            self._swap_recovered = False
+            if not self._wait_for_copy(self._recovered_swap):
+                return
             vim.command('silent! recover! %s' % \
-                    self._recovered_swap.replace('%','\%'))
-            name = vim.current.buffer.name
-            match = re.search(self.buffer_pattern,\
-                    vim.current.buffer.name)
-            if not match:
+                    self._backup_file(self._recovered_swap).replace('%','\%'))
+            #don't overwrite file if there is no copy from before recovery
+            if not self._scratch_name(vim.current.buffer) and \
+                    self._wait_for_copy(self._recovered_file):
                 vim.command('write')
-            self._swap_recovered = False
+
+    def copy_backend(self):
+        """Print copy strategies detected for backup_dir and how many times
+each was used"""
+        print "Reco copy backend %s" % \
+                reco_copy.backend_for(self.backup_dir).describe()
+        if self._copy_cache is not None:
+            print "Reco copy cache: %d unchanged, %d copied" % \
+                    (self._copy_cache.hits,self._copy_cache.misses)
+
+    def compression_stats(self):
+        """Print compression ratio and time spent compressing backups and
+decompressing them for recovery"""
+        stats = reco_store.stats
+        ratio = float(stats['bytes_out']) / stats['bytes_in'] \
+                if stats['bytes_in'] else 1.0
+        print "Reco compression: %d files %d -> %d bytes (ratio %.2f) in "\
+                "%.3fs, %d decompressed in %.3fs" % (stats['compressed'],\
+                stats['bytes_in'],stats['bytes_out'],ratio,\
+                stats['compress_time'],stats['decompressed'],\
+                stats['decompress_time'])
+
+    def copy_cache_update(self):
+        """At CursorHold and FocusLost save finished copies to copy cache"""
+        if self._copy_cache is not None:
+            self._copy_cache.save()
+
+    def report_copy_errors(self):
+        """At CursorHold show backups which background copy failed to make"""
+        if self._copy_engine:
+            for job in self._copy_engine.failed():
+                self._echo_error('Reco: backup of %s failed: %s' % \
+                        (job.src,job.error))
 
     def badd_file_recover(self):
         """At BufAdd check if unnamed buffer added to buffer list, if yes first
-check if pid match vim instance pid if not then check for swap and if exists 
-copy swap to backup dir then remove swap and add swap from backup dir into 
-scratch_buffers_swaps list for recovery"""
-        last_buf_nr = int(vim.eval('bufnr("$")'))
-        buf = vim.buffers[last_buf_nr]
-        match = re.search(self.buffer_pattern,buf.name)
+check if pid match vim instance pid if not then check for swap in swap index
+and if exists copy swap to backup dir then remove swap and add swap from backup
+dir into scratch_buffers_swaps list for recovery. If dead Vim left scratch
+journal with this buffer and journal is not older than swap, its lines are
+replayed instead. Swap is still copied and removed only at replay"""
+        buf = vim.buffers[self._last_buf_nr()]
+        scratch = self._scratch_name(buf)
         pid = os.getpid().__str__()
-        if not self._vim_entered and match and match.group(2) != pid:
+        if not self._vim_entered and scratch and scratch.pid != pid:
             #get swapfile and move to backup dir and add to recovery
-            swapdirs = vim.eval('&dir').split(',')
-            for dir in swapdirs:
-                if dir is '.':
-                    name = "%s/.%s.swp"
-                else:
-                    name = "%s/%s.swp"
-                dir = os.path.abspath(os.path.expanduser(dir))
-                buf_name = os.path.basename(buf.name)
-                swap = name % (dir,buf_name)
-                if os.path.exists(swap):
-                    swap_file_path = "%s/%s" % \
-                            (os.path.expanduser(self.backup_dir),\
-                            swap.replace('/','%'))
-                    self._scratch_buffers_swaps.append(\
-                            (buf.name,swap_file_path))
+            swap = self._get_swap_index().lookup(os.path.basename(buf.name))
+            lines = self._scratch_replay(scratch.pid).get(\
+                    os.path.basename(buf.name))
+            if lines is not None and not self._pid_alive(scratch.pid) and \
+                    self._scratch_journal_newer(scratch.pid,swap):
+                swap_file_path = None
+                if swap:
+                    swap_file_path = self._backup_path(swap)
                     self._leave_cleanup.append(swap_file_path)
-                    shutil.copy2(swap,swap_file_path)
+                    self._queue_copy(swap,swap_file_path,True)
+                self._scratch_buffers_lines.append(\
+                        (buf.name,lines,swap,swap_file_path))
+            elif swap:
+                swap_file_path = self._backup_path(swap)
+                self._scratch_buffers_swaps.append(\
+                        (buf.name,swap_file_path))
+                self._leave_cleanup.append(swap_file_path)
+                #copy keeps swap open so it's safe to remove it now
+                if self._queue_copy(swap,swap_file_path,\
+                        not self._pid_alive(scratch.pid)):
                     os.remove(swap)
-                    #break after first swapfile found
-                    break
+                    self._swap_index.discard(swap)
 
     def diff_swap(self):
         """First check if orginal file exists if yes do diff on file before and
 after recovery"""
         file_path = vim.eval('expand("%:p")')
-        backup_filename = file_path.replace('/','%')
-        backup_file_path = "%s/%s" % (os.path.expanduser(self.backup_dir),\
-                backup_filename)
-        if os.path.exists(backup_file_path):
+        backup_file_path = self._backup_path(file_path)
+        self._wait_for_copy(backup_file_path)
+        self._touch_backup(backup_file_path)
+        backup_file_path = self._backup_file(backup_file_path)
+        if os.path.exists(backup_file_path) and \
+                self._diff_size(file_path,backup_file_path) >= \
+                self.diff_threshold:
+            self._start_diff(backup_file_path,file_path)
+        elif os.path.exists(backup_file_path):
             vim.command('silent! tabnew %s' % file_path)
             vim.command('silent! diffsplit %s' % \
                     backup_file_path.replace('%','\%'))
         else:
             print "You can't do diff_swap without file before recovery"
 
+    def diff_timer(self):
+        """Called by RecoDiffTimer, show diff_swap hunks when background diff
+is done otherwise check again later"""
+        self._diff_timer = None
+        if self._diff_job is None:
+            return
+        if self._diff_job.done():
+            self._show_diff()
+        else:
+            self._diff_timer = vim.eval("timer_start(100,'RecoDiffTimer')")
+
+    def diff_jump(self):
+        """<CR> in diff_swap hunks buffer, go to line of hunk under cursor in
+recovered file"""
+        jump = self._diff_jumps.get(vim.current.buffer.number)
+        if jump is None:
+            return
+        win_id,targets = jump
+        target = targets[vim.current.window.cursor[0] - 1]
+        if not int(vim.eval('win_gotoid(%s)' % win_id)):
+            vim.command('wincmd p')
+        vim.command('%d' % target)
+        vim.command('normal! zz')
+
     def before_recovery(self):
         """First check name of file in current window then if exists before
 recovery version of that file read that file into current window"""
-        backup_filename = vim.current.window.buffer.name.replace('/','%')
-        backup_file_path = "%s/%s" % (os.path.expanduser(self.backup_dir),\
-                backup_filename)
+        backup_file_path = self._backup_path(vim.current.window.buffer.name)
+        self._wait_for_copy(backup_file_path)
+        self._touch_backup(backup_file_path)
+        backup_file_path = self._backup_file(backup_file_path)
         if os.path.exists(backup_file_path):
 #First delete all text
             vim.command('%d')
@@ -197,12 +687,83 @@ recovery version of that file read that file into current window"""
             vim.command('0r %s' % backup_file_path.replace('%','\%'))
 
 #All private methods 
+    def _run_stages(self,event,instrumented=False):
+        previous, self._event = self._event, \
+                EventContext(event,EVENT_VALUES.get(event,()))
+        try:
+            for name,handler in self._stages.get(event,[]):
+                if name in self.disabled_stages:
+                    continue
+                if not instrumented:
+                    handler()
+                elif name == self.profile:
+                    self._get_profiler().runcall(self._stats.run,name,\
+                            handler)
+                else:
+                    self._stats.run(name,handler)
+        finally:
+            self._event = previous
+
+    def _get_stats(self):
+        """Stats start at first instrumented event"""
+        if self._stats is None:
+            self._stats = reco_stats.Stats()
+        return self._stats
+
+    def _get_profiler(self):
+        if self._profiler is None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+        return self._profiler
+
+    def _collect_stats(self):
+        """Add copy engine counters to stats, return report lines"""
+        if self._copy_engine:
+            self._stats.counters['copies'] = self._copy_engine.copies
+            self._stats.counters['bytes copied'] = \
+                    self._copy_engine.bytes_copied
+        return self._stats.report()
+
+    def _dump_stats(self):
+        """At VimLeave write stats json and profile if they were asked for"""
+        if self.stats_file and self._stats is not None:
+            self._collect_stats()
+            self._stats.dump(os.path.expanduser(self.stats_file))
+        if self._profiler is not None:
+            self._profiler.dump_stats(os.path.expanduser(self.profile_file or \
+                    "%s/reco_profile.%s" % (self.backup_dir,os.getpid())))
+
+    def _eval(self,expr):
+        """vim.eval, inside dispatch value is shared by all stages of event"""
+        if self._event is not None:
+            return self._event.eval(expr)
+        return vim.eval(expr)
+
+    def _memo(self,key,compute):
+        """compute(), inside dispatch result is kept for rest of event"""
+        if self._event is not None:
+            return self._event.memo(key,compute)
+        return compute()
+
+    def _backup_path(self,path):
+        """Backup of path in backup_dir, / in path is replaced by %"""
+        return "%s/%s" % (os.path.expanduser(self.backup_dir),\
+                path.replace('/','%'))
+
+    def _afile_backup_path(self):
+        """Backup path of <afile>, same for all stages of event"""
+        return self._memo('afile_backup',\
+                lambda: self._backup_path(self._eval(AFILE)))
+
+    def _last_buf_nr(self):
+        """Vim always add buffers to the end of buffer list"""
+        return int(self._eval(LAST_BUF))
+
     def _get_new_name(self):
         """Create new name for unnamed buffer"""
         new_name = "%s%s.%s" % (self.buffer_prefix,self._unnamed_counter,\
                 os.getpid())
-        match = re.search(self.buffer_pattern,new_name)
-        if match:
+        if self._get_names().scratch(new_name):
             self._unnamed_counter += 1
             return new_name
         else:
@@ -211,9 +772,10 @@ recovery version of that file read that file into current window"""
     def _set_name_if_unnamed_buffer(self,buf):
         """Check if buffer is unnamed and we are not loading session now, 
 if yes then set new name"""
-        if not buf.name and not int(vim.eval('&modified')) and \
-                not int(vim.eval("exists('g:SessionLoad')")):
+        if not buf.name and not int(self._eval(MODIFIED)) and \
+                not int(self._eval(SESSION_LOAD)):
             buf.name = self._get_new_name()
+            self._renamed(buf)
 
     def _update_unnamed_buffers(self):
         """Loop over buffers and set if no name"""
@@ -223,13 +785,12 @@ if yes then set new name"""
     def _update_pid(self,buf):
         """If buffer from previous session update pid and _buffers_counter 
 to match new session"""
-        match = re.search(self.buffer_pattern,buf.name)
-        if match:
-            new_name = "%s%s" % (match.group(1),os.getpid())
-            if new_name != buf.name:
-                buf.name = new_name
-                self._unnamed_counter += 1
-                vim.command('bwipeout %s' % match.string)
+        scratch = self._scratch_name(buf)
+        if scratch and scratch.pid != str(os.getpid()):
+            buf.name = "%s%s" % (scratch.prefix,os.getpid())
+            self._renamed(buf)
+            self._unnamed_counter += 1
+            vim.command('bwipeout %s' % scratch.name)
 
     def _update_pid_in_prev_session_buffers(self):
         """Update pid part in unnamed buffer name after session recovery"""
@@ -238,70 +799,472 @@ to match new session"""
 
     def _make_init_backup(self):
         """Do init backup and set init_backup flag = True"""
+        if self.journal and self._journal is None and \
+                self._journal_supported():
+            self._journal = reco_journal.Journal(\
+                    reco_journal.journal_path(self.backup_name))
+            self._leave_cleanup.append(self._journal.path)
+            self._all_au_for_update_backup_journal()
+        if self.scratch_journal and self._scratch_journal is None:
+            self._scratch_journal = reco_scratch.ScratchJournal(\
+                    reco_scratch.journal_path(self.backup_name))
+            self._leave_cleanup.append(self._scratch_journal.path)
+            self._text_changed_au_for_update_scratch_journal()
+            self._buf_wipeout_au_for_forget_scratch_buffer()
+        self._write_session_snapshot()
+        self._leave_cleanup.append(self.backup_name)
+        if self.daemon and self._get_copy_engine() is self._daemon:
+            self._daemon.register(os.getpid(),self.backup_name)
+        self._resume_cleanup()
+        self._register_session()
+        if self.retention:
+            #backups made before VimEnter can have paths indexed under pid of
+            #dead Vim, this Vim claims them before eviction starts
+            self._retain_backups()
+            self._get_retention().start_evict(pid=os.getpid())
+        self.init_backup = True
+
+    def _session_sourced(self):
+        """After Reco session of dead Vim was sourced recover its scratch
+buffers and give them pid of this Vim"""
+        if self._session_recovered():
+            self._scratch_buffers_recovery()
+            self._update_pid_in_prev_session_buffers()
+
+    def _get_registry(self):
+        if self._registry is None:
+            self._registry = reco_registry.Registry(self.backup_dir)
+        return self._registry
+
+    def _register_session(self):
+        """Add this Vim to registry and tell about sessions of dead Vims
+found there"""
+        if not self.registry:
+            return
+        orphans = self._get_registry().register(os.getpid(),\
+                self.backup_name,self._leave_cleanup,self._start)
+        self._registry_beat = time.time()
+        self._registry_backups = len(self._leave_cleanup)
+        if orphans:
+            vim.command("echomsg 'Reco: %d session(s) of dead Vim, restore "\
+                    "with :py reco.restore_session()'" % len(orphans))
+
+    def _get_retention(self):
+        if self._retention is None:
+            self._retention = reco_retention.RetentionStore(self.backup_dir,\
+                    self.retention_bytes,self.retention_files)
+        return self._retention
+
+    def _retain_backups(self,leave=False):
+        """Add backups which are not in retention store yet, at VimLeave all
+of them get final size and are taken from _leave_cleanup. Session backup
+and its journals are not kept. Return True if store is over quota"""
+        if not self.retention or self.dedup:
+            return False
+        session = set([self.backup_name,\
+                reco_journal.journal_path(self.backup_name),\
+                reco_scratch.journal_path(self.backup_name)])
+        paths = [os.path.expanduser(f) for f in self._leave_cleanup \
+                if f not in session and (leave or f not in self._retained)]
+        if not paths:
+            return False
+        store = self._get_retention()
+        store.add(paths,os.getpid())
+        self._retained.update(paths)
+        if leave:
+            for f in list(self._leave_cleanup):
+                if f not in session:
+                    self._leave_cleanup.discard(f)
+        return store.over_quota()
+
+    def _touch_backup(self,backup_file_path):
+        """Backup was used, it's evicted from retention store last"""
+        if self.retention:
+            self._get_retention().touch(backup_file_path,os.getpid())
+
+    def _write_session_snapshot(self):
+        """Write session backup and clear dirty flag. In journal mode this is
+checkpoint, journal is emptied first and session replays it when loaded"""
         backup_cmd = 'exe "mksession! %s"'
+        if self._journal is not None:
+            self._journal.reset()
         vim.command(backup_cmd % self.backup_name)
-        if self.backup_name not in self._leave_cleanup:
-            self._leave_cleanup.append(self.backup_name)
-        self.init_backup = True
+        if self._journal is not None:
+            reco_journal.append_footer(self.backup_name,self._journal.path)
+        self._session_dirty = False
+        self._last_snapshot = time.time()
+        self._snapshot_writes += 1
+        #all requests since last snapshot are covered by this one write
+        self._snapshot_coalesced += max(self._snapshot_pending - 1,0)
+        self._snapshot_pending = 0
+
+    def _schedule_snapshot(self,delay=None):
+        """Start RecoSnapshotTimer if Vim has timers and none is pending.
+Without timers snapshot is written at CursorHold"""
+        if self._snapshot_timer is not None or not self._has_snapshot_timer():
+            return
+        if delay is None:
+            delay = self.snapshot_delay
+        self._snapshot_timer = vim.eval(\
+                "timer_start(%d,'RecoSnapshotTimer')" % max(delay,1))
+
+    def _has_snapshot_timer(self):
+        """Check once if Vim has timers and RecoSnapshotTimer from reco.vim"""
+        if self._snapshot_timers is None:
+            self._snapshot_timers = bool(int(vim.eval(\
+                    "has('timers') && exists('*RecoSnapshotTimer')")))
+        return self._snapshot_timers
+
+    def _journal_supported(self):
+        """Journal replay needs winlayout() and window ids"""
+        return all(int(vim.eval("exists('*%s')" % name)) \
+                for name in reco_journal.REQUIRED)
+
+    def _ms_since(self,timestamp):
+        """Milliseconds since timestamp from time.time()"""
+        return (time.time() - timestamp) * 1000
 
     def _cleanup(self,cleanup_list):
         """check if file exists then try to remove each file in cleanup list,
-if some of files not exists just print messg in vim but continue."""
+if some of files not exists just print messg in vim but continue"""
         while cleanup_list:
             f = cleanup_list.pop()
-            if os.path.exists(os.path.expanduser(f)):
-                os.remove(os.path.expanduser(f))
+            reco_store.remove_backup(os.path.expanduser(f))
+
+    def _detach_cleanup(self):
+        """Hand _leave_cleanup to daemon or to helper through manifest so
+VimLeave doesn't wait for removing of backups"""
+        paths = [os.path.expanduser(f) for f in self._leave_cleanup]
+        self._leave_cleanup.clear()
+        if self._daemon is not None and self._daemon.cleanup(paths):
+            return
+        manifest = reco_cleanup.manifest_path(self.backup_dir,os.getpid())
+        try:
+            reco_cleanup.write_manifest(manifest,paths)
+        except (IOError,OSError):
+            self._cleanup(paths)
+            return
+        if not self.cleanup_detach or not reco_cleanup.detach(manifest):
+            reco_cleanup.run(manifest,self.cleanup_workers,\
+                    self.cleanup_deadline)
+
+    def _resume_cleanup(self):
+        """Finish cleanups of Vims which quit before their backups were
+removed, in background"""
+        reco_cleanup.resume(self.backup_dir,os.getpid(),self.cleanup_workers)
 
     def _session_recovered(self):
         sess_name = vim.eval('v:this_session')
-        match = re.search(self.backup_pattern,sess_name)
-        if match:
+        if self._get_names().session_pid(sess_name) is not None:
             os.remove(sess_name)
+            for journal in (reco_journal.journal_path(sess_name),\
+                    reco_scratch.journal_path(sess_name)):
+                if os.path.exists(journal):
+                    os.remove(journal)
             return True
         return False
 
     def _copy_file_to_backup_dir(self):
         """First create backup location path then copy file before recovery"""
-        file_path = vim.eval('expand("<afile>:p:h")')
-        filename = vim.eval('expand("<afile>:t")')
-        full_path = "%s/%s" % (file_path,filename)
-        backup_filename = vim.eval(\
-                'expand("<afile>:p")').replace('/','%')
-        backup_file_path = "%s/%s" % (os.path.expanduser(self.backup_dir),\
-                backup_filename)
-        if os.path.exists(full_path) and full_path not in self._leave_cleanup:
+        full_path = "%s/%s" % (self._eval(AFILE_HEAD),self._eval(AFILE_TAIL))
+        backup_file_path = self._afile_backup_path()
+        self._recovered_file = None
+        if os.path.exists(full_path):
             self._leave_cleanup.append(backup_file_path)
-            shutil.copy2(full_path,backup_file_path)
+            self._recovered_file = backup_file_path
+            self._cached_copy(full_path,backup_file_path,cold=True)
 
     def _copy_swapfile_to_backup_dir(self):
         """Create backup_path and copy swapfile there"""
-        backup_filename = vim.eval(\
-                'expand("<afile>:p")').replace('/','%')
-        swapname = vim.eval('v:swapname')
-        swap_filename = "%s.swp" % backup_filename
-        swap_file_path = "%s/%s" % (os.path.expanduser(self.backup_dir),\
-                swap_filename.replace('/','%'))
-        if swap_file_path not in self._leave_cleanup:
-            self._leave_cleanup.append(swap_file_path)
+        swapname = self._eval(SWAPNAME)
+        owner = self._eval(SWAP_OWNER)
+        swap_file_path = "%s.swp" % self._afile_backup_path()
+        self._leave_cleanup.append(swap_file_path)
         self._recovered_swap = swap_file_path
-        shutil.copy2(swapname,swap_file_path)
+        if self._stager is not None and \
+                self._stager.claim(swapname,swap_file_path):
+            if self.copy_cache:
+                cache = self._get_copy_cache()
+                cache.add(swapname,swap_file_path,cache.key(swapname))
+            return
+        #swap of dead Vim is only removed after recovery so it can be linked
+        self._cached_copy(swapname,swap_file_path,\
+                int(owner) > 0 and not self._pid_alive(owner))
+
+    def _diff_size(self,file_path,backup_file_path):
+        """Size of bigger of both files for choosing diff_swap mode"""
+        sizes = [os.path.getsize(path) for path in \
+                (file_path,backup_file_path) if os.path.exists(path)]
+        return max(sizes)
+
+    def _start_diff(self,before,after):
+        """Diff in background, hunks are shown by RecoDiffTimer. Without
+timers wait for diff here, Vim is still blocked but only till diff_timeout"""
+        self._diff_job = reco_diff.DiffJob(before,after,self.diff_timeout)
+        if self._diff_timer is None and int(vim.eval(\
+                "has('timers') && exists('*RecoDiffTimer')")):
+            print "Reco: diff of %s is running" % after
+            self._diff_timer = vim.eval("timer_start(100,'RecoDiffTimer')")
+        elif self._diff_timer is None:
+            self._diff_job.wait()
+            self._show_diff()
+
+    def _show_diff(self):
+        """Open recovered file in new tab with hunks summary above it, <CR>
+on summary line jumps to hunk and ]c [c move between hunks"""
+        job, self._diff_job = self._diff_job, None
+        if job.error is not None:
+            self._echo_error('Reco: diff of %s failed: %s' % \
+                    (job.after,job.error))
+            return
+        lines,targets = job.summary()
+        header = 'Reco diff: %d hunks between %s and recovered %s in '\
+                '%.2fs' % (len(job.hunks),job.before,job.after,job.seconds)
+        if job.timed_out:
+            header += ', timed out so hunks are not minimal'
+        vim.command('silent! tabnew %s' % job.after)
+        win_id = vim.eval('win_getid()')
+        vim.command("exe 'silent! topleft %dnew' fnameescape('%s')" % \
+                (min(len(lines) + 1,15),('reco-diff:%s' % \
+                os.path.basename(job.after)).replace("'","''")))
+        buf = vim.current.buffer
+        for option,value in (('buftype','nofile'),('bufhidden','wipe'),\
+                ('swapfile',False)):
+            buf.options[option] = value
+        buf[:] = [header] + lines
+        buf.options['modifiable'] = False
+        self._diff_jumps[buf.number] = (win_id,[targets[0] if targets \
+                else 1] + targets)
+        vim.command('nnoremap <buffer> <silent> <CR> '\
+                ':python reco.diff_jump()<CR>')
+        for key,flags in ((']c','W'),('[c','bW')):
+            vim.command("nnoremap <buffer> <silent> %s "\
+                    ":call search('^@@','%s')<CR>" % (key,flags))
+
+    def _get_names(self):
+        """Classifier for buffer_pattern and backup_pattern, made again only
+if patterns were changed"""
+        if self._names is None or self._names.patterns != \
+                (self.buffer_pattern,self.backup_pattern):
+            self._names = reco_names.NameClassifier(self.buffer_pattern,\
+                    self.backup_pattern)
+        return self._names
+
+    def _scratch_name(self,buf):
+        """ScratchName of buffer or None, cached by buffer number and name"""
+        return self._get_names().scratch(buf.name,buf.number)
+
+    def _renamed(self,buf):
+        """Buffer got new name, Vim doesn't run BufFilePost for names set
+by Reco inside auto-command"""
+        self._get_names().forget(buf.number)
+        if self._buffer_index is not None:
+            self._buffer_index.add(buf.number,buf.name)
+        tracked = self._scratch_tracked.get(buf.number)
+        if tracked is not None and tracked[0] is not None:
+            #buffer is recorded whole under new name at its next change
+            self._scratch_journal.forget(tracked[0])
+            tracked[0] = None
+
+    def _get_buffer_index(self):
+        """Build index of buffer names at first lookup"""
+        if self._buffer_index is None:
+            self._buffer_index = reco_names.BufferIndex(\
+                    (buf.number,buf.name) for buf in vim.buffers)
+            self._buffer_index_fresh = True
+        return self._buffer_index
+
+    def _buffer_by_name(self,name):
+        """Buffer with name or None, index is built again if it missed
+some change but only once in recovery batch"""
+        for rebuild in (False,True):
+            if rebuild:
+                if self._buffer_index_fresh:
+                    break
+                self._buffer_index = None
+            nr = self._get_buffer_index().lookup(name)
+            if nr is None:
+                continue
+            try:
+                buf = vim.buffers[nr]
+            except KeyError:
+                continue
+            if buf.name == name:
+                return buf
+        return None
+
+    def _get_swap_index(self):
+        """List all 'directory' entries once at first lookup"""
+        if self._swap_index is None:
+            self._swap_index = reco_swap.SwapIndex(\
+                    vim.eval('&dir').split(','))
+        return self._swap_index
+
+    def _get_copy_engine(self):
+        """Start copy engine at first backup, daemon client if daemon is on
+and running"""
+        if self._copy_engine is None:
+            if self.daemon:
+                self._daemon = reco_daemon.connect(self.backup_dir,\
+                        self._local_copy_engine)
+            self._copy_engine = self._daemon or self._local_copy_engine()
+        return self._copy_engine
+
+    def _local_copy_engine(self):
+        if self.dedup:
+            self._store = reco_store.BlobStore(self.backup_dir)
+        return reco_copy.CopyEngine(self.copy_workers,self.copy_queue_size,\
+                self._store)
+
+    def _backup_file(self,backup_file_path):
+        """Real file for backup, blob if backup_file_path is dedup ref"""
+        return reco_store.resolve(backup_file_path)
+
+    def _queue_copy(self,src,dst,link=False,cold=False):
+        """Queue copy of src to dst in background, source is already opened
+when this returns. Return False if src can't be opened"""
+        return self._submit_copy(src,dst,link,cold).error is None
+
+    def _cached_copy(self,src,dst,link=False,cold=False):
+        """Same as _queue_copy but copy is skipped if copy cache knows dst is
+backup of src which didn't change since"""
+        if not self.copy_cache:
+            return self._queue_copy(src,dst,link,cold)
+        cache = self._get_copy_cache()
+        key = cache.key(src)
+        if cache.unchanged(src,dst,key) and self._hold_backup(dst):
+            return True
+        job = self._submit_copy(src,dst,link,cold)
+        cache.add(src,dst,key,job)
+        return job.error is None
+
+    def _hold_backup(self,dst):
+        """With dedup reused backup is ref, its blob is held by this session
+same as after copy. Daemon holds blobs itself, so then backup is copied"""
+        if not self.dedup:
+            return True
+        self._get_copy_engine()
+        return self._store is not None and self._store.hold(dst)
+
+    def _submit_copy(self,src,dst,link=False,cold=False):
+        return self._get_copy_engine().submit(src,dst,link,\
+                self._get_compressor(cold))
+
+    def _get_copy_cache(self):
+        if self._copy_cache is None:
+            self._copy_cache = reco_cache.CopyCache(self.backup_dir,\
+                    self.copy_cache_checksum)
+        return self._copy_cache
+
+    def _get_compressor(self,cold=False):
+        """Compressor for backup or None if compression is off"""
+        if not self.compression:
+            return None
+        method = self.compression if cold else 'zlib'
+        if method not in self._compressors:
+            self._compressors[method] = reco_store.Compressor(method)
+        return self._compressors[method]
+
+    def _pid_alive(self,pid):
+        """Check if process with pid still exists"""
+        return reco_swap.pid_alive(pid)
+
+    def _wait_for_copy(self,dst):
+        """Wait only for background copy to dst, report if it failed"""
+        if dst is None or self._copy_engine is None:
+            return True
+        job = self._copy_engine.job(dst)
+        if job is None or job.wait():
+            return True
+        self.report_copy_errors()
+        return False
+
+    def _echo_error(self,msg):
+        vim.command("echohl ErrorMsg | echomsg '%s' | echohl None" % \
+                msg.replace("'","''"))
+
+    def _track_scratch(self,buf):
+        """Record all lines of scratch buffer and add listener for its next
+changes if Vim has listeners"""
+        tracked = self._scratch_tracked.setdefault(buf.number,[None,None])
+        tracked[0] = os.path.basename(buf.name)
+        self._scratch_journal.record(tracked[0],buf[:])
+        if tracked[1] is None and self._has_scratch_listener():
+            tracked[1] = vim.eval("listener_add('RecoScratchChanged',%d)" % \
+                    buf.number)
+
+    def _has_scratch_listener(self):
+        """Check once if Vim has listener_add() and RecoScratchChanged"""
+        if self._scratch_listeners is None:
+            self._scratch_listeners = bool(int(vim.eval(\
+                    "exists('*listener_add') && "\
+                    "exists('*RecoScratchChanged')")))
+        return self._scratch_listeners
+
+    def _scratch_journal_path(self,pid):
+        return reco_scratch.journal_path("%s/%s.%s" % \
+                (self.backup_dir,self.backup_prefix,pid))
+
+    def _scratch_replay(self,pid):
+        """Lines of scratch buffers from journal of Vim with pid, journal is
+read once"""
+        if pid not in self._scratch_replays:
+            self._scratch_replays[pid] = reco_scratch.replay(\
+                    self._scratch_journal_path(pid))
+        return self._scratch_replays[pid]
+
+    def _scratch_journal_newer(self,pid,swap):
+        """Journal of pid can replace swap only if it was written after swap,
+changes which didn't reach journal before crash are only in swap"""
+        if not swap:
+            return True
+        try:
+            return os.path.getmtime(self._scratch_journal_path(pid)) >= \
+                    os.path.getmtime(swap)
+        except OSError:
+            return False
 
     def _scratch_buffers_recovery(self):
-        """Loop over scratch buffers swaps list, pop item and recover"""
-        modified = False
+        """Recover all scratch buffers swaps in one batch, buffers are found
+in buffer index. Buffers from scratch journal get their lines without swap.
+Current buffer and its modified flag are only touched if there is something
+to recover"""
+        if not self._scratch_buffers_swaps and \
+                not self._scratch_buffers_lines:
+            return
+        swaps, self._scratch_buffers_swaps = self._scratch_buffers_swaps, []
+        replayed, self._scratch_buffers_lines = \
+                self._scratch_buffers_lines, []
+        self._scratch_replays = {}
+        self._buffer_index_fresh = False
         cur_nr = vim.current.buffer.number
-        if self._scratch_buffers_swaps and \
-            vim.current.buffer.options['modified']:
+        modified = vim.current.buffer.options['modified']
+        if modified:
             vim.current.buffer.options['modified'] = False
-            modified = True
-
-        while self._scratch_buffers_swaps:
-            name,swap = self._scratch_buffers_swaps.pop()
-            for buf in vim.buffers:
-                if buf.name == name:
-                    nr = buf.number
-            vim.current.buffer = vim.buffers[nr]
-            vim.command('silent! recover! %s' % swap.replace('%','\%'))
+        for name,swap in reversed(swaps):
+            buf = self._buffer_by_name(name)
+            if buf is None or not self._wait_for_copy(swap):
+                continue
+            vim.current.buffer = buf
+            vim.command('silent! recover! %s' % \
+                    self._backup_file(swap).replace('%','\%'))
+        for name,lines,swap,swap_file_path in reversed(replayed):
+            buf = self._buffer_by_name(name)
+            if buf is None:
+                continue
+            if swap:
+                #swap goes only when its copy is safe, otherwise buffer is
+                #recovered from swap at SwapExists as usual
+                if not self._wait_for_copy(swap_file_path):
+                    continue
+                try:
+                    os.remove(swap)
+                except OSError:
+                    pass
+                if self._swap_index is not None:
+                    self._swap_index.discard(swap)
+            vim.current.buffer = buf
+            buf[:] = lines
         vim.current.buffer = vim.buffers[cur_nr]
         if modified:
             vim.current.buffer.options['modified'] = True
@@ -311,16 +1274,24 @@ if some of files not exists just print messg in vim but continue."""
     def setup_auto_commands(self):
         """Add all auto-commands at once"""
         self._add_auto_group_reco()
+        self._buf_file_post_buffer_renamed()
         self._buf_add_check_last_buffer_name()
+        self._buf_add_buffer_added()
         self._buf_add_increment_buffers_counter()
         self._buf_unload_decrement_buffers_counter()
         self._all_au_for_update_backup_session()
+        self._all_au_for_flush_backup_session()
+        self._cursor_hold_au_for_report_copy_errors()
+        self._cursor_hold_au_for_copy_cache_update()
+        self._cursor_hold_au_for_registry_heartbeat()
+        self._cursor_hold_au_for_retention_update()
         self._vim_enter_au_for_vim_enter_buffers_check()
         self._vim_leave_au_for_vim_leave_buffers_check()
         self._swap_exists_au_for_swapcmd()
         self._file_recovery_au()
         self._buf_win_enter_check_swapfile_au()
         self._buf_add_file_recover()
+        self._buf_add_vim_enter_prestage_swaps()
         self._buf_write_post_check_filename_after_write()
 
     def _add_auto_group_reco(self):
@@ -329,50 +1300,91 @@ if some of files not exists just print messg in vim but continue."""
     def _remove_auto_group_reco(self):
         """Remove whole auto group Reco"""
         vim.command('au! Reco')
+        self._stages = {}
     
+    def _add_stage(self,events,stage):
+        """Add stage to pipeline of each event, Vim calls only one dispatch
+au per event which runs all stages in order they were added"""
+        for event in events.split(','):
+            if event not in self._stages:
+                self._stages[event] = []
+                vim.command(self._add_au_cmd % \
+                        (event,"reco.dispatch('%s')" % event))
+            if stage not in [name for name,handler in self._stages[event]]:
+                self._stages[event].append((stage,getattr(self,stage)))
+
+    def _buf_file_post_buffer_renamed(self):
+        self._add_stage('BufFilePost','buffer_renamed')
+
     def _buf_write_post_check_filename_after_write(self):
         """If unnamed buffer after write set buffer name = filename"""
-        vim.command(self._add_au_cmd % \
-                ('BufWritePost','reco.check_filename_after_write()'))
+        self._add_stage('BufWritePost','check_filename_after_write')
 
     def _buf_add_file_recover(self):
-        vim.command(self._add_au_cmd % \
-                ('BufAdd','reco.badd_file_recover()'))
+        self._add_stage('BufAdd','badd_file_recover')
+
+    def _buf_add_vim_enter_prestage_swaps(self):
+        self._add_stage('BufAdd,VimEnter','prestage_swaps')
+
+    def _buf_add_buffer_added(self):
+        self._add_stage('BufAdd','buffer_added')
 
     def _buf_add_check_last_buffer_name(self):
-        vim.command(self._add_au_cmd % \
-                ('BufAdd','reco.check_last_buffer_name()'))
+        self._add_stage('BufAdd','check_last_buffer_name')
 
     def _buf_add_increment_buffers_counter(self):
-        vim.command(self._add_au_cmd % \
-                ('BufAdd','reco.increment_buffers_counter()'))
+        self._add_stage('BufAdd','increment_buffers_counter')
 
     def _buf_unload_decrement_buffers_counter(self):
-        vim.command(self._add_au_cmd % \
-                ('BufUnload','reco.decrement_buffers_counter()'))
+        self._add_stage('BufUnload','decrement_buffers_counter')
 
     def _all_au_for_update_backup_session(self):
-        """Set BufWinEnter,BufWinLeave,BufAdd,BufUnload backup_session au"""
-        vim.command(self._add_au_cmd % \
-                ('BufAdd,BufWinEnter,BufWinLeave',\
-                'reco.update_backup_session()'))
+        """Set BufWinEnter,BufWinLeave,BufAdd backup_session au"""
+        self._add_stage('BufAdd,BufWinEnter,BufWinLeave',\
+                'update_backup_session')
+
+    def _all_au_for_update_backup_journal(self):
+        """Set journal au, only added at VimEnter if journal is on"""
+        self._add_stage('BufAdd,BufDelete,BufWinEnter,WinEnter,TabEnter',\
+                'update_backup_journal')
+
+    def _text_changed_au_for_update_scratch_journal(self):
+        """Set scratch journal au, only added if scratch_journal is on"""
+        self._add_stage('TextChanged,TextChangedI','update_scratch_journal')
+
+    def _buf_wipeout_au_for_forget_scratch_buffer(self):
+        self._add_stage('BufWipeout','forget_scratch_buffer')
+
+    def _all_au_for_flush_backup_session(self):
+        """Set CursorHold,CursorHoldI,FocusLost flush_backup_session au"""
+        self._add_stage('CursorHold,CursorHoldI,FocusLost',\
+                'flush_backup_session')
+
+    def _cursor_hold_au_for_report_copy_errors(self):
+        self._add_stage('CursorHold,CursorHoldI','report_copy_errors')
+
+    def _cursor_hold_au_for_copy_cache_update(self):
+        self._add_stage('CursorHold,CursorHoldI,FocusLost',\
+                'copy_cache_update')
+
+    def _cursor_hold_au_for_registry_heartbeat(self):
+        self._add_stage('CursorHold,CursorHoldI,FocusLost',\
+                'registry_heartbeat')
+
+    def _cursor_hold_au_for_retention_update(self):
+        self._add_stage('CursorHold,CursorHoldI,FocusLost','retention_update')
 
     def _vim_enter_au_for_vim_enter_buffers_check(self):
-        vim.command(self._add_au_cmd % \
-                ('VimEnter','reco.vim_enter_buffers_check()'))
+        self._add_stage('VimEnter','vim_enter_buffers_check')
 
     def _vim_leave_au_for_vim_leave_buffers_check(self):
-        vim.command(self._add_au_cmd % \
-                ('VimLeave','reco.vim_leave_buffers_check()'))
+        self._add_stage('VimLeave','vim_leave_buffers_check')
 
     def _swap_exists_au_for_swapcmd(self):
-        vim.command('au Reco SwapExists * \
-                v:swapcommand = :python reco.swapcmd()')
+        self._add_stage('SwapExists','swapcmd')
 
     def _file_recovery_au(self):
-        vim.command(self._add_au_cmd % \
-                ('BufWinEnter','reco.file_recovery()'))
+        self._add_stage('BufWinEnter','file_recovery')
 
     def _buf_win_enter_check_swapfile_au(self):
-        vim.command(self._add_au_cmd % \
-                ('BufFilePost,BufWinEnter','reco.check_swapfile()'))
+        self._add_stage('BufFilePost,BufWinEnter','check_swapfile')
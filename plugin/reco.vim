@@ -6,6 +6,7 @@
 "
 " ============================================================================
 let s:path = expand("<sfile>:p:h")
+let s:backup_prefix = "vim_backup" " backup_name = <backup_prefix>.<pid>
 function! Reco()
 python << EOF
 import sys
@@ -14,10 +15,33 @@ import os
 sys.path.append(vim.eval('s:path'))
 import reco as _reco_module
 backup_dir = "~/.vim/backup" #if not set default backup dir is home folder
-backup_prefix = "vim_backup" # backup_name = <backup_prefix>.<pid>
+backup_prefix = vim.eval('s:backup_prefix') # set at top of reco.vim
 buffer_prefix = "scratch" # buffer_name = <buffer_prefix><buffer_nr>.<pid>
 nofile = False # default False , more about buffer types and nofile :help 'bt'
 reco = _reco_module.Reco(backup_dir,backup_prefix,buffer_prefix)
 EOF
 endfunction
-call Reco()
+function! RecoSnapshotTimer(timer)
+python reco.snapshot_timer()
+endfunction
+function! RecoDiffTimer(timer)
+python reco.diff_timer()
+endfunction
+function! RecoScratchChanged(bufnr,start,end,added,changes)
+python reco.scratch_changed()
+endfunction
+" let g:reco_lazy = 1 in vimrc starts Reco at first need, see :help reco-lazy
+if get(g:,'reco_lazy',0)
+    if empty(globpath(&rtp,'autoload/reco.vim'))
+        exe 'set rtp+=' . fnameescape(fnamemodify(s:path,':h'))
+    endif
+    augroup RecoLazy
+        au!
+        au SwapExists * call reco#load('SwapExists')
+        exe 'au SourcePre ' . s:backup_prefix . ".[0-9]* call reco#load('SourcePre')"
+        au VimEnter * au RecoLazy BufAdd * call reco#load('BufAdd')
+        au VimEnter * au RecoLazy CursorHold * call reco#load('CursorHold')
+    augroup END
+else
+    call Reco()
+endif
@@ -0,0 +1,138 @@
+# ============================================================================
+# File:        reco_cache.py
+# Description: Cache of Reco backups by source metadata, copy of source which
+#              didn't change since its backup was made is skipped
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import zlib
+import reco_index
+import reco_store
+
+INDEX_NAME = 'reco_cache.json'
+LOCK_NAME = 'reco_cache.lock'
+CHECKSUM_CHUNK = 1024 * 1024
+
+def stat_key(path):
+    """(dev,inode,size,mtime_ns) of path. Python 2 has only float mtime, so
+key made by Python 2 doesn't match one made by Python 3, that only costs a
+copy"""
+    st = os.stat(path)
+    mtime = getattr(st,'st_mtime_ns',None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    return (st.st_dev,st.st_ino,st.st_size,mtime)
+
+def checksum(path):
+    """crc32 of content, catches change which kept size and mtime i.e. on
+filesystem with coarse mtime"""
+    crc = 0
+    with open(path,'rb') as f:
+        while True:
+            data = f.read(CHECKSUM_CHUNK)
+            if not data:
+                break
+            crc = zlib.crc32(data,crc)
+    return crc & 0xffffffff
+
+class CopyCache(reco_index.JsonIndex):
+    def __init__(self,backup_dir,checksum=False):
+        """(backup_dir,checksum) : index is <backup_dir>/reco_cache.json,
+backup path -> [source,dev,inode,size,mtime_ns,crc32]. With checksum
+crc32 of source is part of key, otherwise it's None. Index is read once,
+changes are merged into it under lock file by save()"""
+        reco_index.JsonIndex.__init__(self,backup_dir,INDEX_NAME,LOCK_NAME)
+        self.checksum = checksum
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        #dst -> (src,key,job) for copies which are not finished yet
+        self._pending = {}
+        #dst -> entry or None for removed entry, not saved yet
+        self._changed = {}
+
+    def read(self):
+        """Entries from index, empty if it doesn't exist or is broken"""
+        entries = {}
+        values = self._load()
+        for value in values if isinstance(values,list) else ():
+            try:
+                dst,src,dev,ino,size,mtime,crc = value
+                entries[dst] = (src,(int(dev),int(ino),int(size),int(mtime),\
+                        None if crc is None else int(crc)))
+            except (TypeError,ValueError):
+                continue
+        return entries
+
+    def key(self,src):
+        """Key of src now or None if it can't be read"""
+        try:
+            return stat_key(src) + \
+                    (checksum(src) if self.checksum else None,)
+        except (IOError,OSError):
+            return None
+
+    def unchanged(self,src,dst,key):
+        """True if dst is backup of src with key, also when copy is still
+running. Backup must still exist in any form reco_store reads"""
+        hit = False
+        if key is not None:
+            pending = self._pending.get(dst)
+            if pending is not None:
+                hit = pending[:2] == (src,key) and \
+                        (pending[2] is None or pending[2].error is None)
+            else:
+                hit = self._get_entries().get(dst) == (src,key) and \
+                        reco_store.backup_exists(dst)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    def add(self,src,dst,key,job=None):
+        """Copy of src with key to dst was submitted as job, it's cached when
+job finished without error. job None means dst is already there"""
+        self._get_entries().pop(dst,None)
+        self._changed[dst] = None
+        if key is not None:
+            self._pending[dst] = (src,key,job)
+
+    def save(self):
+        """Merge finished copies into index, entries which backups are gone
+are dropped. Return False if there was nothing to save"""
+        self._settle()
+        if not self._changed:
+            return False
+        with self._update() as entries:
+            for dst,entry in self._changed.items():
+                if entry is None:
+                    entries.pop(dst,None)
+                else:
+                    entries[dst] = entry
+            for dst in list(entries):
+                if not reco_store.backup_exists(dst):
+                    del entries[dst]
+        self._changed = {}
+        self._entries = entries
+        return True
+
+    def _get_entries(self):
+        if self._entries is None:
+            self._entries = self.read()
+        return self._entries
+
+    def _settle(self):
+        for dst,(src,key,job) in list(self._pending.items()):
+            if job is not None and not job.done():
+                continue
+            del self._pending[dst]
+            if job is None or job.error is None:
+                self._get_entries()[dst] = (src,key)
+                self._changed[dst] = (src,key)
+
+    def _dump(self,entries):
+        return [[dst,src] + list(key) for dst,(src,key) in entries.items()]
@@ -0,0 +1,232 @@
+# ============================================================================
+# File:        reco_cleanup.py
+# Description: Cleanup of Reco backups after Vim quits. Paths are written to
+#              manifest in backup_dir and removed by detached helper, cleanup
+#              which didn't finish is resumed by next Reco.
+#              Run: python reco_cleanup.py <manifest>...
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import re
+import sys
+import json
+import time
+import errno
+import threading
+import subprocess
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import reco_store
+import reco_swap
+
+MANIFEST_PREFIX = 'reco_cleanup'
+MANIFEST_PATTERN = re.compile(r'^%s\.(\d+)$' % MANIFEST_PREFIX)
+
+class CleanupSet(object):
+    """Backups to remove at VimLeave in order they were added, each path
+only once. append and pop as list so it can be used instead of one"""
+    def __init__(self,paths=()):
+        self._paths = OrderedDict()
+        for path in paths:
+            self.append(path)
+
+    def append(self,path):
+        self._paths[path] = None
+
+    def discard(self,path):
+        self._paths.pop(path,None)
+
+    def pop(self):
+        """Remove and return last added path"""
+        return self._paths.popitem()[0]
+
+    def clear(self):
+        self._paths.clear()
+
+    def __contains__(self,path):
+        return path in self._paths
+
+    def __iter__(self):
+        return iter(list(self._paths))
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __bool__(self):
+        return bool(self._paths)
+    __nonzero__ = __bool__
+
+def manifest_path(backup_dir,pid):
+    return os.path.join(backup_dir,'%s.%d' % (MANIFEST_PREFIX,int(pid)))
+
+def write_manifest(path,paths):
+    """Write paths to manifest, manifest is replaced in one rename so helper
+never reads half of it"""
+    tmp = '%s.tmp' % path
+    with open(tmp,'w') as f:
+        json.dump(list(paths),f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp,path)
+
+def read_manifest(path):
+    """Paths in manifest, empty list if it's gone or broken"""
+    try:
+        with open(path) as f:
+            paths = json.load(f)
+    except (IOError,OSError,ValueError):
+        return []
+    return [path for path in paths if isinstance(path,type(u''))] \
+            if isinstance(paths,list) else []
+
+def _remove(path):
+    """Remove backup, file removed by someone else meanwhile is not error"""
+    try:
+        reco_store.remove_backup(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def _inside(path,directory):
+    return os.path.dirname(os.path.abspath(path)) == directory or \
+            os.path.abspath(path).startswith(directory + os.sep)
+
+def _lock(manifest):
+    """Open manifest with lock held, None if it's gone or other helper is
+working on it. Lock is released when returned file is closed"""
+    try:
+        f = open(manifest)
+    except (IOError,OSError):
+        return None
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(),fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError,OSError):
+            f.close()
+            return None
+    return f
+
+def run(manifest,workers=4,deadline=None):
+    """Remove paths of manifest by workers threads. Only paths in manifest
+directory are removed. Manifest is removed when all are done, after deadline
+seconds workers stop and manifest keeps paths not removed yet. Manifest is
+locked meanwhile, manifest locked by other helper is left to it. Return number
+of paths left"""
+    locked = _lock(manifest)
+    if locked is None:
+        return len(read_manifest(manifest))
+    try:
+        return _run(manifest,workers,deadline)
+    finally:
+        locked.close()
+
+def _run(manifest,workers,deadline):
+    directory = os.path.dirname(os.path.abspath(manifest))
+    paths = [path for path in read_manifest(manifest) \
+            if _inside(path,directory)]
+    end = None if deadline is None else time.time() + deadline
+    lock = threading.Lock()
+    left = list(reversed(paths))
+    def worker():
+        while end is None or time.time() < end:
+            with lock:
+                if not left:
+                    return
+                path = left.pop()
+            try:
+                _remove(path)
+            except OSError:
+                pass
+    threads = [threading.Thread(target=worker) \
+            for i in range(max(1,min(workers,len(paths))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join(None if end is None else max(end - time.time(),0) + 1)
+    with lock:
+        left = list(reversed(left))
+    try:
+        if left:
+            write_manifest(manifest,left)
+        else:
+            os.remove(manifest)
+    except OSError:
+        pass
+    return len(left)
+
+def python_executable():
+    """Python interpreter for helper or None, in Vim sys.executable is often
+Vim itself"""
+    if os.path.basename(sys.executable or '').startswith('python'):
+        return sys.executable
+    names = ['python%d.%d' % sys.version_info[:2],\
+            'python%d' % sys.version_info[0],'python']
+    for name in names:
+        for directory in os.environ.get('PATH',os.defpath).split(os.pathsep):
+            path = os.path.join(directory,name)
+            if os.path.isfile(path) and os.access(path,os.X_OK):
+                return path
+    return None
+
+def detach(manifest,python=None):
+    """Start helper which removes paths of manifest in own session so it
+outlives Vim, return False if there is no python to run it"""
+    python = python or python_executable()
+    if python is None:
+        return False
+    script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    with open(os.devnull,'r+') as devnull:
+        try:
+            subprocess.Popen([python,script,manifest],stdin=devnull,\
+                    stdout=devnull,stderr=devnull,close_fds=True,\
+                    cwd=os.path.dirname(manifest),preexec_fn=os.setsid)
+        except OSError:
+            return False
+    return True
+
+def interrupted(backup_dir,pid=None):
+    """Manifests of Vims which are gone, without pid's own. Manifest locked
+by detached helper which still works on it is not interrupted"""
+    manifests = []
+    for name in reco_swap.list_dir(backup_dir):
+        match = MANIFEST_PATTERN.match(name)
+        if match is None or int(match.group(1)) == pid or \
+                reco_swap.pid_alive(match.group(1)):
+            continue
+        locked = _lock(os.path.join(backup_dir,name))
+        if locked is None:
+            continue
+        locked.close()
+        manifests.append(os.path.join(backup_dir,name))
+    return sorted(manifests)
+
+def resume(backup_dir,pid=None,workers=4):
+    """Finish interrupted cleanups in background thread, return it or None
+if there is nothing to do"""
+    manifests = interrupted(backup_dir,pid)
+    if not manifests:
+        return None
+    def cleanup():
+        for manifest in manifests:
+            run(manifest,workers)
+    thread = threading.Thread(target=cleanup)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def main(argv=None):
+    manifests = sys.argv[1:] if argv is None else argv
+    if not manifests:
+        sys.stderr.write('usage: reco_cleanup.py <manifest>...\n')
+        return 2
+    return 1 if sum(run(manifest) for manifest in manifests) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,397 @@
+# ============================================================================
+# File:        reco_copy.py
+# Description: Background copy engine for Reco backups
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import sys
+import errno
+import tempfile
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+CHUNK_SIZE = 1024 * 1024
+#ioctl from linux/fs.h, clone whole file from fd (btrfs, XFS with reflink=1)
+FICLONE = 0x40049409
+#errors which mean strategy is not supported here, try next one
+UNSUPPORTED = (errno.EXDEV,errno.EINVAL,errno.ENOSYS,errno.EOPNOTSUPP,\
+        errno.ENOTTY,errno.EBADF,errno.EPERM)
+
+class CopyCancelled(Exception):
+    pass
+
+def _libc_function(name,restype,argtypes):
+    """Function from libc through ctypes, for Pythons without os wrapper"""
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        func = getattr(libc,name)
+    except (ImportError,OSError,AttributeError):
+        return None
+    func.restype = restype
+    func.argtypes = argtypes
+
+    def call(*args):
+        result = func(*args)
+        if result < 0:
+            err = ctypes.get_errno()
+            raise OSError(err,os.strerror(err))
+        return result
+    return call
+
+def _reflink(source,target,size,cancelled):
+    import fcntl
+    fcntl.ioctl(target.fileno(),FICLONE,source.fileno())
+
+def _kernel_loop(copy_chunk):
+    """Copy with copy_chunk(in_fd,out_fd,count) until size is copied"""
+    def copy(source,target,size,cancelled):
+        done = 0
+        while done < size:
+            if cancelled():
+                raise CopyCancelled(source.name)
+            sent = copy_chunk(source.fileno(),target.fileno(),\
+                    min(CHUNK_SIZE * 8,size - done))
+            if sent == 0:
+                break
+            done += sent
+    return copy
+
+def _copy_file_range_chunk():
+    if hasattr(os,'copy_file_range'):
+        return lambda in_fd,out_fd,count: \
+                os.copy_file_range(in_fd,out_fd,count)
+    import ctypes
+    func = _libc_function('copy_file_range',ctypes.c_ssize_t,\
+            [ctypes.c_int,ctypes.c_void_p,ctypes.c_int,ctypes.c_void_p,\
+            ctypes.c_size_t,ctypes.c_uint])
+    if func is None:
+        return None
+    return lambda in_fd,out_fd,count: func(in_fd,None,out_fd,None,count,0)
+
+def _sendfile_chunk():
+    if hasattr(os,'sendfile'):
+        return lambda in_fd,out_fd,count: os.sendfile(out_fd,in_fd,None,count)
+    import ctypes
+    func = _libc_function('sendfile',ctypes.c_ssize_t,\
+            [ctypes.c_int,ctypes.c_int,ctypes.c_void_p,ctypes.c_size_t])
+    if func is None:
+        return None
+    return lambda in_fd,out_fd,count: func(out_fd,in_fd,None,count)
+
+def _userspace(source,target,size,cancelled):
+    while True:
+        if cancelled():
+            raise CopyCancelled(source.name)
+        buf = source.read(CHUNK_SIZE)
+        if not buf:
+            break
+        target.write(buf)
+
+def _strategies():
+    """All copy strategies in order of preference, fastest first"""
+    strategies = []
+    if sys.platform.startswith('linux'):
+        strategies.append(('reflink',_reflink))
+        chunk = _copy_file_range_chunk()
+        if chunk:
+            strategies.append(('copy_file_range',_kernel_loop(chunk)))
+        chunk = _sendfile_chunk()
+        if chunk:
+            strategies.append(('sendfile',_kernel_loop(chunk)))
+    strategies.append(('userspace',_userspace))
+    return strategies
+
+class CopyBackend(object):
+    """Copy strategies which work in directory, detected once by probing"""
+    def __init__(self,directory):
+        self.directory = directory
+        self.strategies = []
+        self.can_link = False
+        self.used = {}
+        self._lock = threading.Lock()
+        self._detect()
+
+    def names(self):
+        return [name for name,copy in self.strategies]
+
+    def describe(self):
+        used = ', '.join('%s %d' % item for item in sorted(self.used.items()))
+        return '%s: %s, hardlink for swaps: %s%s' % (self.directory,\
+                ' > '.join(self.names()),'yes' if self.can_link else 'no',\
+                ' (used: %s)' % used if used else '')
+
+    def copy(self,source,target,size,cancelled=lambda: False):
+        """Copy opened source into opened empty target, first strategy which
+works wins. Return name of used strategy"""
+        for name,copy in self.strategies:
+            try:
+                copy(source,target,size,cancelled)
+            except (IOError,OSError) as e:
+                if e.errno not in UNSUPPORTED or name == 'userspace':
+                    raise
+                #i.e. reflink between two filesystems, start again
+                source.seek(0)
+                target.seek(0)
+                target.truncate()
+                continue
+            with self._lock:
+                self.used[name] = self.used.get(name,0) + 1
+            return name
+
+    def link(self,src,dst):
+        """Hardlink src as dst, only for sources which are never modified in
+place. Return False if it's not possible"""
+        if not self.can_link:
+            return False
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.link(src,dst)
+        except OSError:
+            return False
+        with self._lock:
+            self.used['hardlink'] = self.used.get('hardlink',0) + 1
+        return True
+
+    def _detect(self):
+        """Probe each strategy on small temp files in directory"""
+        data = b'reco probe' * 64
+        try:
+            fd,probe = tempfile.mkstemp(prefix='.reco_probe',\
+                    dir=self.directory)
+        except (IOError,OSError):
+            self.strategies = [('userspace',_userspace)]
+            return
+        try:
+            os.write(fd,data)
+            os.close(fd)
+            for name,copy in _strategies():
+                target_name = probe + '.copy'
+                try:
+                    with open(probe,'rb') as source:
+                        with open(target_name,'wb') as target:
+                            copy(source,target,len(data),lambda: False)
+                    with open(target_name,'rb') as target:
+                        if target.read() == data:
+                            self.strategies.append((name,copy))
+                except (IOError,OSError):
+                    pass
+                finally:
+                    if os.path.exists(target_name):
+                        os.remove(target_name)
+            try:
+                os.link(probe,probe + '.link')
+                os.remove(probe + '.link')
+                self.can_link = True
+            except OSError:
+                pass
+        finally:
+            os.remove(probe)
+        if not self.strategies:
+            self.strategies = [('userspace',_userspace)]
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def backend_for(directory):
+    """Return CopyBackend for directory, capabilities are detected only at
+first call for each directory"""
+    directory = os.path.abspath(directory)
+    with _backends_lock:
+        if directory not in _backends:
+            _backends[directory] = CopyBackend(directory)
+        return _backends[directory]
+
+class CopyJob(object):
+    """One copy from src to dst. Source is opened when job is created so
+copy still works if src is removed or renamed before worker gets to it"""
+    def __init__(self,src,dst,after=None,store=None,compressor=None):
+        self.src = src
+        self.dst = dst
+        self.after = after
+        self.store = store
+        self.compressor = compressor
+        self.error = None
+        self.strategy = None
+        self.bytes_copied = 0
+        self._done = threading.Event()
+        self._cancelled = False
+        try:
+            self._source = open(src,'rb')
+        except (IOError,OSError) as e:
+            self._source = None
+            self.error = e
+            self._done.set()
+
+    def wait(self,timeout=None):
+        """Block until copy is finished, return True if it was successful"""
+        self._done.wait(timeout)
+        return self._done.is_set() and self.error is None
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Worker stops at next chunk and removes partial copy"""
+        self._cancelled = True
+
+    def run(self):
+        try:
+            try:
+                if self.after is not None:
+                    #previous copy to same dst must not interleave with ours
+                    self.after.wait()
+                    self.after = None
+                self._copy()
+            except Exception as e:
+                self.error = e
+                for dst in [self.dst,self._compressed_dst()]:
+                    if dst and os.path.exists(dst):
+                        os.remove(dst)
+        finally:
+            self._source.close()
+            self._done.set()
+
+    def _compressed_dst(self):
+        if self.compressor is None or self.store is not None:
+            return None
+        return self.dst + self.compressor.ext
+
+    def linked(self):
+        """Job was done by hardlink, there is nothing to copy"""
+        self.strategy = 'hardlink'
+        self.bytes_copied = 0
+        self._source.close()
+        self._done.set()
+
+    def _copy(self):
+        """Copy data with best backend for dst then mode and times, same as
+shutil.copy2"""
+        st = os.fstat(self._source.fileno())
+        backend = backend_for(os.path.dirname(self.dst))
+        if self.store is not None:
+            self.strategy = self.store.put(self._source,self.dst,backend,\
+                    lambda: self._cancelled,self.compressor)
+            self.bytes_copied = 0 if self.strategy == 'dedup' else st.st_size
+            return
+        dst = self.dst
+        if self.compressor is not None:
+            backend = self.compressor
+            dst += self.compressor.ext
+            #plain copy from earlier backup would be found first
+            if os.path.exists(self.dst):
+                os.remove(self.dst)
+        with open(dst,'wb') as target:
+            self.strategy = backend.copy(self._source,target,st.st_size,\
+                    lambda: self._cancelled)
+        self.bytes_copied = st.st_size
+        os.chmod(dst,st.st_mode & 0o7777)
+        os.utime(dst,(st.st_atime,st.st_mtime))
+
+class CopyEngine(object):
+    def __init__(self,workers=2,queue_size=32,store=None):
+        """(workers,queue_size,store) :
+workers -> number of threads doing copies
+queue_size -> max number of jobs waiting for worker, submit blocks when queue
+    is full
+store -> optional reco_store.BlobStore, then dst is written as ref to
+    deduplicated blob"""
+        self.workers = workers
+        self.store = store
+        self._queue = queue.Queue(queue_size)
+        self.copies = 0
+        self.bytes_copied = 0
+        self._jobs = {}
+        self._failed = []
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self,src,dst,link=False,compressor=None,store=None):
+        """Queue copy of src to dst and return CopyJob, it's also available
+by dst path from job(dst). If src can't be opened job is returned already
+failed and is not queued. With link=True src is hardlinked when backup_dir
+allows it, only use it for files which are removed but never rewritten
+i.e. swaps of dead Vim. With compressor dst is written compressed by it,
+see reco_store.Compressor. store is used instead of engine store for this
+job"""
+        store = store or self.store
+        with self._lock:
+            old_job = self._jobs.get(dst)
+            if old_job is not None and old_job.done():
+                old_job = None
+            job = CopyJob(src,dst,old_job,store,compressor)
+            self._jobs[dst] = job
+            if job.done():
+                self._failed.append(job)
+                return job
+            if link and old_job is None and store is None and \
+                    compressor is None and \
+                    backend_for(os.path.dirname(dst)).link(src,dst):
+                job.linked()
+                return job
+        self._start_workers()
+        self._queue.put(job)
+        return job
+
+    def job(self,dst):
+        """Return CopyJob for dst or None if dst was never submitted"""
+        with self._lock:
+            return self._jobs.get(dst)
+
+    def wait(self,dst,timeout=None):
+        """Wait only for copy to dst, True if copy is done or there was no
+copy for that path"""
+        job = self.job(dst)
+        if job is None:
+            return True
+        return job.wait(timeout)
+
+    def failed(self):
+        """Return and forget failed jobs, cancelled copies are not failures"""
+        with self._lock:
+            failed, self._failed = self._failed, []
+        return failed
+
+    def pending(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.done()]
+
+    def shutdown(self,cancel=False):
+        """Stop workers after queued jobs, with cancel=True unfinished copies
+are stopped and removed"""
+        if cancel:
+            for job in self.pending():
+                job.cancel()
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            job.run()
+            with self._lock:
+                if job.error is None:
+                    self.copies += 1
+                    self.bytes_copied += job.bytes_copied
+                elif not isinstance(job.error,CopyCancelled):
+                    self._failed.append(job)
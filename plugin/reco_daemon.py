@@ -0,0 +1,525 @@
+# ============================================================================
+# File:        reco_daemon.py
+# Description: Backup daemon shared by all Vim instances of one user, Reco
+#              sends it copy and cleanup jobs over Unix socket in backup_dir.
+#              Run: python reco_daemon.py --help
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import argparse
+import threading
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+import reco_copy
+import reco_store
+import reco_swap
+
+SOCKET_NAME = 'reco_daemon.sock'
+DEFAULT_BACKUP_DIR = '~/.vim/backup'
+
+class DaemonError(Exception):
+    pass
+
+def socket_path(backup_dir):
+    return os.path.join(os.path.abspath(os.path.expanduser(backup_dir)),\
+            SOCKET_NAME)
+
+def _send(sock_file,message):
+    sock_file.write(json.dumps(message).encode('utf-8') + b'\n')
+    sock_file.flush()
+
+def _receive(sock_file):
+    line = sock_file.readline()
+    if not line:
+        raise EOFError('connection closed')
+    return json.loads(line.decode('utf-8'))
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One connection is one Reco instance, requests are json lines"""
+    def handle(self):
+        client = {'pid':None,'jobs':{},'reported':set()}
+        self.server.daemon.connected(self.connection,1)
+        try:
+            while True:
+                try:
+                    request = _receive(self.rfile)
+                except (EOFError,ValueError,socket.error):
+                    break
+                try:
+                    reply = self.server.daemon.handle(request,client)
+                except Exception as e:
+                    reply = {'failure':'%s: %s' % (type(e).__name__,e)}
+                try:
+                    _send(self.wfile,reply)
+                except socket.error:
+                    break
+        finally:
+            self.server.daemon.connected(self.connection,-1)
+
+class _Server(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Daemon(object):
+    def __init__(self,backup_dir,workers=4,queue_size=64,dedup=False):
+        """(backup_dir,workers,queue_size,dedup) :
+backup_dir -> Reco backup_dir, socket is <backup_dir>/reco_daemon.sock
+workers,queue_size -> copy engine shared by all Reco instances
+dedup -> store backups in reco_store.BlobStore, one session per Vim pid"""
+        self.backup_dir = os.path.abspath(os.path.expanduser(backup_dir))
+        self.path = socket_path(backup_dir)
+        self.dedup = dedup
+        self.engine = reco_copy.CopyEngine(workers,queue_size)
+        self.sessions = {}
+        self.stats = {'copies':0,'deduplicated':0,'cleanups':0,\
+                'removed':0,'clients':0}
+        self.clients = 0
+        self.last_active = time.time()
+        self._stores = {}
+        self._compressors = {}
+        #number of clients sharing queued copy to dst
+        self._sharing = {}
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._cleanup_threads = []
+
+    def start(self):
+        """Listen on socket, stale socket of dead daemon is removed. Raise
+DaemonError if other daemon already serves backup_dir"""
+        if not os.path.isdir(self.backup_dir):
+            os.makedirs(self.backup_dir)
+        if os.path.exists(self.path):
+            client = connect(self.backup_dir)
+            if client is not None:
+                client.close()
+                raise DaemonError('daemon already running on %s' % self.path)
+            os.remove(self.path)
+        umask = os.umask(0o077)
+        try:
+            self._server = _Server(self.path,_Handler)
+        finally:
+            os.umask(umask)
+        self._server.daemon = self
+        thread = threading.Thread(target=self._server.serve_forever,\
+                args=(0.1,))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving and close connections of clients, they go on without
+daemon. Queued copies and cleanups are finished first"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        for thread in self._cleanup_threads:
+            thread.join()
+        self.engine.shutdown()
+
+    def serve(self,idle_exit=None):
+        """Serve until stop request or until there was no client and no
+pending job for idle_exit seconds"""
+        while self._server is not None:
+            time.sleep(0.2)
+            with self._lock:
+                idle = self.clients == 0 and not self.engine.pending() and \
+                        time.time() - self.last_active
+            if idle_exit is not None and idle and idle > idle_exit:
+                self.stop()
+
+    def connected(self,connection,change):
+        with self._lock:
+            self.clients += change
+            self.last_active = time.time()
+            if change > 0:
+                self.stats['clients'] += 1
+                self._connections.add(connection)
+            else:
+                self._connections.discard(connection)
+
+    def handle(self,request,client):
+        """Reply for one request of client, client is state of connection"""
+        op = request.get('op')
+        if op == 'hello':
+            client['pid'] = request['pid']
+            return {'pid':os.getpid()}
+        if op == 'copy':
+            return self._copy(request,client)
+        if op == 'wait':
+            job = client['jobs'].get(request['dst'])
+            if job is None:
+                return {'done':True,'error':None}
+            job.wait(request.get('timeout'))
+            return {'done':job.done(),'error':_error(job)}
+        if op == 'failed':
+            failed = []
+            for dst,job in client['jobs'].items():
+                if job.done() and _error(job) and dst not in \
+                        client['reported'] and \
+                        not isinstance(job.error,reco_copy.CopyCancelled):
+                    client['reported'].add(dst)
+                    failed.append({'src':job.src,'dst':dst,\
+                            'error':_error(job)})
+            return {'failed':failed}
+        if op == 'pending':
+            return {'pending':[dst for dst,job in client['jobs'].items() \
+                    if not job.done()]}
+        if op == 'cancel':
+            self._cancel(client)
+            return {}
+        if op == 'cleanup':
+            self._cleanup(request['paths'],client)
+            return {}
+        if op == 'register':
+            with self._lock:
+                self.sessions[str(request['pid'])] = {\
+                        'pid':request['pid'],'session':request['session'],\
+                        'started':request.get('started',time.time())}
+            return {}
+        if op == 'sessions':
+            with self._lock:
+                sessions = [dict(info,alive=reco_swap.pid_alive(info['pid'])) \
+                        for info in self.sessions.values()]
+            return {'sessions':sorted(sessions,key=lambda s: s['started'])}
+        if op == 'stats':
+            done = [job for job in client['jobs'].values() \
+                    if job.done() and job.error is None]
+            with self._lock:
+                stats = dict(self.stats,clients_connected=self.clients,\
+                        pending=len(self.engine.pending()))
+            return {'stats':stats,'copies':len(done),\
+                    'bytes_copied':sum(job.bytes_copied for job in done)}
+        if op == 'stop':
+            threading.Thread(target=self.stop).start()
+            return {}
+        return {'failure':'unknown op %s' % op}
+
+    def _copy(self,request,client):
+        """Same as CopyEngine.submit, source is opened before reply. Copy of
+same src to same dst which is still queued is shared"""
+        src,dst = request['src'],request['dst']
+        job = self.engine.job(dst)
+        if job is not None and not job.done() and job.src == src:
+            with self._lock:
+                self.stats['deduplicated'] += 1
+                self._sharing[dst] = self._sharing.get(dst,1) + 1
+        else:
+            job = self.engine.submit(src,dst,request.get('link',False),\
+                    self._compressor(request.get('compression')),\
+                    self._store(client['pid']))
+            with self._lock:
+                self.stats['copies'] += 1
+                self._sharing[dst] = 1
+        client['jobs'][dst] = job
+        client['reported'].discard(dst)
+        return {'error':_error(job) if job.done() else None}
+
+    def _store(self,pid):
+        if not self.dedup:
+            return None
+        with self._lock:
+            if pid not in self._stores:
+                self._stores[pid] = reco_store.BlobStore(self.backup_dir,pid)
+            return self._stores[pid]
+
+    def _compressor(self,method):
+        if not method:
+            return None
+        with self._lock:
+            if method not in self._compressors:
+                self._compressors[method] = reco_store.Compressor(method)
+            return self._compressors[method]
+
+    def _cancel(self,client):
+        """Cancel unfinished copies of client which no other client shares,
+return them"""
+        jobs = []
+        with self._lock:
+            for dst,job in client['jobs'].items():
+                if job.done():
+                    continue
+                if self._sharing.get(dst,1) > 1:
+                    self._sharing[dst] -= 1
+                else:
+                    job.cancel()
+                    jobs.append(job)
+        return jobs
+
+    def _cleanup(self,paths,client):
+        """Remove backups in background, unfinished copies of client are
+cancelled first. Session of client is forgotten"""
+        jobs = self._cancel(client)
+        pid = client['pid']
+        with self._lock:
+            self.sessions.pop(str(pid),None)
+            store = self._stores.pop(pid,None)
+        def cleanup():
+            for job in jobs:
+                job.wait()
+            removed = sum(1 for path in paths \
+                    if reco_store.remove_backup(os.path.expanduser(path)))
+            if store is not None:
+                store.release()
+            with self._lock:
+                self.stats['cleanups'] += 1
+                self.stats['removed'] += removed
+        thread = threading.Thread(target=cleanup)
+        thread.start()
+        self._cleanup_threads = [t for t in self._cleanup_threads \
+                if t.is_alive()] + [thread]
+
+def _error(job):
+    return str(job.error) if job.error is not None else None
+
+class RemoteJob(object):
+    """CopyJob done by daemon"""
+    def __init__(self,client,src,dst,error=None):
+        self.client = client
+        self.src = src
+        self.dst = dst
+        self.error = error
+        self._done = error is not None
+
+    def wait(self,timeout=None):
+        if not self._done:
+            reply = self.client._call(op='wait',dst=self.dst,timeout=timeout)
+            if reply is None:
+                self.error = DaemonError('daemon is gone')
+                self._done = True
+            else:
+                self._done = reply['done']
+                if reply['error']:
+                    self.error = DaemonError(reply['error'])
+        return self._done and self.error is None
+
+    def done(self):
+        if not self._done:
+            self.wait(0)
+        return self._done
+
+class Client(object):
+    """Same interface as reco_copy.CopyEngine, jobs are done by daemon.
+When daemon is gone jobs go to local engine from fallback()"""
+    def __init__(self,path,fallback):
+        self.path = path
+        self.fallback = fallback
+        self._engine = None
+        self._file = None
+        self._sock = None
+        self._jobs = {}
+
+    def connect(self):
+        """Return True if daemon answered hello"""
+        try:
+            self._sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+            self._sock.connect(self.path)
+            self._file = self._sock.makefile('rwb')
+        except socket.error:
+            self.close()
+            return False
+        return self._call(op='hello',pid=os.getpid()) is not None
+
+    def close(self):
+        for item in (self._file,self._sock):
+            if item is not None:
+                try:
+                    item.close()
+                except socket.error:
+                    pass
+        self._file = self._sock = None
+
+    @property
+    def connected(self):
+        return self._file is not None
+
+    def submit(self,src,dst,link=False,compressor=None):
+        if self.connected:
+            reply = self._call(op='copy',src=src,dst=dst,link=link,\
+                    compression=compressor.method if compressor else None)
+            if reply is not None:
+                error = reply['error']
+                job = RemoteJob(self,src,dst,\
+                        IOError(error) if error else None)
+                self._jobs[dst] = job
+                return job
+        self._jobs.pop(dst,None)
+        return self._local().submit(src,dst,link,compressor)
+
+    def job(self,dst):
+        if dst in self._jobs:
+            return self._jobs[dst]
+        if self._engine is not None:
+            return self._engine.job(dst)
+        return None
+
+    def wait(self,dst,timeout=None):
+        job = self.job(dst)
+        if job is None:
+            return True
+        return job.wait(timeout)
+
+    def failed(self):
+        failed = []
+        if self.connected:
+            reply = self._call(op='failed')
+            for item in reply['failed'] if reply else []:
+                job = self._jobs.get(item['dst'])
+                if job is not None:
+                    job.error = IOError(item['error'])
+                    job._done = True
+                    failed.append(job)
+        if self._engine is not None:
+            failed += self._engine.failed()
+        return failed
+
+    def pending(self):
+        pending = []
+        if self.connected:
+            reply = self._call(op='pending')
+            pending = [self._jobs[dst] for dst in \
+                    (reply['pending'] if reply else []) if dst in self._jobs]
+        if self._engine is not None:
+            pending += self._engine.pending()
+        return pending
+
+    def shutdown(self,cancel=False):
+        if cancel and self.connected:
+            self._call(op='cancel')
+        if self._engine is not None:
+            self._engine.shutdown(cancel)
+
+    def cleanup(self,paths):
+        """Daemon removes paths in background and forgets session, return
+False if daemon is gone"""
+        if not self.connected and not self.connect():
+            return False
+        return self._call(op='cleanup',paths=paths) is not None
+
+    def register(self,pid,session):
+        return self._call(op='register',pid=pid,session=session) is not None
+
+    def sessions(self):
+        reply = self._call(op='sessions')
+        return reply['sessions'] if reply else []
+
+    def stats(self):
+        return self._call(op='stats')
+
+    @property
+    def copies(self):
+        reply = self.stats()
+        local = self._engine.copies if self._engine else 0
+        return (reply['copies'] if reply else 0) + local
+
+    @property
+    def bytes_copied(self):
+        reply = self.stats()
+        local = self._engine.bytes_copied if self._engine else 0
+        return (reply['bytes_copied'] if reply else 0) + local
+
+    def _local(self):
+        if self._engine is None:
+            self._engine = self.fallback()
+        return self._engine
+
+    def _call(self,**request):
+        """Send request and return reply, None if daemon is gone. Daemon which
+failed request is left too, so Vim goes on with local engine instead of
+getting traceback"""
+        if not self.connected:
+            return None
+        try:
+            _send(self._file,request)
+            reply = _receive(self._file)
+        except (EOFError,ValueError,IOError,OSError,socket.error):
+            self.close()
+            return None
+        if 'failure' in reply:
+            self.close()
+            return None
+        return reply
+
+def connect(backup_dir,fallback=None):
+    """Client for daemon of backup_dir or None if it's not running"""
+    path = socket_path(backup_dir)
+    if not os.path.exists(path):
+        return None
+    client = Client(path,fallback or reco_copy.CopyEngine)
+    if not client.connect():
+        return None
+    return client
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reco backup daemon, '\
+            'copies and cleanups of all Vim instances which use same '\
+            'backup_dir go through it. Set reco.daemon = 1 in Vim.')
+    parser.add_argument('--backup-dir',default=DEFAULT_BACKUP_DIR)
+    parser.add_argument('-j','--jobs',type=int,default=4,\
+            help='copy workers shared by all Vims')
+    parser.add_argument('--dedup',action='store_true',\
+            help='store same content only once, see reco.dedup')
+    parser.add_argument('--idle-exit',type=float,default=None,\
+            help='exit after this many seconds without Vim')
+    parser.add_argument('--sessions',action='store_true',\
+            help='list Vim sessions of running daemon')
+    parser.add_argument('--stats',action='store_true',\
+            help='print stats of running daemon')
+    parser.add_argument('--stop',action='store_true',\
+            help='stop running daemon')
+    options = parser.parse_args(argv)
+    if options.sessions or options.stats or options.stop:
+        client = connect(options.backup_dir)
+        if client is None:
+            print('reco daemon is not running for %s' % options.backup_dir)
+            return 1
+        if options.sessions:
+            for info in client.sessions():
+                print('%s %s %s' % (info['pid'],'alive' if info['alive'] \
+                        else 'dead',info['session']))
+        if options.stats:
+            print(json.dumps(client.stats()['stats'],indent=1,\
+                    sort_keys=True))
+        if options.stop:
+            client._call(op='stop')
+        return 0
+    daemon = Daemon(options.backup_dir,options.jobs,dedup=options.dedup)
+    try:
+        daemon.start()
+    except DaemonError as e:
+        print('reco daemon: %s' % e,file=sys.stderr)
+        return 1
+    except socket.error as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        print('reco daemon: %s is in use' % daemon.path,file=sys.stderr)
+        return 1
+    print('reco daemon %d serving %s' % (os.getpid(),daemon.path))
+    try:
+        daemon.serve(options.idle_exit)
+    except KeyboardInterrupt:
+        daemon.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# ============================================================================
+# File:        reco_diff.py
+# Description: Line diff in background thread for DiffSwap of big files
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import mmap
+import time
+import threading
+
+#lines of each side shown for one hunk in summary
+HUNK_LINES = 3
+
+class DiffTimeout(Exception):
+    pass
+
+def read_lines(path):
+    """Lines of file as bytes without new line, file is memory mapped so
+it's not read twice into memory"""
+    with open(path,'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            lines = []
+            line = data.readline()
+            while line:
+                lines.append(line.rstrip(b'\r\n'))
+                line = data.readline()
+            return lines
+        finally:
+            data.close()
+
+def diff(a,b,timeout=None):
+    """Myers diff of sequences a and b in linear space. Return (hunks,
+timed_out), hunk is (a_start,a_count,b_start,b_count) with 0 based starts.
+After timeout every part which is not diffed yet is one hunk, so hunks are
+still correct only not minimal"""
+    deadline = time.time() + timeout if timeout is not None else None
+    #compare small ints instead of lines
+    ids = {}
+    a = [ids.setdefault(line,len(ids)) for line in a]
+    b = [ids.setdefault(line,len(ids)) for line in b]
+    matches = []
+    timed_out = False
+    stack = [(0,len(a),0,len(b))]
+    while stack:
+        alo,ahi,blo,bhi = stack.pop()
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            matches.append((start,blo - (alo - start),alo - start))
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if end > ahi:
+            matches.append((ahi,bhi,end - ahi))
+        if alo == ahi or blo == bhi or timed_out:
+            continue
+        try:
+            split = _bisect(a,alo,ahi,b,blo,bhi,deadline)
+        except DiffTimeout:
+            timed_out = True
+            continue
+        if split is not None:
+            x,y = split
+            stack.append((x,ahi,y,bhi))
+            stack.append((alo,x,blo,y))
+    matches.sort()
+    hunks = []
+    ai = bi = 0
+    for ma,mb,count in matches + [(len(a),len(b),0)]:
+        if ma > ai or mb > bi:
+            hunks.append((ai,ma - ai,bi,mb - bi))
+        ai,bi = ma + count,mb + count
+    return hunks,timed_out
+
+def _bisect(a,alo,ahi,b,blo,bhi,deadline):
+    """Find middle snake of a[alo:ahi] and b[blo:bhi], walking from both
+ends with two arrays of diagonals. Return split point or None if ranges have
+nothing in common"""
+    n = ahi - alo
+    m = bhi - blo
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    length = 2 * max_d + 2
+    v1 = [-1] * length
+    v1[offset + 1] = 0
+    v2 = v1[:]
+    delta = n - m
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if deadline is not None and time.time() > deadline:
+            raise DiffTimeout()
+        for k1 in range(-d + k1start,d + 1 - k1end,2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[alo + x1] == b[blo + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < length and v2[k2_offset] != -1 and \
+                        x1 >= n - v2[k2_offset]:
+                    return alo + x1,blo + y1
+        for k2 in range(-d + k2start,d + 1 - k2end,2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and \
+                    a[ahi - 1 - x2] == b[bhi - 1 - y2]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return alo + x1,blo + y1
+    return None
+
+def summary(hunks,a,b,hunk_lines=HUNK_LINES):
+    """Lines of hunk summary and for each of them line in b to jump to.
+Lines are bytes same as a and b"""
+    lines = []
+    targets = []
+    for a_start,a_count,b_start,b_count in hunks:
+        target = max(b_start + 1,1) if b_count else max(b_start,1)
+        lines.append(('@@ -%d,%d +%d,%d @@' % (a_start + 1,a_count,\
+                b_start + 1,b_count)).encode('ascii'))
+        targets.append(target)
+        for sign,side,start,count in ((b'-',a,a_start,a_count),\
+                (b'+',b,b_start,b_count)):
+            for i in range(start,start + min(count,hunk_lines)):
+                lines.append(sign + side[i])
+                targets.append(target + i - start if side is b else target)
+            if count > hunk_lines:
+                lines.append(('%s ... %d more lines' % (sign.decode('ascii'),\
+                        count - hunk_lines)).encode('ascii'))
+                targets.append(target)
+    return lines,targets
+
+class DiffJob(object):
+    def __init__(self,before,after,timeout=None):
+        """(before,after,timeout) :
+before,after -> paths of files to diff, both are read and diffed in
+    background thread
+timeout -> seconds for diff, then rest is reported as big hunks"""
+        self.before = before
+        self.after = after
+        self.timeout = timeout
+        self.hunks = None
+        self.timed_out = False
+        self.error = None
+        self.seconds = 0.0
+        self.before_lines = self.after_lines = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self,timeout=None):
+        """Block until diff is finished, True if it was successful"""
+        self._done.wait(timeout)
+        return self._done.is_set() and self.error is None
+
+    def summary(self,hunk_lines=HUNK_LINES):
+        return summary(self.hunks,self.before_lines,self.after_lines,\
+                hunk_lines)
+
+    def _run(self):
+        start = time.time()
+        try:
+            self.before_lines = read_lines(self.before)
+            self.after_lines = read_lines(self.after)
+            self.hunks,self.timed_out = diff(self.before_lines,\
+                    self.after_lines,self.timeout)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.seconds = time.time() - start
+            self._done.set()
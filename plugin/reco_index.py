@@ -0,0 +1,65 @@
+# ============================================================================
+# File:        reco_index.py
+# Description: Json index file in backup_dir shared by all Vim instances,
+#              base of Reco registry, retention store and copy cache
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import json
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class JsonIndex(object):
+    def __init__(self,backup_dir,index_name,lock_name):
+        """(backup_dir,index_name,lock_name) : index is
+<backup_dir>/<index_name>. Updates hold <backup_dir>/<lock_name> and replace
+index with rename, so reader never sees half written index. Subclass turns
+json into entries in read() and entries back into json in _dump()"""
+        self.backup_dir = os.path.abspath(os.path.expanduser(backup_dir))
+        self.path = os.path.join(self.backup_dir,index_name)
+        self.lock_path = os.path.join(self.backup_dir,lock_name)
+        self.writes = 0
+
+    def read(self):
+        raise NotImplementedError
+
+    def _dump(self,entries):
+        raise NotImplementedError
+
+    def _load(self):
+        """Json of index, None if it doesn't exist or is broken"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError,OSError,ValueError):
+            return None
+
+    @contextmanager
+    def _update(self):
+        """Read, change and write index under lock"""
+        if not os.path.isdir(self.backup_dir):
+            try:
+                os.makedirs(self.backup_dir)
+            except OSError:
+                #other Vim created it first
+                if not os.path.isdir(self.backup_dir):
+                    raise
+        with open(self.lock_path,'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(),fcntl.LOCK_EX)
+            entries = self.read()
+            yield entries
+            self._write(entries)
+
+    def _write(self,entries):
+        tmp = '%s.%d.tmp' % (self.path,os.getpid())
+        with open(tmp,'w') as f:
+            json.dump(self._dump(entries),f,sort_keys=True)
+        os.rename(tmp,self.path)
+        self.writes += 1
@@ -0,0 +1,147 @@
+# ============================================================================
+# File:        reco_journal.py
+# Description: Append-only layout journal for Reco sessions
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+
+#journal of session <backup_name> is <backup_name>.journal
+EXT = '.journal'
+#journal is Vim script, records are one line each and use these functions
+HEADER = r'''" Reco layout journal, sourced at the end of Reco session
+function! s:Buffer(name)
+  return exists('*bufadd') ? bufadd(a:name) : bufnr(a:name,1)
+endfunction
+function! s:Window(node)
+  if a:node[0] ==# 'leaf'
+    if a:node[1] !=# ''
+      exe 'silent! buffer' s:Buffer(a:node[1])
+    endif
+    return
+  endif
+  let ids = [win_getid()]
+  for child in a:node[1][1:]
+    exe 'silent! belowright' (a:node[0] ==# 'row' ? 'vsplit' : 'split')
+    call add(ids,win_getid())
+  endfor
+  for i in range(len(ids))
+    call win_gotoid(ids[i])
+    call s:Window(a:node[1][i])
+  endfor
+endfunction
+function! s:Layout(tab,tabs,layout,current,sizes)
+  while tabpagenr('$') < a:tabs
+    silent! $tabnew
+  endwhile
+  while tabpagenr('$') > a:tabs
+    silent! $tabclose!
+  endwhile
+  exe 'silent! tabnext' a:tab
+  silent! only!
+  call s:Window(a:layout)
+  silent! exe a:sizes
+  exe 'silent!' a:current 'wincmd w'
+endfunction
+'''
+#appended to session after each checkpoint, SessionLoad stops Reco from
+#naming buffers created by replay
+FOOTER = '''let SessionLoad = 1
+if filereadable(%(path)s)
+  exe 'source' fnameescape(%(path)s)
+endif
+unlet SessionLoad
+'''
+#Vim functions needed by HEADER
+REQUIRED = ('winlayout','win_getid','win_gotoid')
+
+def journal_path(session):
+    return session + EXT
+
+def vim_literal(value):
+    """Vim expression for string or nested list of strings"""
+    if isinstance(value,(list,tuple)):
+        return '[%s]' % ','.join(vim_literal(item) for item in value)
+    return "'%s'" % value.replace("'","''")
+
+def append_footer(session,path):
+    """Make session replay journal at path after it's loaded"""
+    with open(session,'a') as f:
+        f.write(FOOTER % {'path':vim_literal(path)})
+
+def layout_names(layout,names):
+    """Replace window ids in winlayout() by buffer names from names"""
+    if layout[0] == 'leaf':
+        return ['leaf',names.get(layout[1],'')]
+    return [layout[0],[layout_names(child,names) for child in layout[1]]]
+
+def layout_record(tab,tabs,layout,current,sizes,names):
+    """Record rebuilding one tab page, names maps window id to buffer name"""
+    return 'call s:Layout(%s,%s,%s,%s,%s)' % (int(tab),int(tabs),\
+            vim_literal(layout_names(layout,names)),int(current),\
+            vim_literal(sizes))
+
+def buffer_record(command,name):
+    """Record for badd or bdelete of buffer name"""
+    return "exe 'silent! %s' fnameescape(%s)" % (command,vim_literal(name))
+
+class Journal(object):
+    def __init__(self,path):
+        """(path) :
+path -> journal file, it's truncated by reset() at each session checkpoint.
+    Records are only flushed to OS by append(), sync() does fsync so number
+    of fsyncs depends on number of flushes not on number of records"""
+        self.path = path
+        #records since last checkpoint and all records
+        self.records = 0
+        self.appended = 0
+        self.bytes_written = 0
+        self.syncs = 0
+        self.checkpoints = 0
+        self._last = None
+        self._unsynced = False
+        self._file = None
+
+    def append(self,record):
+        """Append one record, same record as the last one is skipped.
+Return True if record was written"""
+        if record == self._last:
+            return False
+        if self._file is None:
+            self.reset()
+        line = record + '\n'
+        self._file.write(line)
+        self._file.flush()
+        self._last = record
+        self._unsynced = True
+        self.records += 1
+        self.appended += 1
+        self.bytes_written += len(line)
+        return True
+
+    def sync(self):
+        """fsync records appended since last sync"""
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = False
+            self.syncs += 1
+
+    def reset(self):
+        """Start empty journal with replay functions, called before session
+checkpoint is written so crash between them never replays old records on
+new checkpoint"""
+        self.close()
+        self._file = open(self.path,'w')
+        self._file.write(HEADER)
+        self._file.flush()
+        self._last = None
+        self._unsynced = True
+        self.checkpoints += 1
+        self.records = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,95 @@
+# ============================================================================
+# File:        reco_names.py
+# Description: Buffer and session name classification for Reco
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import re
+
+#counter is last number before pid in group 1 of buffer_pattern
+COUNTER_PATTERN = re.compile(r'(\d+)\.$')
+
+class ScratchName(object):
+    """Parts of scratch buffer name <buffer_prefix><counter>.<pid>"""
+    __slots__ = ('name','prefix','counter','pid')
+
+    def __init__(self,name,prefix,pid):
+        self.name = name
+        self.prefix = prefix
+        self.pid = pid
+        counter = COUNTER_PATTERN.search(prefix)
+        self.counter = int(counter.group(1)) if counter else None
+
+class NameClassifier(object):
+    def __init__(self,buffer_pattern,backup_pattern):
+        """(buffer_pattern,backup_pattern) :
+buffer_pattern -> Reco.buffer_pattern, group 1 is name up to pid and group 2
+    is pid of Vim which named buffer
+backup_pattern -> Reco.backup_pattern, same groups for session backups
+Both patterns are compiled once, buffers are classified once per name"""
+        self.patterns = (buffer_pattern,backup_pattern)
+        self.hits = 0
+        self.misses = 0
+        self._buffer_re = re.compile(buffer_pattern)
+        self._backup_re = re.compile(backup_pattern)
+        self._buffers = {}
+
+    def scratch(self,name,bufnr=None):
+        """ScratchName if name is scratch buffer name otherwise None. With
+bufnr result is cached until buffer gets other name"""
+        if bufnr is not None:
+            cached = self._buffers.get(bufnr)
+            if cached is not None and cached[0] == name:
+                self.hits += 1
+                return cached[1]
+        self.misses += 1
+        match = self._buffer_re.search(name)
+        result = ScratchName(name,match.group(1),match.group(2)) \
+                if match else None
+        if bufnr is not None:
+            self._buffers[bufnr] = (name,result)
+        return result
+
+    def session_pid(self,name):
+        """Pid part of Reco session backup name or None"""
+        match = self._backup_re.search(name)
+        return match.group(2) if match else None
+
+    def forget(self,bufnr):
+        """Drop cached classification, i.e. buffer was renamed"""
+        self._buffers.pop(bufnr,None)
+
+    def __len__(self):
+        return len(self._buffers)
+
+class BufferIndex(object):
+    """Buffer number by buffer name, kept current by Reco from BufAdd and
+BufFilePost instead of scanning vim.buffers for each name"""
+    def __init__(self,buffers=()):
+        self._numbers = {}
+        self._names = {}
+        for number,name in buffers:
+            self.add(number,name)
+
+    def add(self,number,name):
+        """Add buffer or update name of known buffer"""
+        old_name = self._names.get(number)
+        if old_name is not None and self._numbers.get(old_name) == number:
+            del self._numbers[old_name]
+        self._names[number] = name
+        if name:
+            self._numbers[name] = number
+
+    def remove(self,number):
+        name = self._names.pop(number,None)
+        if name is not None and self._numbers.get(name) == number:
+            del self._numbers[name]
+
+    def lookup(self,name):
+        """Buffer number for name or None"""
+        return self._numbers.get(name)
+
+    def __len__(self):
+        return len(self._names)
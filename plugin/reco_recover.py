@@ -0,0 +1,226 @@
+# ============================================================================
+# File:        reco_recover.py
+# Description: Bulk recovery of swaps left by dead Vim instances, no Vim
+#              session needed. Run: python reco_recover.py --help
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+import multiprocessing
+import multiprocessing.pool
+import reco_copy
+import reco_swap
+
+#same defaults as reco.vim and Vim 'directory' on Unix
+DEFAULT_DIRS = '.,~/tmp,/var/tmp,/tmp'
+DEFAULT_BACKUP_DIR = '~/.vim/backup'
+DEFAULT_BACKUP_PREFIX = 'vim_backup'
+DEFAULT_BUFFER_PREFIX = 'scratch'
+LINE_ENDINGS = {'unix':b'\n','dos':b'\r\n','mac':b'\r',None:b'\n'}
+
+class SwapTask(object):
+    """One swap to recover, paths are same as swapcmd makes in backup_dir"""
+    def __init__(self,swap,header,backup_dir):
+        self.swap = swap
+        self.pid = header.pid
+        self.target = os.path.abspath(os.path.expanduser(\
+                header.fname.decode('utf-8','replace')))
+        self.fileformat = header.fileformat
+        mangled = self.target.replace('/','%')
+        self.backup = os.path.join(backup_dir,mangled)
+        self.swap_backup = os.path.join(backup_dir,'%s.swp' % mangled)
+
+def group_swaps(dirs,backup_dir,backup_prefix,buffer_prefix):
+    """Return ({pid: [SwapTask]}, skipped). Swaps of living Vim, scratch
+buffers (they are restored with Reco session) and unreadable swaps are
+skipped"""
+    groups = {}
+    skipped = []
+    scratch = re.compile(r'%s\d+\.\d+$' % re.escape(buffer_prefix))
+    for swap in reco_swap.find_swaps(dirs):
+        try:
+            with reco_swap.SwapFile(swap) as header:
+                task = SwapTask(swap,header,backup_dir)
+        except (IOError,OSError,reco_swap.SwapError) as e:
+            skipped.append((swap,str(e)))
+            continue
+        if reco_swap.pid_alive(task.pid):
+            skipped.append((swap,'Vim %d is still running' % task.pid))
+        elif scratch.search(task.target):
+            skipped.append((swap,'scratch buffer, restore Reco session'))
+        else:
+            groups.setdefault(task.pid,[]).append(task)
+    #same file in more dead Vims, only newest swap is recovered
+    newest = {}
+    for tasks in groups.values():
+        for task in tasks:
+            other = newest.get(task.target)
+            if other is None or \
+                    os.path.getmtime(task.swap) > os.path.getmtime(other.swap):
+                newest[task.target] = task
+    for pid in list(groups):
+        for task in list(groups[pid]):
+            if newest[task.target] is not task:
+                groups[pid].remove(task)
+                skipped.append((task.swap,'newer swap %s' % \
+                        newest[task.target].swap))
+        if not groups[pid]:
+            del groups[pid]
+    return groups,skipped
+
+def session_path(backup_dir,backup_prefix,pid):
+    """Reco session of dead Vim or None"""
+    path = os.path.join(backup_dir,'%s.%s' % (backup_prefix,pid))
+    return path if os.path.exists(path) else None
+
+def stage(tasks,workers):
+    """Copy originals and swaps into backup_dir before anything is
+overwritten, same as swapcmd. Return tasks which were staged"""
+    engine = reco_copy.CopyEngine(workers)
+    jobs = []
+    for task in tasks:
+        if os.path.exists(task.target):
+            jobs.append((task,engine.submit(task.target,task.backup)))
+        jobs.append((task,engine.submit(task.swap,task.swap_backup)))
+    failed = set()
+    for task,job in jobs:
+        if not job.wait():
+            print('reco: backup of %s failed: %s' % (job.src,job.error),\
+                    file=sys.stderr)
+            failed.add(task)
+    engine.shutdown()
+    return [task for task in tasks if task not in failed]
+
+def recover_native(task):
+    """Write lines from swap to target, missing blocks are taken from
+original copy in backup_dir"""
+    start = time.time()
+    original = task.backup if os.path.exists(task.backup) else None
+    eol = LINE_ENDINGS[task.fileformat]
+    lines = size = 0
+    tmp = '%s.reco%d' % (task.target,os.getpid())
+    with reco_swap.SwapFile(task.swap_backup) as swap:
+        with open(tmp,'wb') as target:
+            for line in swap.lines(original):
+                target.write(line + eol)
+                lines += 1
+                size += len(line) + len(eol)
+    if original:
+        os.chmod(tmp,os.stat(original).st_mode & 0o7777)
+    os.rename(tmp,task.target)
+    return task.target,lines,size,time.time() - start
+
+def recover_vim(task,vim='vim'):
+    """Let headless Vim recover swap copy and write it over target"""
+    start = time.time()
+    with open(os.devnull,'w') as null:
+        code = subprocess.call([vim,'-u','NONE','-N','-es','-i','NONE',\
+                '-r',task.swap_backup,'-c',\
+                "exe 'write!' fnameescape('%s')" % \
+                task.target.replace("'","''"),'-c','qa!'],\
+                stdin=null,stdout=null,stderr=null)
+    if code != 0:
+        raise RuntimeError('vim -r %s exited with %d' % \
+                (task.swap_backup,code))
+    size = os.path.getsize(task.target)
+    with open(task.target,'rb') as f:
+        lines = sum(1 for line in f)
+    return task.target,lines,size,time.time() - start
+
+def _recover(args):
+    """Pool worker, errors are returned so one bad swap doesn't stop others"""
+    task,engine,vim = args
+    try:
+        if engine == 'native':
+            return recover_native(task) + (None,)
+        return recover_vim(task,vim) + (None,)
+    except Exception as e:
+        return task.target,0,0,0.0,e
+
+def recover(tasks,engine='native',jobs=None,vim='vim'):
+    """Recover tasks in parallel, native reader runs in process pool, Vim
+workers are processes already so threads only wait for them"""
+    jobs = jobs or multiprocessing.cpu_count()
+    if engine == 'native':
+        pool = multiprocessing.Pool(jobs)
+    else:
+        pool = multiprocessing.pool.ThreadPool(jobs)
+    try:
+        return pool.map(_recover,[(task,engine,vim) for task in tasks])
+    finally:
+        pool.close()
+        pool.join()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recover all swaps left '\
+            'by dead Vim instances. Originals and swaps are copied into '\
+            'backup_dir first, same as Reco does at SwapExists.')
+    parser.add_argument('--dir',default=DEFAULT_DIRS,\
+            help="swap directories, same format as Vim 'directory'")
+    parser.add_argument('--backup-dir',default=DEFAULT_BACKUP_DIR)
+    parser.add_argument('--backup-prefix',default=DEFAULT_BACKUP_PREFIX)
+    parser.add_argument('--buffer-prefix',default=DEFAULT_BUFFER_PREFIX)
+    parser.add_argument('--engine',choices=('native','vim'),\
+            default='native',help='native swap reader or vim -es -r')
+    parser.add_argument('--vim',default='vim',help='Vim for --engine vim')
+    parser.add_argument('-j','--jobs',type=int,default=None)
+    parser.add_argument('--keep-swaps',action='store_true',\
+            help="don't remove recovered swaps, copies are in backup_dir")
+    parser.add_argument('-n','--dry-run',action='store_true',\
+            help='only list swaps grouped by dead Vim')
+    options = parser.parse_args(argv)
+    backup_dir = os.path.abspath(os.path.expanduser(options.backup_dir))
+    groups,skipped = group_swaps(options.dir.split(','),backup_dir,\
+            options.backup_prefix,options.buffer_prefix)
+    for swap,reason in skipped:
+        print('skip %s: %s' % (swap,reason))
+    for pid in sorted(groups):
+        session = session_path(backup_dir,options.backup_prefix,pid)
+        print('Vim %d: %d swaps%s' % (pid,len(groups[pid]),\
+                ', session %s' % session if session else ''))
+        for task in groups[pid]:
+            print('    %s -> %s' % (task.swap,task.target))
+    tasks = [task for pid in sorted(groups) for task in groups[pid]]
+    if options.dry_run or not tasks:
+        return 0
+    if not os.path.isdir(backup_dir):
+        os.makedirs(backup_dir)
+    start = time.time()
+    tasks = stage(tasks,options.jobs or 2)
+    staged = time.time()
+    results = recover(tasks,options.engine,options.jobs,options.vim)
+    done = time.time()
+    errors = 0
+    lines = size = 0
+    by_target = dict((task.target,task) for task in tasks)
+    for target,task_lines,task_size,seconds,error in results:
+        if error is not None:
+            errors += 1
+            print('failed %s: %s' % (target,error),file=sys.stderr)
+            continue
+        lines += task_lines
+        size += task_size
+        if not options.keep_swaps:
+            os.remove(by_target[target].swap)
+    for pid in sorted(groups):
+        session = session_path(backup_dir,options.backup_prefix,pid)
+        if session:
+            print('restore layout of Vim %d: vim -S %s' % (pid,session))
+    total = max(done - start,1e-6)
+    print('recovered %d/%d files, %d lines, %.1f MB in %.2fs '\
+            '(staging %.2fs, recovery %.2fs): %.1f files/s, %.1f MB/s' % \
+            (len(results) - errors,len(results),lines,size / 1e6,total,\
+            staged - start,done - staged,len(results) / total,\
+            size / 1e6 / total))
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# ============================================================================
+# File:        reco_registry.py
+# Description: Registry of Reco sessions of all Vim instances using one
+#              backup_dir, sessions of dead Vims are found in one read
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import time
+import reco_index
+import reco_swap
+
+REGISTRY_NAME = 'reco_registry.json'
+LOCK_NAME = 'reco_registry.lock'
+#process started this many seconds after its entry was written is other
+#process with reused pid
+START_SLACK = 2.0
+
+def _boot_time():
+    try:
+        with open('/proc/stat') as f:
+            for line in f:
+                if line.startswith('btime '):
+                    return int(line.split()[1])
+    except (IOError,OSError,ValueError):
+        pass
+    return None
+
+_BOOT_TIME = []
+
+def process_start(pid):
+    """Start time of process from /proc, None if it's not known"""
+    if not _BOOT_TIME:
+        _BOOT_TIME.append(_boot_time())
+    if _BOOT_TIME[0] is None:
+        return None
+    try:
+        with open('/proc/%d/stat' % int(pid)) as f:
+            stat = f.read()
+        #command in () can have spaces, start time is 20th field after it
+        ticks = int(stat[stat.rindex(')') + 2:].split()[19])
+    except (IOError,OSError,ValueError,IndexError):
+        return None
+    return _BOOT_TIME[0] + float(ticks) / os.sysconf('SC_CLK_TCK')
+
+class Session(object):
+    """Registry entry of one Reco instance"""
+    __slots__ = ('pid','start','session','backups','heartbeat')
+
+    def __init__(self,pid,start,session,backups=(),heartbeat=None):
+        self.pid = int(pid)
+        self.start = start
+        self.session = session
+        self.backups = list(backups)
+        self.heartbeat = start if heartbeat is None else heartbeat
+
+    def alive(self):
+        """Vim of entry still runs, pid reused by other process is dead"""
+        if not reco_swap.pid_alive(self.pid):
+            return False
+        started = process_start(self.pid)
+        return started is None or started <= self.start + START_SLACK
+
+    def to_dict(self):
+        return {'start':self.start,'session':self.session,\
+                'backups':self.backups,'heartbeat':self.heartbeat}
+
+    @classmethod
+    def from_dict(cls,pid,values):
+        return cls(pid,values['start'],values['session'],\
+                values.get('backups',()),values.get('heartbeat'))
+
+class Registry(reco_index.JsonIndex):
+    def __init__(self,backup_dir):
+        """(backup_dir) : registry is <backup_dir>/reco_registry.json, one
+entry per pid"""
+        reco_index.JsonIndex.__init__(self,backup_dir,REGISTRY_NAME,\
+                LOCK_NAME)
+        self.reads = 0
+
+    def read(self):
+        """All entries by pid, empty if registry doesn't exist or is broken"""
+        self.reads += 1
+        values = self._load()
+        sessions = {}
+        if not isinstance(values,dict):
+            return sessions
+        for pid,entry in values.items():
+            try:
+                sessions[int(pid)] = Session.from_dict(pid,entry)
+            except (KeyError,TypeError,ValueError):
+                continue
+        return sessions
+
+    def register(self,pid,session,backups=(),start=None):
+        """Add entry of pid and return sessions of dead Vims, newest first.
+Entries of dead Vims without session file are dropped"""
+        pid = int(pid)
+        now = time.time()
+        with self._update() as sessions:
+            sessions[pid] = Session(pid,now if start is None else start,\
+                    session,backups,now)
+            dead = self._dead(sessions,pid)
+            for entry in dead:
+                if not os.path.exists(entry.session):
+                    del sessions[entry.pid]
+        return self._newest_first(entry for entry in dead \
+                if entry.pid in sessions)
+
+    def heartbeat(self,pid,backups=None):
+        """Mark entry of pid alive now, with backups replace its backups"""
+        with self._update() as sessions:
+            entry = sessions.get(int(pid))
+            if entry is None:
+                return False
+            entry.heartbeat = time.time()
+            if backups is not None:
+                entry.backups = list(backups)
+        return True
+
+    def unregister(self,pid):
+        with self._update() as sessions:
+            return sessions.pop(int(pid),None)
+
+    def orphans(self,pid=None):
+        """Sessions of dead Vims which still have session file, newest
+first. Only registry is read, not backup_dir"""
+        pid = None if pid is None else int(pid)
+        return self._newest_first(entry for entry in \
+                self._dead(self.read(),pid) if os.path.exists(entry.session))
+
+    def _dead(self,sessions,pid):
+        return [entry for entry in sessions.values() \
+                if entry.pid != pid and not entry.alive()]
+
+    def _newest_first(self,sessions):
+        return sorted(sessions,key=lambda entry: -entry.heartbeat)
+
+    def _dump(self,sessions):
+        return dict((str(pid),entry.to_dict()) \
+                for pid,entry in sessions.items())
@@ -0,0 +1,129 @@
+# ============================================================================
+# File:        reco_retention.py
+# Description: Size capped store of Reco backups which are kept after Vim
+#              quits, least recently used backups of dead Vims are evicted
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import time
+import errno
+import threading
+from collections import OrderedDict
+import reco_index
+import reco_store
+import reco_swap
+
+INDEX_NAME = 'reco_retention.json'
+LOCK_NAME = 'reco_retention.lock'
+
+class RetentionStore(reco_index.JsonIndex):
+    def __init__(self,backup_dir,max_bytes,max_files):
+        """(backup_dir,max_bytes,max_files) : index of kept backups is
+<backup_dir>/reco_retention.json, path -> [size,last use,pid] from least to
+most recently used. Store is over quota when sum of sizes is bigger than
+max_bytes or it has more than max_files backups"""
+        reco_index.JsonIndex.__init__(self,backup_dir,INDEX_NAME,LOCK_NAME)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self._thread = None
+
+    def read(self):
+        """Entries in LRU order, empty if index doesn't exist or is broken"""
+        entries = OrderedDict()
+        values = self._load()
+        for value in values if isinstance(values,list) else ():
+            try:
+                path,size,used,pid = value
+                entries[path] = [int(size),float(used),int(pid)]
+            except (TypeError,ValueError):
+                continue
+        return entries
+
+    def add(self,paths,pid):
+        """Keep backups of pid, they become most recently used. Size is
+taken now, backups which don't exist are skipped"""
+        now = time.time()
+        with self._update() as entries:
+            for path in paths:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                entries.pop(path,None)
+                entries[path] = [size,now,int(pid)]
+
+    def touch(self,path,pid=None):
+        """Backup was used, i.e. by diff_swap, move it to end of LRU order.
+With pid backup is owned by pid from now, so it's not evicted as backup of
+dead Vim which made it"""
+        with self._update() as entries:
+            entry = entries.pop(path,None)
+            if entry is None:
+                return False
+            entry[1] = time.time()
+            if pid is not None:
+                entry[2] = int(pid)
+            entries[path] = entry
+        return True
+
+    def usage(self,entries=None):
+        """(bytes,files) of kept backups"""
+        if entries is None:
+            entries = self.read()
+        return sum(entry[0] for entry in entries.values()),len(entries)
+
+    def over_quota(self,entries=None):
+        used,files = self.usage(entries)
+        return used > self.max_bytes or files > self.max_files
+
+    def evict(self,batch=32,pid=None):
+        """Remove at most batch least recently used backups of dead Vims
+while store is over quota, backups of pid and of living Vims are kept.
+Return number of evicted backups, 0 when there is nothing more to do"""
+        evicted = 0
+        with self._update() as entries:
+            used,files = self.usage(entries)
+            alive = {}
+            for path,(size,used_at,owner) in list(entries.items()):
+                if evicted >= batch or (used <= self.max_bytes and \
+                        files <= self.max_files):
+                    break
+                if owner == pid:
+                    continue
+                if owner not in alive:
+                    alive[owner] = reco_swap.pid_alive(owner)
+                if alive[owner]:
+                    continue
+                try:
+                    reco_store.remove_backup(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        continue
+                del entries[path]
+                used -= size
+                files -= 1
+                evicted += 1
+                self.evicted_bytes += size
+        self.evicted += evicted
+        return evicted
+
+    def start_evict(self,batch=32,pid=None):
+        """Evict in background thread, batch by batch so index lock is held
+only shortly. Return thread or None if one is already running"""
+        if self._thread is not None and self._thread.is_alive():
+            return None
+        def evict():
+            while self.evict(batch,pid):
+                pass
+        self._thread = threading.Thread(target=evict)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def _dump(self,entries):
+        return [[path] + entry for path,entry in entries.items()]
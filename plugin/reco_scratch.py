@@ -0,0 +1,166 @@
+# ============================================================================
+# File:        reco_scratch.py
+# Description: Append-only journal of scratch buffers contents for Reco
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import json
+
+#journal of session <backup_name> is <backup_name>.scratch
+EXT = '.scratch'
+#journal is compacted when it's bigger than COMPACT_FACTOR times buffers
+#contents and at least COMPACT_MIN bytes
+COMPACT_FACTOR = 4
+COMPACT_MIN = 64 * 1024
+
+try:
+    unicode
+except NameError:
+    #Python 3 Vim gives lines as str
+    def _dumps(value):
+        return json.dumps(value)
+
+    def _bytes(value):
+        return value
+else:
+    #Python 2 Vim gives lines as bytes in 'encoding', latin-1 maps each byte
+    #to one character so any bytes go through json unchanged
+    def _dumps(value):
+        return json.dumps(value,encoding='latin-1')
+
+    def _bytes(value):
+        if isinstance(value,list):
+            return [line.encode('latin-1') for line in value]
+        return value.encode('latin-1')
+
+def journal_path(session):
+    return session + EXT
+
+def delta(old,new):
+    """(start,end,lines) which turn old into new by old[start:end] = lines,
+None if they are same. Only common start and end are skipped, so one
+change costs size of changed lines"""
+    if old == new:
+        return None
+    start = 0
+    limit = min(len(old),len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end_old, end_new = len(old), len(new)
+    while end_old > start and end_new > start and \
+            old[end_old - 1] == new[end_new - 1]:
+        end_old -= 1
+        end_new -= 1
+    return start,end_old,new[start:end_new]
+
+def replay(path):
+    """Contents of buffers by name from journal. Record cut by crash and
+records after it are skipped"""
+    buffers = {}
+    try:
+        f = open(path)
+    except (IOError,OSError):
+        return buffers
+    with f:
+        for line in f:
+            try:
+                name,start,end,lines = json.loads(line)
+            except ValueError:
+                break
+            name,lines = _bytes(name),_bytes(lines)
+            if end is None:
+                buffers[name] = lines
+            elif name in buffers:
+                buffers[name][start:end] = lines
+    return buffers
+
+class ScratchJournal(object):
+    def __init__(self,path):
+        """(path) :
+path -> journal file, each record is json [name,start,end,lines], end None
+    means whole buffer. Records are flushed to OS by record(), sync() does
+    fsync and compact() rewrites journal with one record per buffer"""
+        self.path = path
+        self.records = 0
+        self.bytes_written = 0
+        self.syncs = 0
+        self.compactions = 0
+        self._size = 0
+        self._buffers = {}
+        self._unsynced = False
+        self._file = None
+
+    def record(self,name,lines):
+        """Append change of buffer name which now has lines, return False if
+nothing changed"""
+        old = self._buffers.get(name)
+        if old is None:
+            change = (0,None,lines)
+        else:
+            change = delta(old,lines)
+            if change is None:
+                return False
+        self._buffers[name] = list(lines)
+        self._write(_dumps([name] + list(change)) + '\n')
+        return True
+
+    def change(self,name,start,end,lines):
+        """Append change old[start:end] = lines of buffer name, i.e. from
+listener_add(), without comparing whole buffer. Return False if buffer was
+not recorded yet, then it needs record() of all its lines"""
+        old = self._buffers.get(name)
+        if old is None:
+            return False
+        old[start:end] = lines
+        self._write(_dumps([name,start,end,list(lines)]) + '\n')
+        return True
+
+    def forget(self,name):
+        """Buffer was renamed or wiped, next record of it is whole buffer"""
+        self._buffers.pop(name,None)
+
+    def sync(self):
+        """fsync records appended since last sync"""
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = False
+            self.syncs += 1
+
+    def needs_compaction(self):
+        contents = sum(len(line) + 1 for lines in self._buffers.values() \
+                for line in lines)
+        return self._size > max(COMPACT_MIN,COMPACT_FACTOR * contents)
+
+    def compact(self):
+        """Rewrite journal with whole contents of each buffer, new journal
+replaces old one by rename after it's synced"""
+        self.close()
+        tmp = self.path + '.tmp'
+        with open(tmp,'w') as f:
+            for name,lines in sorted(self._buffers.items()):
+                f.write(_dumps([name,0,None,lines]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp,self.path)
+        self._size = os.path.getsize(self.path)
+        self._file = open(self.path,'a')
+        self._unsynced = False
+        self.compactions += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self,line):
+        if self._file is None:
+            self._file = open(self.path,'w')
+        self._file.write(line)
+        self._file.flush()
+        self._unsynced = True
+        self.records += 1
+        self.bytes_written += len(line)
+        self._size += len(line)
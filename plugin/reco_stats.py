@@ -0,0 +1,90 @@
+# ============================================================================
+# File:        reco_stats.py
+# Description: Instrumentation counters of Reco handlers
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import json
+import time
+
+class Stats(object):
+    """Calls, wall time and vim.eval calls of each handler plus counters
+of whole Reco, handler is stage or event name"""
+    def __init__(self):
+        self.start = time.time()
+        self.handlers = {}
+        self.counters = {}
+        self._running = []
+
+    def handler(self,name):
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = {'calls':0,'total':0.0,'max':0.0,\
+                    'evals':0}
+        return stats
+
+    def run(self,name,handler,*args):
+        """Run handler(*args) and add its time to name"""
+        stats = self.handler(name)
+        self._running.append(stats)
+        start = time.time()
+        try:
+            return handler(*args)
+        finally:
+            seconds = time.time() - start
+            self._running.pop()
+            stats['calls'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'],seconds)
+
+    def count(self,name,value=1):
+        self.counters[name] = self.counters.get(name,0) + value
+
+    def counted_eval(self):
+        """vim.eval was called, it counts for every running handler"""
+        self.count('vim.eval')
+        for stats in self._running:
+            stats['evals'] += 1
+
+    def to_dict(self):
+        return {'seconds':time.time() - self.start,\
+                'handlers':self.handlers,'counters':self.counters}
+
+    def dump(self,path):
+        with open(path,'w') as f:
+            json.dump(self.to_dict(),f,indent=1,sort_keys=True)
+
+    def report(self):
+        """Lines of report, handlers with most time first"""
+        lines = ['%-32s %7s %10s %9s %7s' % ('handler','calls','total ms',\
+                'max ms','evals')]
+        for name,stats in sorted(self.handlers.items(),\
+                key=lambda item: -item[1]['total']):
+            lines.append('%-32s %7d %10.2f %9.2f %7d' % (name,stats['calls'],\
+                    stats['total'] * 1e3,stats['max'] * 1e3,stats['evals']))
+        lines.append('')
+        for name,value in sorted(self.counters.items()):
+            lines.append('%-32s %d' % (name,value))
+        return lines
+
+class CountingVim(object):
+    """Stand-in for vim module which counts eval and command calls, rest is
+taken from module"""
+    def __init__(self,module,stats):
+        self.module = module
+        self.stats = stats
+
+    def eval(self,expr):
+        self.stats.counted_eval()
+        return self.module.eval(expr)
+
+    def command(self,cmd):
+        self.stats.count('vim.command')
+        if 'mksession' in cmd:
+            self.stats.count('mksession!')
+        return self.module.command(cmd)
+
+    def __getattr__(self,name):
+        return getattr(self.module,name)
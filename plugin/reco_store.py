@@ -0,0 +1,341 @@
+# ============================================================================
+# File:        reco_store.py
+# Description: Content-addressed and compressed store for Reco backups
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import time
+import zlib
+import hashlib
+import tempfile
+import threading
+import reco_copy
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+BLOB_DIR = '.reco_blobs'
+TMP_DIR = '.reco_tmp'
+REF_MAGIC = b'RECO-REF sha1 '
+#ref is magic, blob name and new line
+MAX_REF_SIZE = 256
+HASH_CHUNK = 1024 * 1024
+#compressed backup is <backup>.reco.gz (gzip) or <backup>.reco.xz
+COMPRESSED_EXT = {'zlib':'.reco.gz','lzma':'.reco.xz'}
+
+stats = {'compressed':0,'bytes_in':0,'bytes_out':0,'compress_time':0.0,\
+        'decompressed':0,'decompress_time':0.0}
+_stats_lock = threading.Lock()
+
+def _add_stats(**values):
+    with _stats_lock:
+        for key,value in values.items():
+            stats[key] += value
+
+def resolve(path):
+    """Return real file for backup path. Ref is followed to its blob and
+compressed backup is decompressed to temp file in <backup_dir>/.reco_tmp.
+Works for backups made with and without store or compression"""
+    path = _follow_ref(path)
+    if not os.path.exists(path):
+        for ext in COMPRESSED_EXT.values():
+            if os.path.exists(path + ext):
+                return decompress(path + ext)
+        return path
+    for ext in COMPRESSED_EXT.values():
+        if path.endswith(ext):
+            return decompress(path)
+    return path
+
+def backup_exists(path):
+    """True if backup is there plain, compressed or as ref with its blob"""
+    for name in [path] + [path + ext for ext in COMPRESSED_EXT.values()]:
+        if os.path.exists(name):
+            return os.path.exists(_follow_ref(name))
+    return False
+
+def remove_backup(path):
+    """Remove backup with its compressed version and decompressed temp
+file, return True if anything was removed"""
+    removed = False
+    for name in [path] + [path + ext for ext in COMPRESSED_EXT.values()]:
+        if os.path.exists(name):
+            os.remove(name)
+            removed = True
+    tmp = _tmp_path(path)
+    if os.path.exists(tmp):
+        os.remove(tmp)
+        try:
+            os.rmdir(os.path.dirname(tmp))
+        except OSError:
+            pass
+    return removed
+
+def decompress(path):
+    """Decompress path in chunks to temp file. It's done on every call, mtime
+of temp file can't tell if backup was rewritten in the same second"""
+    tmp = _tmp_path(path)
+    start = time.time()
+    if path.endswith(COMPRESSED_EXT['lzma']):
+        decompressor = _lzma().LZMADecompressor()
+    else:
+        decompressor = zlib.decompressobj(31)
+    _makedirs(os.path.dirname(tmp))
+    with open(path,'rb') as source:
+        with open(tmp + '.part','wb') as target:
+            while True:
+                buf = source.read(HASH_CHUNK)
+                if not buf:
+                    break
+                target.write(decompressor.decompress(buf))
+            if hasattr(decompressor,'flush'):
+                target.write(decompressor.flush())
+    st = os.stat(path)
+    os.utime(tmp + '.part',(st.st_atime,st.st_mtime))
+    os.rename(tmp + '.part',tmp)
+    _add_stats(decompressed=1,decompress_time=time.time() - start)
+    return tmp
+
+def _tmp_path(path):
+    """Decompressed file keeps backup name without compression ext, so swap
+still ends with .swp"""
+    name = os.path.basename(path)
+    for ext in COMPRESSED_EXT.values():
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    backup_dir = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(os.path.dirname(backup_dir)) == BLOB_DIR:
+        backup_dir = os.path.dirname(os.path.dirname(backup_dir))
+    return os.path.join(backup_dir,TMP_DIR,name)
+
+def _lzma():
+    if lzma is None:
+        raise IOError('lzma module is not available')
+    return lzma
+
+class Compressor(object):
+    """Copy strategy which writes gzip or xz stream, same interface as
+reco_copy.CopyBackend.copy"""
+    def __init__(self,method):
+        if method == 'lzma' and lzma is None:
+            method = 'zlib'
+        if method not in COMPRESSED_EXT:
+            raise ValueError('unknown compression %s' % method)
+        self.method = method
+        self.ext = COMPRESSED_EXT[method]
+
+    def copy(self,source,target,size,cancelled=lambda: False):
+        start = time.time()
+        if self.method == 'lzma':
+            compressor = lzma.LZMACompressor()
+        else:
+            #wbits 31 writes gzip header so backup can be read by zcat
+            compressor = zlib.compressobj(6,zlib.DEFLATED,31)
+        bytes_in = bytes_out = 0
+        while True:
+            if cancelled():
+                raise reco_copy.CopyCancelled(source.name)
+            buf = source.read(HASH_CHUNK)
+            if not buf:
+                break
+            bytes_in += len(buf)
+            data = compressor.compress(buf)
+            bytes_out += len(data)
+            target.write(data)
+        data = compressor.flush()
+        bytes_out += len(data)
+        target.write(data)
+        _add_stats(compressed=1,bytes_in=bytes_in,bytes_out=bytes_out,\
+                compress_time=time.time() - start)
+        return self.method
+
+def _follow_ref(path):
+    """Return path of blob if path is a ref, otherwise path itself"""
+    try:
+        if os.path.getsize(path) > MAX_REF_SIZE:
+            return path
+        with open(path,'rb') as f:
+            data = f.read(MAX_REF_SIZE)
+    except (IOError,OSError):
+        return path
+    if not data.startswith(REF_MAGIC):
+        return path
+    name = data[len(REF_MAGIC):].strip()
+    if not isinstance(name,str):
+        name = name.decode('utf-8')
+    return blob_path(os.path.dirname(os.path.abspath(path)),name)
+
+def blob_path(backup_dir,name):
+    return os.path.join(backup_dir,BLOB_DIR,name[:2],name)
+
+def blob_name(digest,ref,compressor=None):
+    """Blob is named by sha1 and extension of ref, Vim recognizes swap to
+recover! only by its .swp extension"""
+    ext = os.path.splitext(ref)[1]
+    if len(ext) > 16 or os.sep in ext:
+        ext = ''
+    if compressor is not None:
+        ext += compressor.ext
+    return digest + ext
+
+def _makedirs(path):
+    """makedirs which doesn't fail if other Vim created path first"""
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+class BlobStore(object):
+    def __init__(self,backup_dir,session=None):
+        """(backup_dir,session) :
+backup_dir -> blobs are in <backup_dir>/.reco_blobs/<2 hex>/<sha1><ext>,
+    mangled backup names in backup_dir are small refs to them
+session -> id of session holding refs, default pid. Each session keeps list
+    of its blobs in .reco_blobs/sessions/<session> and blob is removed only
+    when it's not on list of other session. List of crashed Vim keeps its
+    blobs until session which restores it adopts the list"""
+        self.backup_dir = os.path.abspath(os.path.expanduser(backup_dir))
+        self.session = str(session or os.getpid())
+        self.blobs_dir = os.path.join(self.backup_dir,BLOB_DIR)
+        self.sessions_dir = os.path.join(self.blobs_dir,'sessions')
+        self.skipped = 0
+        self.stored = 0
+        self._held = set()
+        self._lock = threading.Lock()
+
+    def put(self,source,ref,backend,cancelled=lambda: False,\
+            compressor=None):
+        """Store opened source file as blob and write ref at ref path. Copy
+is skipped if blob already exists. Return name of used copy strategy or
+'dedup' when copy was skipped"""
+        if compressor is not None:
+            backend = compressor
+        name = blob_name(self._hash(source),ref,compressor)
+        blob = blob_path(self.backup_dir,name)
+        self._hold(name)
+        strategy = 'dedup'
+        if not os.path.exists(blob):
+            strategy = self._copy_blob(source,blob,backend,cancelled)
+        self._write_ref(ref,name)
+        #other session could remove blob before it saw our hold
+        if not os.path.exists(blob):
+            source.seek(0)
+            strategy = self._copy_blob(source,blob,backend,cancelled)
+        with self._lock:
+            if strategy == 'dedup':
+                self.skipped += 1
+            else:
+                self.stored += 1
+        return strategy
+
+    def release(self):
+        """Forget this session refs and remove blobs no other session has"""
+        session_file = os.path.join(self.sessions_dir,self.session)
+        if os.path.exists(session_file):
+            os.remove(session_file)
+        with self._lock:
+            held, self._held = self._held, set()
+        if not held:
+            return
+        for name in held - self._referenced_by_others():
+            blob = blob_path(self.backup_dir,name)
+            remove_backup(blob)
+            try:
+                os.rmdir(os.path.dirname(blob))
+            except OSError:
+                pass
+
+    def hold(self,ref):
+        """Hold blob of ref which is already there, i.e. backup reused from
+copy cache. Return False if ref or its blob is missing"""
+        blob = _follow_ref(ref)
+        if blob == ref or not os.path.exists(blob):
+            return False
+        self._hold(os.path.basename(blob))
+        #other session could remove blob before it saw our hold
+        return os.path.exists(blob)
+
+    def adopt(self,session):
+        """Hold blobs of crashed session whose backups this session took
+over, its list is removed. Return number of adopted blobs"""
+        path = os.path.join(self.sessions_dir,str(session))
+        try:
+            with open(path) as f:
+                names = [line.strip() for line in f if line.strip()]
+        except (IOError,OSError):
+            return 0
+        for name in names:
+            self._hold(name)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return len(names)
+
+    def _hash(self,source):
+        sha = hashlib.sha1()
+        while True:
+            buf = source.read(HASH_CHUNK)
+            if not buf:
+                break
+            sha.update(buf)
+        source.seek(0)
+        return sha.hexdigest()
+
+    def _hold(self,name):
+        """Add blob to session list before it's written, so cleanup of other
+session never removes blob we are going to use"""
+        with self._lock:
+            if name in self._held:
+                return
+            self._held.add(name)
+            _makedirs(self.sessions_dir)
+            with open(os.path.join(self.sessions_dir,self.session),'a') as f:
+                f.write(name + '\n')
+
+    def _referenced_by_others(self):
+        refs = set()
+        if not os.path.isdir(self.sessions_dir):
+            return refs
+        for name in os.listdir(self.sessions_dir):
+            try:
+                with open(os.path.join(self.sessions_dir,name)) as f:
+                    refs.update(line.strip() for line in f)
+            except (IOError,OSError):
+                continue
+        return refs
+
+    def _copy_blob(self,source,blob,backend,cancelled):
+        """Copy into temp file next to blob and rename, so half written
+blob is never visible to other sessions"""
+        blob_dir = os.path.dirname(blob)
+        _makedirs(blob_dir)
+        fd,tmp = tempfile.mkstemp(prefix='.tmp',dir=blob_dir)
+        try:
+            with os.fdopen(fd,'wb') as target:
+                strategy = backend.copy(source,target,\
+                        os.fstat(source.fileno()).st_size,cancelled)
+            st = os.fstat(source.fileno())
+            os.chmod(tmp,st.st_mode & 0o7777)
+            os.utime(tmp,(st.st_atime,st.st_mtime))
+            os.rename(tmp,blob)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return strategy
+
+    def _write_ref(self,ref,name):
+        tmp = '%s.tmp%s' % (ref,os.getpid())
+        with open(tmp,'wb') as f:
+            f.write(REF_MAGIC + name.encode('utf-8') + b'\n')
+        os.rename(tmp,ref)
@@ -0,0 +1,291 @@
+# ============================================================================
+# File:        reco_swap.py
+# Description: Swap files lookup and reader for Reco
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import re
+import mmap
+import errno
+import struct
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+#Vim starts with .swp and goes down .swo, .swn ... .sva, .svz ... if swap
+#already exists
+SWAP_PATTERN = re.compile(r'^(.*)\.s([uvw])([a-z])$')
+
+def pid_alive(pid):
+    """Check if process with pid still exists"""
+    try:
+        os.kill(int(pid),0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def find_swaps(dirs):
+    """Full paths of all swaps in 'directory' entries"""
+    swaps = []
+    for dir_entry in dirs:
+        path = os.path.abspath(os.path.expanduser(dir_entry))
+        swaps.extend(os.path.join(path,name) for name in list_dir(path) \
+                if swap_key(dir_entry,name) is not None)
+    return swaps
+
+def list_dir(path):
+    """File names in path in one pass, empty list if path can't be read"""
+    try:
+        if scandir is not None:
+            return [entry.name for entry in scandir(path)]
+        return os.listdir(path)
+    except OSError:
+        return []
+
+def swap_order(name):
+    """Sort key, .swp first then variants in order Vim creates them"""
+    match = SWAP_PATTERN.match(name)
+    return ('wvu'.index(match.group(2)),-ord(match.group(3)))
+
+def swap_key(dir_entry,name):
+    """Return basename of file which swap name belongs to or None if name is
+not a swap. Swaps in '.' are hidden, with dir ending in // name is full path
+where / is replaced by %"""
+    match = SWAP_PATTERN.match(name)
+    if not match:
+        return None
+    base = match.group(1)
+    if dir_entry.endswith('//'):
+        return base.split('%')[-1]
+    if dir_entry == '.':
+        if not base.startswith('.'):
+            return None
+        return base[1:]
+    return base
+
+class SwapIndex(object):
+    def __init__(self,dirs):
+        """(dirs) :
+dirs -> list of 'directory' entries from Vim, each directory is listed only
+    once and swaps are found by basename of file they belong to"""
+        self.dirs = dirs
+        self.lookups = 0
+        self._swaps = {}
+        self._build()
+
+    def lookup(self,basename):
+        """First swap for basename in 'directory' order or None"""
+        self.lookups += 1
+        swaps = self._swaps.get(basename)
+        return swaps[0] if swaps else None
+
+    def swaps(self,basename):
+        """All swaps for basename, .swp first then other variants"""
+        return list(self._swaps.get(basename,[]))
+
+    def discard(self,path):
+        """Forget swap which was removed or moved by Reco"""
+        for key,swaps in self._swaps.items():
+            if path in swaps:
+                swaps.remove(path)
+                if not swaps:
+                    del self._swaps[key]
+                return
+
+    def add(self,path,dir_entry=None):
+        """Add swap created or moved into one of indexed dirs"""
+        key = swap_key(dir_entry or os.path.dirname(path),\
+                os.path.basename(path))
+        if key is not None and path not in self._swaps.get(key,[]):
+            self._swaps.setdefault(key,[]).append(path)
+
+    def __len__(self):
+        return sum(len(swaps) for swaps in self._swaps.values())
+
+    def _build(self):
+        for dir_entry in self.dirs:
+            path = os.path.abspath(os.path.expanduser(dir_entry))
+            names = [name for name in list_dir(path) \
+                    if swap_key(dir_entry,name) is not None]
+            for name in sorted(names,key=swap_order):
+                self._swaps.setdefault(swap_key(dir_entry,name),[]).append(\
+                        os.path.join(path,name))
+
+#memline.c block 0 layout, numbers in header are always little endian
+B0_ID = b'b0'
+B0_CRYPT_IDS = b'cCd'
+B0_VERSION = slice(2,12)
+B0_PAGE_SIZE = 12
+B0_MTIME = 16
+B0_INO = 20
+B0_PID = 24
+B0_UNAME = slice(28,68)
+B0_HNAME = slice(68,108)
+B0_FNAME = slice(108,1006)
+B0_FLAGS = 1006
+B0_DIRTY = 1007
+B0_MAGIC = 1008
+B0_DIRTY_FLAG = 0x55
+B0_MAGIC_LONG = 0x30313233
+PTR_ID = 0x7074
+DATA_ID = 0x6461
+DB_INDEX_MASK = 0x7fffffff
+MISSING = b'???LINES MISSING'
+ROOT_BLOCK = 1
+
+class SwapError(Exception):
+    pass
+
+def _cstring(data):
+    return data.split(b'\0',1)[0]
+
+class SwapFile(object):
+    """Read Vim swap without Vim. Byte order and size of long are taken from
+block 0 magic numbers, so swap from other machine with same Vim works too"""
+    def __init__(self,path):
+        self.path = path
+        self._file = open(path,'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(),0,\
+                    access=mmap.ACCESS_READ)
+        except (ValueError,mmap.error) as e:
+            self._file.close()
+            raise SwapError('%s: %s' % (path,e))
+        try:
+            self._read_block0()
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def lines(self,original=None):
+        """Generator of recovered lines as bytes without new line. Blocks
+Vim didn't write yet are read from original file if given, otherwise
+replaced by ???LINES MISSING like in Vim"""
+        return self._walk(ROOT_BLOCK,1,original)
+
+    def _read_block0(self):
+        data = self._data
+        if len(data) < B0_MAGIC + 16 or data[0:1] != B0_ID[0:1]:
+            raise SwapError('%s: not a Vim swap file' % self.path)
+        if data[1:2] in B0_CRYPT_IDS:
+            raise SwapError('%s: encrypted swap file' % self.path)
+        if data[1:2] != B0_ID[1:2]:
+            raise SwapError('%s: unknown block 0 id' % self.path)
+        self.version = _cstring(data[B0_VERSION])
+        self.page_size = self._b0_number(B0_PAGE_SIZE)
+        self.mtime = self._b0_number(B0_MTIME)
+        self.inode = self._b0_number(B0_INO)
+        self.pid = self._b0_number(B0_PID)
+        self.user = _cstring(data[B0_UNAME])
+        self.host = _cstring(data[B0_HNAME])
+        self.fname = _cstring(data[B0_FNAME])
+        self.dirty = ord(data[B0_DIRTY:B0_DIRTY + 1]) == B0_DIRTY_FLAG
+        #fileformat + 1 in lowest 2 bits, 0 if unknown
+        fileformat = ord(data[B0_FLAGS:B0_FLAGS + 1]) & 3
+        self.fileformat = (None,'unix','dos','mac')[fileformat]
+        for order in '<>':
+            for size,code in ((8,'q'),(4,'i')):
+                if struct.unpack_from(order + code,data,B0_MAGIC)[0] == \
+                        B0_MAGIC_LONG:
+                    self._set_layout(order,size,code)
+                    return
+        raise SwapError('%s: unknown byte order' % self.path)
+
+    def _b0_number(self,offset):
+        return struct.unpack_from('<I',self._data,offset)[0]
+
+    def _set_layout(self,order,long_size,long_code):
+        """Offsets of native structs from memline.c for this swap"""
+        self.byte_order = order
+        self.long_size = long_size
+        align = lambda n: (n + long_size - 1) // long_size * long_size
+        #pointer_block: short id, count, count_max, then entries
+        self._pb_header = struct.Struct(order + 'HHH')
+        self._pb_pointer = align(6)
+        #pointer_entry: long bnum, line_count, old_lnum, int page_count
+        self._pe = struct.Struct(order + long_code * 3 + 'i')
+        self._pe_size = align(self._pe.size)
+        #data_block: short id, unsigned free, txt_start, txt_end, long lines
+        self._db_header = struct.Struct(order + 'H2xIII')
+        self._db_line_count = struct.Struct(order + long_code)
+        self._db_line_count_offset = align(self._db_header.size)
+        self._db_index = self._db_line_count_offset + long_size
+        self._index = struct.Struct(order + 'I')
+
+    def _block(self,bnum,pages=1):
+        start = bnum * self.page_size
+        end = start + pages * self.page_size
+        if bnum < 1 or end > len(self._data):
+            return None
+        return start
+
+    def _walk(self,bnum,pages,original,old_lnum=1,line_count=0):
+        start = self._block(bnum,pages)
+        if start is None:
+            for line in self._missing(original,old_lnum,line_count):
+                yield line
+            return
+        block_id = self._pb_header.unpack_from(self._data,start)[0]
+        if block_id == PTR_ID:
+            for line in self._pointer_block(start,original):
+                yield line
+        elif block_id == DATA_ID:
+            for line in self._data_block(start):
+                yield line
+        else:
+            for line in self._missing(original,old_lnum,line_count):
+                yield line
+
+    def _pointer_block(self,start,original):
+        block_id,count,count_max = \
+                self._pb_header.unpack_from(self._data,start)
+        for i in range(count):
+            bnum,line_count,old_lnum,page_count = self._pe.unpack_from(\
+                    self._data,start + self._pb_pointer + i * self._pe_size)
+            for line in self._walk(bnum,max(page_count,1),original,\
+                    old_lnum,line_count):
+                yield line
+
+    def _data_block(self,start):
+        data = self._data
+        block_id,free,txt_start,txt_end = \
+                self._db_header.unpack_from(data,start)
+        line_count = self._db_line_count.unpack_from(data,\
+                start + self._db_line_count_offset)[0]
+        end = start + txt_end
+        for i in range(line_count):
+            line_start = start + (self._index.unpack_from(data,\
+                    start + self._db_index + i * 4)[0] & DB_INDEX_MASK)
+            #lines are stored from end of block, each ends with NUL
+            yield data[line_start:end].split(b'\0',1)[0]
+            end = line_start
+
+    def _missing(self,original,old_lnum,line_count):
+        """Lines Vim never wrote to swap, same as Vim take them from
+original file or mark them as missing"""
+        if original is None or not os.path.exists(original):
+            yield MISSING
+            return
+        with open(original,'rb') as f:
+            for lnum,line in enumerate(f,1):
+                if lnum >= old_lnum + line_count:
+                    break
+                if lnum >= old_lnum:
+                    yield line.rstrip(b'\r\n')
@@ -0,0 +1,335 @@
+# ============================================================================
+# File:        reco_watch.py
+# Description: Watch swap directories and copy swaps of dead Vims into
+#              backup_dir before Vim asks about them. inotify on Linux,
+#              directories are polled elsewhere
+# Maintainer:  Mirek Malinowski <malinowski.miroslaw@yahoo.com>
+# License:     GPLv2+ -- look it up.
+#
+# ============================================================================
+
+import os
+import re
+import errno
+import shutil
+import select
+import struct
+import threading
+import reco_copy
+import reco_store
+import reco_swap
+
+STAGE_DIR = '.reco_staged'
+#inotify.h
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+        IN_DELETE
+EVENT = struct.Struct('iIII')
+#events are 'changed' or 'removed', None name means rescan whole directory
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+class Inotify(object):
+    """inotify through ctypes, raises OSError where it's not available"""
+    method = 'inotify'
+
+    def __init__(self,dirs):
+        import ctypes
+        import ctypes.util
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c') or \
+                    'libc.so.6',use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError,AttributeError) as e:
+            raise OSError(errno.ENOSYS,'no inotify: %s' % e)
+        self._fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(),'inotify_init1 failed')
+        self._dirs = {}
+        #wake() writes to pipe so read returns before timeout
+        self._wake = os.pipe()
+        try:
+            for path in dirs:
+                wd = self._libc.inotify_add_watch(self._fd,\
+                        path.encode('utf-8'),WATCH_MASK)
+                if wd >= 0:
+                    self._dirs[wd] = path
+        except:
+            self.close()
+            raise
+
+    def read(self,timeout):
+        """List of (dir,name,CHANGED|REMOVED) which came in timeout"""
+        ready = select.select([self._fd,self._wake[0]],[],[],timeout)[0]
+        if self._fd not in ready:
+            return []
+        try:
+            data = os.read(self._fd,65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd,mask,cookie,length = EVENT.unpack_from(data,offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].split(b'\0',1)[0]
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.extend((path,None,CHANGED) \
+                        for path in self._dirs.values())
+            elif wd in self._dirs:
+                events.append((self._dirs[wd],name.decode('utf-8',\
+                        'replace'),REMOVED if mask & (IN_DELETE | \
+                        IN_MOVED_FROM) else CHANGED))
+        return events
+
+    def wake(self):
+        os.write(self._wake[1],b'x')
+
+    def close(self):
+        if self._fd >= 0:
+            for fd in (self._fd,) + self._wake:
+                os.close(fd)
+            self._fd = -1
+
+class Poller(object):
+    """Same interface as Inotify, each read lists directories again"""
+    method = 'poll'
+
+    def __init__(self,dirs):
+        self._dirs = list(dirs)
+        self._stop = threading.Event()
+        self._state = dict((path,self._list(path)) for path in self._dirs)
+
+    def read(self,timeout):
+        self._stop.wait(timeout)
+        events = []
+        for path in self._dirs:
+            old, new = self._state[path], self._list(path)
+            self._state[path] = new
+            events.extend((path,name,CHANGED) for name,stat in new.items() \
+                    if old.get(name) != stat)
+            events.extend((path,name,REMOVED) for name in old \
+                    if name not in new)
+        return events
+
+    def wake(self):
+        self._stop.set()
+
+    def close(self):
+        self._stop.set()
+
+    def _list(self,path):
+        state = {}
+        for name in reco_swap.list_dir(path):
+            try:
+                st = os.stat(os.path.join(path,name))
+            except OSError:
+                continue
+            state[name] = (st.st_ino,st.st_size,st.st_mtime)
+        return state
+
+def watch(dirs,poll=False):
+    """Inotify for dirs if it works here, otherwise Poller"""
+    if not poll:
+        try:
+            return Inotify(dirs)
+        except OSError:
+            pass
+    return Poller(dirs)
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_dev,st.st_ino,st.st_size,st.st_mtime)
+
+class SwapStager(object):
+    def __init__(self,dirs,backup_dir,workers=1,interval=1.0,ignore=None,\
+            poll=False):
+        """(dirs,backup_dir,workers,interval,ignore,poll) :
+dirs -> 'directory' entries from Vim, swaps of dead Vims there are copied
+    to <backup_dir>/.reco_staged/<pid> by workers threads
+interval -> how often stop is checked and, without inotify, how often dirs
+    are listed
+ignore -> function of swap file name from swap header, True for swaps which
+    are not staged i.e. scratch buffers"""
+        self.dirs = [(entry,os.path.abspath(os.path.expanduser(entry))) \
+                for entry in dirs]
+        self.backup_dir = os.path.abspath(os.path.expanduser(backup_dir))
+        self.stage_dir = os.path.join(self.backup_dir,STAGE_DIR,\
+                str(os.getpid()))
+        self.interval = interval
+        self.ignore = ignore
+        self.poll = poll
+        self.method = None
+        self.staged = 0
+        self.claimed = 0
+        self.missed = 0
+        self._engine = reco_copy.CopyEngine(workers,256)
+        self._jobs = {}
+        #swaps of living Vims, Vim dying is not file event so their pids are
+        #checked again after each read
+        self._living = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+        self._watcher = None
+
+    def start(self):
+        """Remove staged copies left by dead Vims and start watching"""
+        self._remove_stale()
+        if not os.path.isdir(self.stage_dir):
+            os.makedirs(self.stage_dir)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait_ready(self,timeout=None):
+        """Wait until swaps which existed at start are queued"""
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        """Stop watching, unfinished copies are cancelled and all staged
+copies which were not claimed are removed"""
+        self._stop.set()
+        with self._lock:
+            if self._watcher is not None:
+                self._watcher.wake()
+        if self._thread is not None:
+            self._thread.join()
+        self._engine.shutdown(cancel=True)
+        shutil.rmtree(self.stage_dir,ignore_errors=True)
+
+    def claim(self,swap,dst):
+        """Move staged copy of swap to dst and return True if copy is done
+and swap didn't change since it was staged, otherwise forget staged copy
+and return False so caller copies swap itself"""
+        swap = os.path.abspath(swap)
+        with self._lock:
+            staged = self._jobs.pop(swap,None)
+        if staged is None:
+            self.missed += 1
+            return False
+        job,key = staged
+        try:
+            if job.done() and job.error is None and \
+                    _stat_key(swap) == key and \
+                    os.path.getsize(job.dst) == key[2]:
+                reco_store.remove_backup(dst)
+                os.rename(job.dst,dst)
+                self.claimed += 1
+                return True
+        except OSError:
+            pass
+        self._drop(job)
+        self.missed += 1
+        return False
+
+    def _run(self):
+        watcher = None
+        try:
+            watcher = watch([path for entry,path in self.dirs] + \
+                    [self.stage_dir],self.poll)
+            with self._lock:
+                self._watcher = watcher
+            self.method = watcher.method
+            for path in reco_swap.find_swaps([entry for entry,path \
+                    in self.dirs]):
+                if self._stop.is_set():
+                    return
+                self._consider(path)
+            self._ready.set()
+            while not self._stop.is_set():
+                for directory,name,kind in watcher.read(self.interval):
+                    self._event(directory,name,kind)
+                for swap,pid in list(self._living.items()):
+                    if not reco_swap.pid_alive(pid):
+                        self._consider(swap)
+        finally:
+            self._ready.set()
+            if watcher is not None:
+                with self._lock:
+                    self._watcher = None
+                watcher.close()
+
+    def _event(self,directory,name,kind):
+        if directory == self.stage_dir:
+            #staged copy removed by someone else
+            if kind == REMOVED:
+                with self._lock:
+                    for swap,(job,key) in list(self._jobs.items()):
+                        if os.path.basename(job.dst) == name:
+                            del self._jobs[swap]
+            return
+        for entry,path in self.dirs:
+            if path != directory:
+                continue
+            if name is None:
+                for swap in reco_swap.find_swaps([entry]):
+                    self._consider(swap)
+            elif reco_swap.swap_key(entry,name) is not None:
+                swap = os.path.join(path,name)
+                if kind == REMOVED:
+                    self._forget(swap)
+                else:
+                    self._consider(swap)
+
+    def _consider(self,swap):
+        """Stage copy of swap if its Vim is dead and it's not staged yet"""
+        pid = self._living.get(swap)
+        if pid is not None and reco_swap.pid_alive(pid):
+            return
+        try:
+            key = _stat_key(swap)
+            with self._lock:
+                staged = self._jobs.get(swap)
+            if staged is not None and staged[1] == key:
+                return
+            with reco_swap.SwapFile(swap) as header:
+                pid = header.pid
+                fname = header.fname.decode('utf-8','replace')
+        except (IOError,OSError,reco_swap.SwapError):
+            self._living.pop(swap,None)
+            return
+        if reco_swap.pid_alive(pid):
+            self._living[swap] = pid
+            return
+        self._living.pop(swap,None)
+        if self.ignore and self.ignore(fname):
+            return
+        dst = os.path.join(self.stage_dir,swap.replace('/','%'))
+        job = self._engine.submit(swap,dst,link=True)
+        #copy of changed swap to same dst runs after older one
+        with self._lock:
+            self._jobs[swap] = (job,key)
+        self.staged += 1
+
+    def _forget(self,swap):
+        self._living.pop(swap,None)
+        with self._lock:
+            staged = self._jobs.pop(swap,None)
+        if staged is not None:
+            self._drop(staged[0])
+
+    def _drop(self,job):
+        job.cancel()
+        try:
+            os.remove(job.dst)
+        except OSError:
+            pass
+
+    def _remove_stale(self):
+        root = os.path.dirname(self.stage_dir)
+        for name in reco_swap.list_dir(root):
+            if re.match(r'^\d+$',name) and int(name) != os.getpid() and \
+                    not reco_swap.pid_alive(name):
+                shutil.rmtree(os.path.join(root,name),ignore_errors=True)
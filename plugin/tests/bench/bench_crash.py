@@ -0,0 +1,264 @@
+#End-to-end crash and recovery benchmark with real Vim. Vim with Reco opens and
+#edits files and scratch buffers, then it's killed with SIGKILL and started
+#again from its backup_prefix.<pid> session. Reco phases are timed inside Vim
+#by crash_probe.py and recovered content is checked. Vim needs +python (Reco
+#is Python 2) and +timers, this script runs with any python:
+#python bench_crash.py                        10 files, 5 scratch buffers
+#python bench_crash.py -n 200 -m 50 --append crash.jsonl
+#Exit status is 1 if content is not recovered, 2 if Vim can't run Reco.
+import os
+import sys
+import pty
+import json
+import time
+import fcntl
+import shutil
+import signal
+import struct
+import termios
+import argparse
+import tempfile
+import threading
+import subprocess
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.abspath(os.path.join(BENCH_DIR,'..','..'))
+
+VIMRC = '''set nocompatible hidden
+set dir=%(swap_dir)s
+set updatetime=100000
+source %(plugin_dir)s/reco.vim
+pyfile %(bench_dir)s/crash_probe.py
+au VimEnter * python _reco_probe.mark('vim_enter')
+function! RecoBenchTimer(timer)
+python _reco_probe.run()
+endfunction
+call timer_start(0,'RecoBenchTimer')
+'''
+PHASES = ['badd_file_recover','_scratch_buffers_recovery',\
+        'vim_enter_buffers_check','swapcmd','copy_submit','copy_wait',\
+        'file_recovery']
+
+def vim_supported(vim):
+    """Reco needs Python 2 in Vim and timers are used to drive it"""
+    return subprocess.call([vim,'-u','NONE','-N','-es','-i','NONE','-c',\
+            "if !has('python') || !has('timers') | cquit | endif",'-c',\
+            'qa!']) == 0
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],\
+                cwd=PLUGIN_DIR,stderr=open(os.devnull,'w')).decode().strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+class VimProcess(object):
+    """Vim on its own pseudo terminal so it runs same as for user, output is
+read and thrown away so Vim never blocks on writing screen"""
+    def __init__(self,args,env,start):
+        master,slave = pty.openpty()
+        fcntl.ioctl(slave,termios.TIOCSWINSZ,struct.pack('HHHH',24,80,0,0))
+        self.start = start
+        self.process = subprocess.Popen(args,stdin=slave,stdout=slave,\
+                stderr=slave,env=env,close_fds=True)
+        os.close(slave)
+        self._master = master
+        self._reader = threading.Thread(target=self._drain)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _drain(self):
+        try:
+            while os.read(self._master,65536):
+                pass
+        except OSError:
+            pass
+
+    def wait(self,timeout):
+        """Wait for Vim to exit, return seconds since start or None"""
+        deadline = time.time() + timeout
+        while self.process.poll() is None:
+            if time.time() > deadline:
+                return None
+            time.sleep(0.01)
+        return time.time() - self.start
+
+    def kill(self):
+        if self.process.poll() is None:
+            os.kill(self.process.pid,signal.SIGKILL)
+            self.process.wait()
+
+    def close(self):
+        self.kill()
+        self._reader.join(1)
+        os.close(self._master)
+
+def wait_for(path,process,timeout):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None or time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class Crash(object):
+    """Directories of one benchmark run, HOME is set to it so Reco backups
+go to its ~/.vim/backup"""
+    def __init__(self,vim,files,scratch,lines):
+        self.vim = vim
+        self.dir = tempfile.mkdtemp(prefix='reco_crash')
+        self.backup_dir = os.path.join(self.dir,'.vim','backup')
+        self.files_dir = os.path.join(self.dir,'files')
+        self.swap_dir = os.path.join(self.dir,'swap')
+        for path in (self.backup_dir,self.files_dir,self.swap_dir):
+            os.makedirs(path)
+        self.vimrc = os.path.join(self.dir,'vimrc')
+        with open(self.vimrc,'w') as f:
+            f.write(VIMRC % {'swap_dir':self.swap_dir,\
+                    'plugin_dir':PLUGIN_DIR,'bench_dir':BENCH_DIR})
+        self.plan_path = os.path.join(self.dir,'plan.json')
+        self.files = {}
+        for i in range(files):
+            path = os.path.join(self.files_dir,'file%d.txt' % i)
+            before = ['file %d line %d' % (i,j) for j in range(lines)]
+            with open(path,'w') as f:
+                f.write(''.join(line + '\n' for line in before))
+            #every 10th line changed and few lines added
+            self.files[path] = [line + ' edited' if j % 10 == 0 else line \
+                    for j,line in enumerate(before)] + \
+                    ['file %d new line %d' % (i,j) for j in range(5)]
+        self.scratch = [['scratch %d line %d' % (i,j) for j in range(lines)] \
+                for i in range(scratch)]
+
+    def launch(self,phase,args):
+        plan = {'phase':phase,'files':self.files,'scratch':self.scratch,\
+                'ready':os.path.join(self.dir,'ready.json'),\
+                'out':os.path.join(self.dir,'out.json'),'start':time.time()}
+        with open(self.plan_path,'w') as f:
+            json.dump(plan,f)
+        env = dict(os.environ,HOME=self.dir,TERM='xterm',\
+                RECO_BENCH_PLAN=self.plan_path)
+        process = VimProcess([self.vim,'-u',self.vimrc,'--noplugin','-N',\
+                '-i','NONE'] + args,env,plan['start'])
+        return process,plan
+
+    def run(self,timeout):
+        """Crash Vim and recover it, return result dict"""
+        result = {'errors':[]}
+        process,plan = self.launch('crash',[])
+        try:
+            if not wait_for(plan['ready'],process.process,timeout):
+                result['errors'].append('crashing Vim never got ready')
+                return result
+            with open(plan['ready']) as f:
+                ready = json.load(f)
+            result['crash_setup_s'] = time.time() - plan['start']
+            process.kill()
+        finally:
+            process.close()
+        process,plan = self.launch('recover',['-S',ready['session']])
+        try:
+            result['exit_s'] = process.wait(timeout)
+            if result['exit_s'] is None:
+                result['errors'].append('recovering Vim did not quit')
+                return result
+        finally:
+            process.close()
+        if not os.path.exists(plan['out']):
+            result['errors'].append('recovering Vim wrote no results')
+            return result
+        with open(plan['out']) as f:
+            out = json.load(f)
+        result.update(phases=out['phases'],timeline=out['timeline'],\
+                copy_bytes=out['copy_bytes'])
+        result['errors'] += self.check(out['buffers'],ready['pid'])
+        return result
+
+    def check(self,buffers,crashed_pid):
+        """Compare recovered buffers and files on disk with edits"""
+        errors = []
+        by_name = dict((buf['name'],buf['lines']) for buf in buffers)
+        for path,lines in sorted(self.files.items()):
+            if by_name.get(path) != lines:
+                errors.append('buffer %s not recovered' % path)
+            with open(path) as f:
+                if f.read().splitlines() != lines:
+                    errors.append('file %s not written' % path)
+        recovered = [buf['lines'] for buf in buffers \
+                if buf['name'] not in self.files]
+        for lines in self.scratch:
+            if lines not in recovered:
+                errors.append('scratch buffer "%s" not recovered' % lines[0])
+        for name in by_name:
+            if name.endswith('.%d' % crashed_pid):
+                errors.append('buffer %s still has pid of crashed Vim' % name)
+        return errors
+
+    def close(self):
+        shutil.rmtree(self.dir)
+
+def report(result):
+    print('files %(files)d, scratch buffers %(scratch)d, %(lines)d lines '\
+            'each' % result)
+    timeline = result.get('timeline',{})
+    for name,key in (('crashed Vim ready','crash_setup_s'),):
+        if key in result:
+            print('    %-28s %9.1f ms' % (name,result[key] * 1e3))
+    for name in ('vim_enter','vim_enter_done','recovered'):
+        if name in timeline:
+            print('    %-28s %9.1f ms' % ('launch -> ' + name,\
+                    timeline[name] * 1e3))
+    if result.get('exit_s') is not None:
+        print('    %-28s %9.1f ms' % ('launch -> exit',result['exit_s'] * 1e3))
+    phases = result.get('phases',{})
+    if phases:
+        print('    %-28s %6s %9s %9s' % ('phase','calls','total ms','max ms'))
+    for name in PHASES:
+        if name in phases:
+            stats = phases[name]
+            print('    %-28s %6d %9.1f %9.1f' % (name,stats['calls'],\
+                    stats['total_ms'],stats['max_ms']))
+    if 'copy_bytes' in result:
+        print('    copied %d bytes' % result['copy_bytes'])
+    for error in result['errors']:
+        print('ERROR %s' % error)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reco crash and recovery '\
+            'benchmark with headless Vim and kill -9')
+    parser.add_argument('-n','--files',type=int,default=10)
+    parser.add_argument('-m','--scratch',type=int,default=5)
+    parser.add_argument('-l','--lines',type=int,default=1000,\
+            help='lines in each file and scratch buffer')
+    parser.add_argument('--vim',default='vim')
+    parser.add_argument('--timeout',type=float,default=120)
+    parser.add_argument('--json',help='write result to file')
+    parser.add_argument('--append',help='append result as one json line, '\
+            'for tracking results across commits')
+    parser.add_argument('--keep',action='store_true',\
+            help="don't remove run directory")
+    options = parser.parse_args(argv)
+    if not vim_supported(options.vim):
+        print('%s has no +python or +timers, Reco can not run' % options.vim)
+        return 2
+    crash = Crash(options.vim,options.files,options.scratch,options.lines)
+    try:
+        result = crash.run(options.timeout)
+    finally:
+        if options.keep:
+            print('run directory %s' % crash.dir)
+        else:
+            crash.close()
+    result.update(files=options.files,scratch=options.scratch,\
+            lines=options.lines,commit=git_commit(),time=time.time(),\
+            ok=not result['errors'])
+    report(result)
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(result,f,indent=1,sort_keys=True)
+    if options.append:
+        with open(options.append,'a') as f:
+            f.write(json.dumps(result,sort_keys=True) + '\n')
+    return 0 if result['ok'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
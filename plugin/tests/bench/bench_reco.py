@@ -0,0 +1,346 @@
+#Benchmark of Reco handlers driven by scripted event storms, Vim is replaced
+#by fake vim module from this directory. Run from this directory with same
+#Python as Vim uses for Reco (reco.py is Python 2):
+#python bench_reco.py                    compare with baseline.json
+#python bench_reco.py --update-baseline  store new baseline for this machine
+#baseline.json is local to machine and ignored by git, without it nothing is
+#compared.
+#Exit status is 1 if any handler p95 latency is worse than baseline.
+import os
+import sys
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,BENCH_DIR)
+sys.path.insert(1,os.path.join(BENCH_DIR,'..','..'))
+import gc
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import vim
+import reco
+import reco_swap
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BASELINE = os.path.join(BENCH_DIR,'baseline.json')
+#regression only if p95 is worse than tolerance times baseline and also by
+#more than MIN_SLOWDOWN_US, so fast handlers don't fail on timer noise
+TOLERANCE = 1.5
+MIN_SLOWDOWN_US = 50.0
+TIMER_HANDLERS = {'RecoSnapshotTimer':'snapshot_timer',\
+        'RecoDiffTimer':'diff_timer'}
+FILE_SIZE = 4096
+SWAP_SIZE = 8192
+
+class Clock(object):
+    """time module for reco.py, timers move clock forward instead of
+waiting for delay"""
+    def __init__(self):
+        self.offset = 0.0
+
+    def time(self):
+        return time.time() + self.offset
+
+clock = Clock()
+reco.time = clock
+
+def dead_pid():
+    """Pid of no running process, it's owner of swaps from crashed Vim"""
+    pid = 999999
+    while reco_swap.pid_alive(pid):
+        pid -= 1
+    return pid
+
+def percentile(values,percent):
+    values = sorted(values)
+    index = max(int(round(percent / 100.0 * len(values))) - 1,0)
+    return values[min(index,len(values) - 1)]
+
+class Run(object):
+    """One scenario in new Vim with new Reco"""
+    def __init__(self,root):
+        self.dir = tempfile.mkdtemp(dir=root)
+        self.backup_dir = os.path.join(self.dir,'backup')
+        self.files_dir = os.path.join(self.dir,'files')
+        self.swap_dir = os.path.join(self.dir,'swap')
+        for path in (self.backup_dir,self.files_dir,self.swap_dir):
+            os.mkdir(path)
+        vim.reset(self.swap_dir)
+        self.reco = reco.Reco(self.backup_dir)
+        self.measure = True
+        self.times = {}
+
+    def add_buffer(self,name):
+        buf = vim.buffers.add(name)
+        self.fire('BufAdd',name,buf.number)
+        return buf
+
+    def fire(self,event,afile='',abuf=0):
+        """Run Reco dispatch for event same as Vim auto-command"""
+        vim.afile = afile
+        vim.abuf = abuf or vim.current.buffer.number
+        self._wrap_stages()
+        start = time.time()
+        self.reco.dispatch(event)
+        self._add('dispatch %s' % event,time.time() - start)
+
+    def run_timers(self):
+        """Vim is quiet, run all timers Reco started"""
+        while vim.timers:
+            delay,name = vim.timers.pop(0)
+            clock.offset += delay / 1000.0
+            handler = TIMER_HANDLERS[name]
+            start = time.time()
+            getattr(self.reco,handler)()
+            self._add(handler,time.time() - start)
+
+    def write_file(self,path,size):
+        with open(path,'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def close(self):
+        if self.reco._copy_engine:
+            self.reco._copy_engine.shutdown()
+        if self.reco._journal is not None:
+            self.reco._journal.close()
+        shutil.rmtree(self.dir)
+
+    def _wrap_stages(self):
+        for stages in self.reco._stages.values():
+            for i,(name,handler) in enumerate(stages):
+                if not getattr(handler,'timed',False):
+                    stages[i] = (name,self._timed(name,handler))
+
+    def _timed(self,name,handler):
+        def timed():
+            start = time.time()
+            try:
+                handler()
+            finally:
+                self._add(name,time.time() - start)
+        timed.timed = True
+        return timed
+
+    def _add(self,name,seconds):
+        if self.measure:
+            self.times.setdefault(name,[]).append(seconds)
+
+def _enter(run):
+    """Vim started without session, not measured"""
+    measure, run.measure = run.measure, False
+    run.fire('VimEnter')
+    run.measure = measure
+
+def session_restore(run,n):
+    """Restore session of dead Vim with n buffers, every 5th is scratch
+buffer with swap"""
+    pid = dead_pid()
+    session = os.path.join(run.backup_dir,'%s.%d' % \
+            (run.reco.backup_prefix,pid))
+    run.write_file(session,FILE_SIZE)
+    vim.v['this_session'] = session
+    vim.g['SessionLoad'] = 1
+    for i in range(n):
+        if i % 5 == 0:
+            name = '%s%d.%d' % (run.reco.buffer_prefix,i + 2,pid)
+            run.write_file(os.path.join(run.swap_dir,name + '.swp'),\
+                    SWAP_SIZE)
+            name = os.path.join(run.files_dir,name)
+        else:
+            name = run.write_file(os.path.join(run.files_dir,\
+                    'file%d.txt' % i),FILE_SIZE)
+        run.add_buffer(name)
+    del vim.g['SessionLoad']
+    run.fire('VimEnter')
+    run.fire('BufWinEnter')
+    run.run_timers()
+
+def _open_files(run,n):
+    for i in range(n):
+        run.add_buffer(run.write_file(os.path.join(run.files_dir,\
+                'file%d.txt' % i),FILE_SIZE))
+
+def bufdo(run,n):
+    """:bufdo over n buffers, each one leaves and enters window"""
+    _enter(run)
+    run.measure = False
+    _open_files(run,n)
+    run.run_timers()
+    run.measure = True
+    for buf in list(vim.buffers):
+        run.fire('BufWinLeave',vim.current.buffer.name)
+        vim.current.buffer = buf
+        run.fire('BufWinEnter',buf.name,buf.number)
+        run.fire('WinEnter',buf.name,buf.number)
+    run.run_timers()
+    run.fire('CursorHold')
+
+def bufdo_journal(run,n):
+    """Same :bufdo with layout journal"""
+    run.reco.journal = True
+    bufdo(run,n)
+
+def swap_flood(run,n):
+    """Open n files which have swaps, each is recovered"""
+    _enter(run)
+    for i in range(n):
+        path = run.write_file(os.path.join(run.files_dir,'file%d.txt' % i),\
+                FILE_SIZE)
+        swap = run.write_file(os.path.join(run.swap_dir,'file%d.txt.swp' % \
+                i),SWAP_SIZE)
+        vim.v['swapname'] = swap
+        buf = vim.buffers.add(path)
+        vim.current.buffer = buf
+        run.fire('BufAdd',path,buf.number)
+        run.fire('SwapExists',path,buf.number)
+        #Vim removes swap after v:swapchoice d
+        os.remove(swap)
+        run.fire('BufWinEnter',path,buf.number)
+    run.run_timers()
+
+def vim_leave(run,n):
+    """Quit Vim with n recovered files, all backups are removed"""
+    run.measure = False
+    swap_flood(run,n)
+    run.measure = True
+    for buf in list(vim.buffers):
+        run.fire('BufUnload',buf.name,buf.number)
+    run.fire('VimLeave')
+
+SCENARIOS = [('session_restore',session_restore,300),('bufdo',bufdo,300),\
+        ('bufdo_journal',bufdo_journal,300),('swap_flood',swap_flood,100),\
+        ('vim_leave',vim_leave,100)]
+
+def run_scenario(root,scenario,n,repeat):
+    """Best p95 and total of repeat runs, then one run for allocations"""
+    result = {'n':n,'stages':{}}
+    for i in range(repeat):
+        run = Run(root)
+        start = time.time()
+        try:
+            scenario(run,n)
+            total = time.time() - start
+        finally:
+            run.close()
+        result['total_ms'] = min(result.get('total_ms',total * 1e3),\
+                total * 1e3)
+        for name,times in run.times.items():
+            stats = {'calls':len(times),\
+                    'p50_us':percentile(times,50) * 1e6,\
+                    'p95_us':percentile(times,95) * 1e6,\
+                    'p99_us':percentile(times,99) * 1e6,\
+                    'max_us':max(times) * 1e6}
+            old = result['stages'].get(name)
+            if old is None or stats['p95_us'] < old['p95_us']:
+                result['stages'][name] = stats
+    result.update(allocations(root,scenario,n))
+    return result
+
+def allocations(root,scenario,n):
+    """Peak traced memory with tracemalloc, otherwise only number of objects
+which stay alive after scenario"""
+    gc.collect()
+    objects = len(gc.get_objects())
+    run = Run(root)
+    if tracemalloc is not None:
+        tracemalloc.start()
+    try:
+        scenario(run,n)
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc else None
+    finally:
+        if tracemalloc is not None:
+            tracemalloc.stop()
+        run.close()
+    del run
+    gc.collect()
+    result = {'objects_kept':len(gc.get_objects()) - objects}
+    if peak is not None:
+        result['peak_kib'] = peak / 1024.0
+    return result
+
+def compare(results,baseline,tolerance):
+    """Return list of regressions against baseline"""
+    regressions = []
+    for name,result in results.items():
+        base = baseline.get(name)
+        if base is None or base.get('n') != result['n']:
+            continue
+        for stage,stats in result['stages'].items():
+            old = base['stages'].get(stage)
+            if old is None:
+                continue
+            slower = stats['p95_us'] - old['p95_us']
+            if stats['p95_us'] > old['p95_us'] * tolerance and \
+                    slower > MIN_SLOWDOWN_US:
+                regressions.append('%s %s: p95 %.1fus, baseline %.1fus' % \
+                        (name,stage,stats['p95_us'],old['p95_us']))
+    return regressions
+
+def report(results):
+    for name in [name for name,scenario,n in SCENARIOS if name in results]:
+        result = results[name]
+        alloc = ', peak %.1f KiB' % result['peak_kib'] \
+                if 'peak_kib' in result else ''
+        print('%s n=%d: %.1f ms, %d objects kept%s' % (name,result['n'],\
+                result['total_ms'],result['objects_kept'],alloc))
+        print('    %-28s %6s %9s %9s %9s %9s' % ('handler','calls',\
+                'p50 us','p95 us','p99 us','max us'))
+        for stage,stats in sorted(result['stages'].items()):
+            print('    %-28s %6d %9.1f %9.1f %9.1f %9.1f' % (stage,\
+                    stats['calls'],stats['p50_us'],stats['p95_us'],\
+                    stats['p99_us'],stats['max_us']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reco event storm '\
+            'benchmark with fake vim module')
+    parser.add_argument('-s','--scenario',action='append',\
+            choices=[name for name,scenario,n in SCENARIOS],\
+            help='run only this scenario, can be repeated')
+    parser.add_argument('-n',type=int,default=None,\
+            help='number of buffers/files instead of scenario default')
+    parser.add_argument('-r','--repeat',type=int,default=3)
+    parser.add_argument('--baseline',default=BASELINE)
+    parser.add_argument('--update-baseline',action='store_true')
+    parser.add_argument('--tolerance',type=float,default=TOLERANCE)
+    parser.add_argument('--json',help='write results to file')
+    options = parser.parse_args(argv)
+    root = tempfile.mkdtemp(prefix='reco_bench')
+    results = {}
+    try:
+        for name,scenario,n in SCENARIOS:
+            if options.scenario and name not in options.scenario:
+                continue
+            results[name] = run_scenario(root,scenario,options.n or n,\
+                    options.repeat)
+    finally:
+        shutil.rmtree(root)
+    report(results)
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(results,f,indent=1,sort_keys=True)
+    if options.update_baseline:
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(options.baseline,'w') as f:
+            json.dump(baseline,f,indent=1,sort_keys=True)
+        print('baseline %s updated' % options.baseline)
+        return 0
+    if not os.path.exists(options.baseline):
+        print('no baseline %s, run with --update-baseline' % \
+                options.baseline)
+        return 0
+    with open(options.baseline) as f:
+        regressions = compare(results,json.load(f),options.tolerance)
+    for regression in regressions:
+        print('REGRESSION %s' % regression)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
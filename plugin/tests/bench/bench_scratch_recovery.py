@@ -0,0 +1,45 @@
+import sys
+import time
+import vim
+import os
+sys.path.append(os.path.abspath('..'))
+sys.path.append(os.path.abspath('.'))
+import reco
+#Run from test directory in clean Vim, Vim exits with 1 if time per buffer
+#grows:
+#vim -u NONE -N --noplugin -c 'pyfile bench/bench_scratch_recovery.py' -c 'qa!'
+#Each scratch buffer from dead session is recovered from swap which doesn't
+#exist, so time is spent only on buffer lookup and switching. Half of names
+#are of buffers which are gone, their misses mustn't rebuild buffer index
+SIZES = [100,200,400,800]
+#time per buffer at biggest size can't be more than this times smallest one
+MAX_GROWTH = 2.0
+DEAD_PID = 999999
+
+def run(r,count):
+    vim.command('silent! %bwipeout!')
+    start_nr = int(vim.eval('bufnr("$")')) + 1
+    swaps = []
+    for i in range(count):
+        name = '%s/%s%d.%d' % (os.path.abspath('.'),r.buffer_prefix,\
+                start_nr + i,DEAD_PID)
+        vim.command('silent badd %s' % name)
+        swaps.append((name,'%s/missing%d.swp' % (r.backup_dir,i)))
+        swaps.append((name + 'gone','%s/gone%d.swp' % (r.backup_dir,i)))
+    r._buffer_index = None
+    r._scratch_buffers_swaps = swaps
+    start = time.time()
+    r._scratch_buffers_recovery()
+    return time.time() - start
+
+r = reco.Reco('./test_files')
+r._remove_auto_group_reco()
+results = [(count,run(r,count)) for count in SIZES]
+for count,seconds in results:
+    print "%5d buffers: %.4fs, %.1f us per buffer" % (count,seconds,\
+            seconds / count * 1e6)
+growth = (results[-1][1] / results[-1][0]) / (results[0][1] / results[0][0])
+print "per buffer time growth %.2f (max %.2f) %s" % (growth,MAX_GROWTH,\
+        'OK' if growth <= MAX_GROWTH else 'FAIL')
+if growth > MAX_GROWTH:
+    sys.exit(1)
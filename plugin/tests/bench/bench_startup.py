@@ -0,0 +1,105 @@
+#Vim startup time with Reco started at once and with g:reco_lazy, measured by
+#vim --startuptime. Vim needs +python same as for Reco and +timers, run with
+#any python:
+#python bench_startup.py -r 20
+#Each Vim starts on pseudo terminal with one file and quits right after first
+#screen update, HOME is temporary directory so Reco backups don't go to your
+#~/.vim/backup.
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from bench_crash import VimProcess
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(BENCH_DIR,'..','..','..'))
+
+VIMRC = '''set nocompatible
+let g:reco_lazy = %(lazy)d
+set rtp^=%(root)s
+'''
+
+def parse_startuptime(path):
+    """Return (msec till VIM STARTED, msec sourcing plugin/reco.vim)"""
+    started = reco = 0.0
+    with open(path) as f:
+        for line in f:
+            fields = line.split(':',1)
+            if len(fields) < 2:
+                continue
+            times = fields[0].split()
+            try:
+                times = [float(value) for value in times]
+            except ValueError:
+                continue
+            if '--- VIM STARTED ---' in fields[1]:
+                started = times[0]
+            elif fields[1].strip().endswith(os.path.join('plugin',\
+                    'reco.vim')) and len(times) == 3:
+                #clock, self+sourced, self
+                reco += times[1]
+    return started,reco
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def measure(vim,directory,lazy,repeat):
+    """Lists of startup and reco.vim times of repeat Vim starts"""
+    vimrc = os.path.join(directory,'vimrc%d' % lazy)
+    with open(vimrc,'w') as f:
+        f.write(VIMRC % {'lazy':lazy,'root':ROOT_DIR})
+    startuptime = os.path.join(directory,'startuptime')
+    path = os.path.join(directory,'file.txt')
+    env = dict(os.environ,HOME=directory,TERM='xterm')
+    started = []
+    reco = []
+    for i in range(repeat):
+        if os.path.exists(startuptime):
+            os.remove(startuptime)
+        process = VimProcess([vim,'-u',vimrc,'-N','-i','NONE',\
+                '--startuptime',startuptime,path,'-c',\
+                "call timer_start(0,{-> execute('qa!')})"],env,time.time())
+        try:
+            process.wait(30)
+        finally:
+            process.close()
+        times = parse_startuptime(startuptime)
+        started.append(times[0])
+        reco.append(times[1])
+    return started,reco
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Vim startup time with '\
+            'Reco started at once and lazily')
+    parser.add_argument('-r','--repeat',type=int,default=10)
+    parser.add_argument('--vim',default='vim')
+    options = parser.parse_args(argv)
+    if subprocess.call([options.vim,'-u','NONE','-N','-es','-i','NONE',\
+            '-c',"if !has('python') || !has('timers') | cquit | endif",\
+            '-c','qa!']) != 0:
+        print('%s has no +python or +timers, Reco can not run' % \
+                options.vim)
+        return 2
+    directory = tempfile.mkdtemp(prefix='reco_startup')
+    try:
+        os.makedirs(os.path.join(directory,'.vim','backup'))
+        results = [(name,measure(options.vim,directory,lazy,\
+                options.repeat)) for name,lazy in (('eager',0),('lazy',1))]
+    finally:
+        shutil.rmtree(directory)
+    print('median of %d starts   %12s %12s' % (options.repeat,\
+            'started ms','reco.vim ms'))
+    for name,(started,reco) in results:
+        print('%-22s %12.2f %12.2f' % (name,median(started),median(reco)))
+    saved = median(results[0][1][0]) - median(results[1][1][0])
+    print('lazy saves %.2f ms of startup' % saved)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#Loaded by bench_crash.py into Vim with pyfile after reco.vim. Times Reco
+#recovery phases and does what the plan from RECO_BENCH_PLAN asks for:
+#crash -> edit files and scratch buffers, write swaps and session, then wait
+#         for kill -9
+#recover -> open every buffer so swaps are recovered, then write timings and
+#           content of buffers to out file and quit
+import os
+import json
+import time
+import vim
+
+class RecoProbe(object):
+    #stages of Reco pipeline and private methods which are timed, every copy
+    #goes through _submit_copy with or without copy cache
+    STAGES = ['badd_file_recover','vim_enter_buffers_check','swapcmd',\
+            'file_recovery']
+    METHODS = {'_scratch_buffers_recovery':'_scratch_buffers_recovery',\
+            '_submit_copy':'copy_submit','_wait_for_copy':'copy_wait'}
+
+    def __init__(self,reco,plan_path):
+        with open(plan_path) as f:
+            self.plan = json.load(f)
+        self.reco = reco
+        self.phases = {}
+        self.timeline = {}
+        for stages in reco._stages.values():
+            for i,(name,handler) in enumerate(stages):
+                if name in self.STAGES:
+                    stages[i] = (name,self._timed(name,handler))
+        for method,phase in self.METHODS.items():
+            setattr(reco,method,self._timed(phase,getattr(reco,method)))
+
+    def mark(self,name):
+        """Seconds since harness started Vim"""
+        self.timeline[name] = time.time() - self.plan['start']
+
+    def run(self):
+        self.mark('first_timer')
+        getattr(self,self.plan['phase'])()
+
+    def crash(self):
+        """Edit files and add scratch buffers, then make sure swaps and
+session have all of it"""
+        for path,lines in sorted(self.plan['files'].items()):
+            vim.command('edit %s' % str(path).replace(' ','\\ '))
+            vim.current.buffer[:] = [str(line) for line in lines]
+        for lines in self.plan['scratch']:
+            vim.command('enew')
+            vim.current.buffer[:] = [str(line) for line in lines]
+        vim.command('preserve')
+        self.reco.flush_backup_session()
+        self._write(self.plan['ready'],{'pid':os.getpid(),\
+                'session':self.reco.backup_name})
+
+    def recover(self):
+        """Enter every listed buffer, swaps of files are recovered at
+SwapExists and BufWinEnter"""
+        self.mark('vim_enter_done')
+        for buf in list(vim.buffers):
+            if buf.name and int(vim.eval('buflisted(%d)' % buf.number)):
+                vim.command('buffer %d' % buf.number)
+        self.mark('recovered')
+        engine = self.reco._copy_engine
+        copied = engine.bytes_copied if engine else 0
+        self._write(self.plan['out'],{'phases':self.phases,\
+                'timeline':self.timeline,'copy_bytes':copied,\
+                'buffers':[{'name':buf.name,'lines':list(buf)} \
+                for buf in vim.buffers if buf.name]})
+        vim.command('qa!')
+
+    def _write(self,path,data):
+        with open(path + '.tmp','w') as f:
+            json.dump(data,f)
+        os.rename(path + '.tmp',path)
+
+    def _timed(self,phase,handler):
+        def timed(*args,**kwargs):
+            start = time.time()
+            try:
+                return handler(*args,**kwargs)
+            finally:
+                self._add(phase,time.time() - start)
+        return timed
+
+    def _add(self,phase,seconds):
+        stats = self.phases.setdefault(phase,{'calls':0,'total_ms':0.0,\
+                'max_ms':0.0})
+        stats['calls'] += 1
+        stats['total_ms'] += seconds * 1e3
+        stats['max_ms'] = max(stats['max_ms'],seconds * 1e3)
+
+_reco_probe = RecoProbe(reco,os.environ['RECO_BENCH_PLAN'])
@@ -0,0 +1,213 @@
+#In-process stand-in for Vim python module, only as much of it as Reco uses.
+#It's first in sys.path of bench_reco.py so "import vim" in reco.py gets it.
+#Expressions Reco doesn't use raise error, so new vim.eval in reco.py shows
+#up here instead of being silently wrong.
+import os
+import re
+
+class error(Exception):
+    pass
+
+class Options(dict):
+    pass
+
+class Buffer(list):
+    def __init__(self,number,name=''):
+        list.__init__(self,[''])
+        self.number = number
+        self.name = name
+        self.options = Options(swapfile=True,modified=False,buftype='',\
+                bufhidden='',modifiable=True)
+
+class BufferList(object):
+    """vim.buffers, buffers by number in order they were added"""
+    def __init__(self):
+        self._buffers = {}
+        self._order = []
+        self._next = 1
+
+    def __getitem__(self,number):
+        try:
+            return self._buffers[number]
+        except KeyError:
+            raise KeyError('no such buffer')
+
+    def __iter__(self):
+        return iter([self._buffers[nr] for nr in self._order])
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def add(self,name=''):
+        number = self._next
+        self._next += 1
+        self._buffers[number] = Buffer(number,name)
+        self._order.append(number)
+        return self._buffers[number]
+
+    def wipe(self,number):
+        if self._buffers.pop(number,None) is not None:
+            self._order.remove(number)
+
+    def last(self):
+        """Vim numbers are never used again, same as bufnr('$')"""
+        return self._next - 1
+
+class Window(object):
+    def __init__(self,win_id,buf):
+        self.id = win_id
+        self.buffer = buf
+        self.cursor = (1,0)
+
+class Current(object):
+    def __init__(self):
+        self.window = None
+
+    @property
+    def buffer(self):
+        return self.window.buffer
+
+    @buffer.setter
+    def buffer(self,buf):
+        self.window.buffer = buf
+
+buffers = None
+current = None
+windows = None
+#state of Vim which events and Reco change
+g = {}
+v = {}
+options = {}
+features = set()
+functions = set()
+afile = ''
+abuf = 0
+swap_owner = 0
+timers = []
+sessions_written = 0
+#how many times each eval and command was used
+eval_calls = {}
+command_calls = {}
+
+def reset(dir_option='.',has_timers=True):
+    """Start new Vim with one empty buffer in one window"""
+    global buffers,current,windows,afile,abuf,swap_owner,sessions_written
+    buffers = BufferList()
+    current = Current()
+    windows = [Window(1000,buffers.add())]
+    current.window = windows[0]
+    g.clear()
+    v.clear()
+    v.update(swapname='',this_session='',swapchoice='')
+    options.clear()
+    options['dir'] = dir_option
+    features.clear()
+    functions.clear()
+    functions.update(['swapinfo','winlayout','win_getid','win_gotoid',\
+            'RecoSnapshotTimer','RecoDiffTimer'])
+    if has_timers:
+        features.add('timers')
+    afile = ''
+    abuf = 0
+    swap_owner = 0
+    sessions_written = 0
+    del timers[:]
+    eval_calls.clear()
+    command_calls.clear()
+
+def _exists(name):
+    if name.startswith('*'):
+        return name[1:] in functions
+    if name.startswith('g:'):
+        return name[2:] in g
+    return False
+
+def _layout():
+    win_ids = [str(window.id) for window in windows]
+    tree = ['leaf',win_ids[0]] if len(windows) == 1 else \
+            ['col',[['leaf',win_id] for win_id in win_ids]]
+    return ['1','1',tree,str(windows.index(current.window) + 1),'',\
+            [[str(window.id),window.buffer.name] for window in windows]]
+
+def _timer_start(match):
+    timers.append((int(match.group(1)),match.group(2)))
+    return str(len(timers))
+
+EXPRESSIONS = {
+    'bufnr("$")':lambda: str(buffers.last()),
+    'expand("<abuf>")':lambda: str(abuf),
+    'expand("<afile>:p")':lambda: os.path.abspath(afile),
+    'expand("<afile>:p:h")':lambda: os.path.dirname(os.path.abspath(afile)),
+    'expand("<afile>:t")':lambda: os.path.basename(afile),
+    'expand("%:p")':lambda: current.buffer.name,
+    '&modified':lambda: '1' if current.buffer.options['modified'] else '0',
+    '&dir':lambda: options['dir'],
+    'v:swapname':lambda: v['swapname'],
+    'v:this_session':lambda: v['this_session'],
+    "exists('*swapinfo') ? get(swapinfo(v:swapname),'pid',0) : 0":\
+            lambda: str(swap_owner),
+    "has('timers') && exists('*RecoSnapshotTimer')":\
+            lambda: '1' if 'timers' in features and \
+            _exists('*RecoSnapshotTimer') else '0',
+    "has('timers') && exists('*RecoDiffTimer')":\
+            lambda: '1' if 'timers' in features and \
+            _exists('*RecoDiffTimer') else '0',
+    'win_getid()':lambda: str(current.window.id),
+}
+PATTERNS = [
+    (re.compile(r"^exists\('([^']*)'\)$"),\
+            lambda match: '1' if _exists(match.group(1)) else '0'),
+    (re.compile(r"^timer_start\((\d+),'(\w+)'\)$"),_timer_start),
+    (re.compile(r"^win_gotoid\((\d+)\)$"),lambda match: '1' if \
+            [w for w in windows if w.id == int(match.group(1))] else '0'),
+    (re.compile(r"^\[tabpagenr\(\),"),lambda match: _layout()),
+]
+DICT_KEY = re.compile(r"(?:^|,)'(\d+)':")
+
+def eval(expr):
+    eval_calls[expr] = eval_calls.get(expr,0) + 1
+    if expr.startswith('{') and expr.endswith('}'):
+        parts = DICT_KEY.split(expr[1:-1])[1:]
+        return dict((parts[i],_eval(parts[i + 1])) \
+                for i in range(0,len(parts),2))
+    return _eval(expr)
+
+def _eval(expr):
+    if expr in EXPRESSIONS:
+        return EXPRESSIONS[expr]()
+    for pattern,result in PATTERNS:
+        match = pattern.search(expr)
+        if match:
+            return result(match)
+    raise error('fake vim: unknown expression %s' % expr)
+
+MKSESSION = re.compile(r'^exe "mksession! (.*)"$')
+
+def command(cmd):
+    name = cmd.split(' ',2)[1] if cmd.startswith('silent') else \
+            cmd.split(' ',1)[0]
+    command_calls[name] = command_calls.get(name,0) + 1
+    match = MKSESSION.match(cmd)
+    if match:
+        _mksession(match.group(1))
+    elif cmd.startswith('let v:swapchoice'):
+        v['swapchoice'] = cmd.split('"')[1]
+    elif cmd.startswith('bwipeout '):
+        name = cmd.split(' ',1)[1]
+        for buf in list(buffers):
+            if buf.name == name:
+                buffers.wipe(buf.number)
+
+def _mksession(path):
+    """Session of real size, one badd per buffer and window layout"""
+    global sessions_written
+    sessions_written += 1
+    with open(path,'w') as f:
+        f.write('let SessionLoad = 1\n')
+        for buf in buffers:
+            f.write('badd +1 %s\n' % buf.name)
+        for window in windows:
+            f.write('edit %s\nsplit\n' % window.buffer.name)
+        f.write('doautoall SessionLoadPost\nunlet SessionLoad\n')
+
+reset()
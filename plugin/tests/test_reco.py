@@ -5,7 +5,10 @@ import os
 sys.path.append(os.path.abspath('..'))
 sys.path.append(os.path.abspath('.'))
 import reco
+import reco_cleanup
+import reco_scratch
 import re
+import time
 class Test_reco_methods_only(unittest.TestCase):
     """Test all methods and flags but no auto commands """
     @classmethod
@@ -80,6 +83,151 @@ class Test_reco_methods_only(unittest.TestCase):
         #restore backup_name
         self.reco.backup_name = old_backup_name
 
+    def test_registry_heartbeat(self):
+        """Heartbeat writes registry only when backups changed or interval
+passed"""
+        registry = self.reco._get_registry()
+        registry.register(os.getpid(),self.reco.backup_name)
+        self.reco._registry_backups = len(self.reco._leave_cleanup)
+        self.reco._registry_beat = time.time()
+        writes = registry.writes
+        self.reco.registry_heartbeat()
+        self.assertEqual(writes,registry.writes)
+        self.reco._leave_cleanup.append('test_registry_heartbeat')
+        self.reco.registry_heartbeat()
+        self.reco._leave_cleanup.discard('test_registry_heartbeat')
+        self.assertEqual(writes + 1,registry.writes)
+        self.assertTrue('test_registry_heartbeat' in \
+                registry.read()[os.getpid()].backups)
+        registry.unregister(os.getpid())
+
+    def test_retain_backups(self):
+        """With retention backups go to retention store at VimLeave instead
+of cleanup, session backup stays in cleanup"""
+        filename = "%s/test_retain_backups" % self.reco.backup_dir
+        open(filename,mode="w").close()
+        leave_cleanup = self.reco._leave_cleanup
+        self.reco._leave_cleanup = reco_cleanup.CleanupSet(\
+                [self.reco.backup_name,filename])
+        self.reco.retention = True
+        try:
+            self.reco._retain_backups(leave=True)
+            store = self.reco._get_retention()
+            self.assertTrue(filename in store.read())
+            self.assertEqual(list(self.reco._leave_cleanup),\
+                    [self.reco.backup_name])
+        finally:
+            self.reco.retention = False
+            self.reco._leave_cleanup = leave_cleanup
+        os.remove(filename)
+        os.remove(store.path)
+
+    def test_update_backup_session_coalesced(self):
+        """Layout changes within snapshot_max_staleness only mark session
+dirty, flush writes one snapshot for all of them"""
+        old_backup_name = self.reco.backup_name
+        self.reco.backup_name = "~/test_reco_backup.vim"
+        self.reco.init_backup = True
+        self.reco._last_snapshot = time.time()
+        writes = self.reco._snapshot_writes
+        coalesced = self.reco._snapshot_coalesced
+        for i in range(3):
+            self.reco.update_backup_session()
+        self.assertFalse(os.path.exists(\
+                os.path.expanduser(self.reco.backup_name)))
+        self.reco.flush_backup_session()
+        self.assertTrue(os.path.exists(\
+                os.path.expanduser(self.reco.backup_name)))
+        self.assertEqual(writes + 1,self.reco._snapshot_writes)
+        self.assertEqual(coalesced + 2,self.reco._snapshot_coalesced)
+        os.remove(os.path.expanduser(self.reco.backup_name))
+        #nothing changed so flush does nothing
+        self.reco.flush_backup_session()
+        self.assertFalse(os.path.exists(\
+                os.path.expanduser(self.reco.backup_name)))
+        self.reco.init_backup = False
+        self.reco.backup_name = old_backup_name
+
+    def test_update_scratch_journal(self):
+        """Only scratch buffers go to scratch journal and replay gives their
+lines"""
+        path = "%s/test_update_scratch_journal.scratch" % self.reco.backup_dir
+        self.reco._scratch_journal = reco_scratch.ScratchJournal(path)
+        try:
+            vim.command('file test_scratch_journal')
+            self.reco.update_scratch_journal()
+            self.assertFalse(os.path.exists(path))
+            vim.command('file %s1.12345' % self.reco.buffer_prefix)
+            vim.current.buffer[:] = ['a','b']
+            self.reco.update_scratch_journal()
+            vim.current.buffer[1] = 'c'
+            self.reco.update_scratch_journal()
+            self.assertEqual(self.reco._scratch_journal.records,2)
+            name = os.path.basename(vim.current.buffer.name)
+            self.assertEqual(reco_scratch.replay(path),{name:['a','c']})
+            #renamed buffer is forgotten and recorded whole under new name
+            vim.command('file %s2.12345' % self.reco.buffer_prefix)
+            self.reco._renamed(vim.current.buffer)
+            self.assertFalse(name in self.reco._scratch_journal._buffers)
+            vim.current.buffer[1] = 'd'
+            self.reco.update_scratch_journal()
+            self.assertEqual(reco_scratch.replay(path)[os.path.basename(\
+                    vim.current.buffer.name)],['a','d'])
+        finally:
+            self.reco._scratch_journal.close()
+            self.reco._scratch_journal = None
+            self.reco._scratch_tracked = {}
+            vim.command('set nomodified')
+        os.remove(path)
+
+    def test_dispatch_shares_eval(self):
+        """All stages of one event get same value from _eval"""
+        values = []
+        self.reco._stages['Test'] = [('first',lambda: values.append(\
+                self.reco._eval('localtime()'))),('second',lambda: \
+                values.append(self.reco._eval('localtime()')))]
+        self.reco.dispatch('Test')
+        del self.reco._stages['Test']
+        self.assertEqual(len(values),2)
+        self.assertTrue(values[0] is values[1])
+        self.assertTrue(self.reco._event is None)
+
+    def test_dispatch_prefetch_one_eval(self):
+        """Values listed in EVENT_VALUES are fetched with one vim.eval"""
+        contexts = []
+        reco.EVENT_VALUES['Test'] = [reco.LAST_BUF,reco.MODIFIED,\
+                reco.SESSION_LOAD]
+        self.reco._stages['Test'] = [('first',lambda: \
+                self.reco._set_name_if_unnamed_buffer(vim.current.buffer)),\
+                ('second',lambda: contexts.append((self.reco._last_buf_nr(),\
+                self.reco._event)))]
+        self.reco.dispatch('Test')
+        del self.reco._stages['Test']
+        del reco.EVENT_VALUES['Test']
+        last_buf,context = contexts[0]
+        self.assertEqual(last_buf,int(vim.eval('bufnr("$")')))
+        self.assertEqual(context.evals,1)
+        self.assertTrue(vim.current.buffer.name)
+
+    def test_dispatch_instrumented(self):
+        """With instrument on, event and its stages are timed and vim.eval
+calls are counted for them"""
+        self.reco._stages['Test'] = [('first',lambda: self.reco._eval('1'))]
+        self.reco.instrument = True
+        try:
+            self.reco.dispatch('Test')
+            stats = self.reco._stats
+        finally:
+            self.reco.instrument = False
+            self.reco._stats = None
+            del self.reco._stages['Test']
+        self.assertEqual(stats.handlers['first']['calls'],1)
+        self.assertEqual(stats.handlers['first']['evals'],1)
+        self.assertEqual(stats.handlers['au Test']['evals'],1)
+        self.assertEqual(stats.counters['vim.eval'],1)
+        #calls are counted only while instrumented event runs
+        self.assertTrue(reco.vim is vim)
+
     def test_cleanup(self):
         """Test if files removed from disk and list is empty afterwards"""
         filename = "%s/test_cleanup" % self.reco.backup_dir
@@ -102,6 +250,24 @@ them out from list and check if list is empty"""
         self.reco._cleanup(fake_list)
         self.assertFalse(fake_list)
 
+    def test_detach_cleanup(self):
+        """Without helper leave cleanup is done by threads and manifest is
+gone when all files are removed"""
+        filename = "%s/test_detach_cleanup" % self.reco.backup_dir
+        open(filename,mode="w").close()
+        self.reco._leave_cleanup.append(filename)
+        self.reco._leave_cleanup.append(filename)
+        self.assertEqual(len(self.reco._leave_cleanup),1)
+        self.reco.cleanup_detach = False
+        try:
+            self.reco._detach_cleanup()
+        finally:
+            self.reco.cleanup_detach = True
+        self.assertFalse(self.reco._leave_cleanup)
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(os.path.exists(reco_cleanup.manifest_path(\
+                self.reco.backup_dir,os.getpid())))
+
     def test_session_recovered_true(self):
         """If session name match backup_pattern remove file and return True"""
         filename = "%s/%s.12345" % (self.reco.backup_dir,\
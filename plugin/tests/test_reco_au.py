@@ -94,6 +94,16 @@ swapchoice = r """
         vim.command('new')
         self.assertEqual(old_counter +1,__main__.reco._buffers_counter)
 
+    def test_disabled_stage_not_called(self):
+        """Stage in disabled_stages is skipped by BufAdd dispatch"""
+        __main__.reco._buf_add_increment_buffers_counter()
+        __main__.reco._vim_entered = True
+        __main__.reco.disabled_stages.add('increment_buffers_counter')
+        old_counter = __main__.reco._buffers_counter
+        vim.command('new')
+        __main__.reco.disabled_stages.discard('increment_buffers_counter')
+        self.assertEqual(old_counter,__main__.reco._buffers_counter)
+
     def test_buf_unload_decrement_buffers_counter(self):
         __main__.reco._buf_unload_decrement_buffers_counter()
         __main__.reco._vim_entered = True
@@ -115,6 +125,8 @@ swapchoice = r """
         self.assertFalse(os.path.exists(\
                 os.path.expanduser(__main__.reco.backup_name)))
         vim.command('quit')
+        #layout changes within snapshot_max_staleness are only marked dirty
+        __main__.reco.flush_backup_session()
         self.assertTrue(os.path.exists(\
                 os.path.expanduser(__main__.reco.backup_name)))
         os.remove(os.path.expanduser(__main__.reco.backup_name))
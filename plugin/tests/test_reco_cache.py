@@ -0,0 +1,134 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_cache
+import reco_copy
+import reco_store
+
+class Test_reco_copy_cache(unittest.TestCase):
+    """Backups of unchanged sources are found in cache, no Vim needed"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backup_dir = os.path.join(self.dir,'backup')
+        os.makedirs(self.backup_dir)
+        self.src = os.path.join(self.dir,'file.txt')
+        self.dst = os.path.join(self.backup_dir,self.src.replace('/','%'))
+        self._write('line\n' * 100)
+        self.engine = reco_copy.CopyEngine(1,4)
+
+    def tearDown(self):
+        self.engine.shutdown()
+        shutil.rmtree(self.dir)
+
+    def _write(self,data,mtime=None):
+        with open(self.src,'w') as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(self.src,(mtime,mtime))
+
+    def _copy(self,cache):
+        """Copy like Reco does, return True if it was skipped"""
+        key = cache.key(self.src)
+        if cache.unchanged(self.src,self.dst,key):
+            return True
+        job = self.engine.submit(self.src,self.dst)
+        cache.add(self.src,self.dst,key,job)
+        job.wait()
+        return False
+
+    def test_unchanged_skipped(self):
+        cache = reco_cache.CopyCache(self.backup_dir)
+        self.assertFalse(self._copy(cache))
+        self.assertTrue(self._copy(cache))
+        self.assertEqual((cache.hits,cache.misses),(1,1))
+
+    def test_changed_copied(self):
+        cache = reco_cache.CopyCache(self.backup_dir)
+        self._copy(cache)
+        self._write('other\n')
+        self.assertFalse(self._copy(cache))
+        with open(self.dst) as f:
+            self.assertEqual(f.read(),'other\n')
+
+    def test_missing_backup_copied(self):
+        cache = reco_cache.CopyCache(self.backup_dir)
+        self._copy(cache)
+        cache.save()
+        os.remove(self.dst)
+        self.assertFalse(self._copy(cache))
+
+    def test_checksum(self):
+        cache = reco_cache.CopyCache(self.backup_dir,checksum=True)
+        self._write('line\n',1000000)
+        self._copy(cache)
+        #same size and mtime, only checksum sees the change
+        inode = os.stat(self.src).st_ino
+        self._write('LINE\n',1000000)
+        self.assertEqual(os.stat(self.src).st_ino,inode)
+        self.assertFalse(self._copy(cache))
+        self.assertTrue(self._copy(cache))
+
+    def test_persisted(self):
+        cache = reco_cache.CopyCache(self.backup_dir)
+        self._copy(cache)
+        self.assertTrue(cache.save())
+        self.assertFalse(cache.save())
+        #next Vim reads cache and reuses backup
+        self.assertTrue(self._copy(reco_cache.CopyCache(self.backup_dir)))
+
+    def test_failed_copy_not_cached(self):
+        cache = reco_cache.CopyCache(self.backup_dir)
+        key = cache.key(self.src)
+        job = self.engine.submit(self.src,os.path.join(self.dir,'no','dst'))
+        job.wait()
+        cache.add(self.src,os.path.join(self.dir,'no','dst'),key,job)
+        cache.save()
+        self.assertEqual(cache.read(),{})
+
+    def test_pending_copy_is_unchanged(self):
+        cache = reco_cache.CopyCache(self.backup_dir)
+        key = cache.key(self.src)
+        cache.add(self.src,self.dst,key,None)
+        self.assertTrue(cache.unchanged(self.src,self.dst,key))
+
+    def test_missing_source(self):
+        cache = reco_cache.CopyCache(self.backup_dir)
+        self.assertEqual(cache.key(self.src + 'missing'),None)
+        self.assertFalse(cache.unchanged(self.src,self.dst,None))
+
+    def test_dedup_hit_holds_blob(self):
+        """Backup reused from cache by other session keeps its blob"""
+        first = reco_store.BlobStore(self.backup_dir,os.getpid())
+        engine = reco_copy.CopyEngine(1,4,first)
+        cache = reco_cache.CopyCache(self.backup_dir)
+        key = cache.key(self.src)
+        job = engine.submit(self.src,self.dst)
+        cache.add(self.src,self.dst,key,job)
+        job.wait()
+        engine.shutdown()
+        cache.save()
+        second = reco_store.BlobStore(self.backup_dir,os.getppid())
+        cache = reco_cache.CopyCache(self.backup_dir)
+        self.assertTrue(cache.unchanged(self.src,self.dst,cache.key(self.src)))
+        self.assertTrue(second.hold(self.dst))
+        blob = reco_store.resolve(self.dst)
+        first.release()
+        self.assertTrue(os.path.exists(blob))
+        second.release()
+        self.assertFalse(os.path.exists(blob))
+
+    def test_broken_index(self):
+        with open(os.path.join(self.backup_dir,reco_cache.INDEX_NAME),\
+                'w') as f:
+            f.write('[["a"],{')
+        cache = reco_cache.CopyCache(self.backup_dir)
+        self.assertEqual(cache.read(),{})
+        self.assertFalse(self._copy(cache))
+        cache.save()
+        self.assertEqual(list(cache.read()),[self.dst])
+
+if __name__ == '__main__':
+    unittest.main()
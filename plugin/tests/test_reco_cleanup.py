@@ -0,0 +1,132 @@
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_cleanup
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable,'-c','pass'])
+    process.wait()
+    return process.pid
+
+class Test_reco_cleanup(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _files(self,count,prefix='backup'):
+        paths = []
+        for i in range(count):
+            path = os.path.join(self.dir,'%s%d' % (prefix,i))
+            with open(path,'w') as f:
+                f.write('backup %d' % i)
+            paths.append(path)
+        return paths
+
+    def test_cleanup_set(self):
+        """Order of first append is kept and path is there only once"""
+        paths = reco_cleanup.CleanupSet(['a','b'])
+        paths.append('c')
+        paths.append('a')
+        self.assertEqual(list(paths),['a','b','c'])
+        self.assertTrue('b' in paths)
+        self.assertEqual(paths.pop(),'c')
+        paths.discard('a')
+        self.assertEqual(list(paths),['b'])
+        paths.clear()
+        self.assertFalse(paths)
+
+    def test_run_removes_all_and_manifest(self):
+        paths = self._files(20)
+        manifest = reco_cleanup.manifest_path(self.dir,12345)
+        reco_cleanup.write_manifest(manifest,paths + \
+                [os.path.join(self.dir,'missing')])
+        self.assertEqual(reco_cleanup.run(manifest,4),0)
+        self.assertEqual(os.listdir(self.dir),[])
+
+    def test_run_keeps_paths_outside_backup_dir(self):
+        outside = tempfile.NamedTemporaryFile(delete=False)
+        outside.close()
+        try:
+            manifest = reco_cleanup.manifest_path(self.dir,12345)
+            reco_cleanup.write_manifest(manifest,[outside.name])
+            reco_cleanup.run(manifest)
+            self.assertTrue(os.path.exists(outside.name))
+        finally:
+            os.remove(outside.name)
+
+    def test_deadline_leaves_rest_in_manifest(self):
+        paths = self._files(10)
+        manifest = reco_cleanup.manifest_path(self.dir,12345)
+        reco_cleanup.write_manifest(manifest,paths)
+        self.assertEqual(reco_cleanup.run(manifest,2,deadline=0),10)
+        self.assertEqual(reco_cleanup.read_manifest(manifest),paths)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_broken_manifest(self):
+        manifest = reco_cleanup.manifest_path(self.dir,12345)
+        with open(manifest,'w') as f:
+            f.write('["half')
+        self.assertEqual(reco_cleanup.read_manifest(manifest),[])
+        self.assertEqual(reco_cleanup.run(manifest),0)
+        self.assertFalse(os.path.exists(manifest))
+
+    def test_detach(self):
+        """Helper removes backups after caller is gone"""
+        paths = self._files(5)
+        manifest = reco_cleanup.manifest_path(self.dir,os.getpid())
+        reco_cleanup.write_manifest(manifest,paths)
+        self.assertTrue(reco_cleanup.detach(manifest,sys.executable))
+        deadline = time.time() + 10
+        while os.listdir(self.dir) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(os.listdir(self.dir),[])
+
+    def test_resume_interrupted(self):
+        """Manifests of dead Vims are finished, of living ones are not"""
+        dead = self._files(3,'dead')
+        alive = self._files(3,'alive')
+        reco_cleanup.write_manifest(\
+                reco_cleanup.manifest_path(self.dir,_dead_pid()),dead)
+        mine = reco_cleanup.manifest_path(self.dir,os.getpid())
+        reco_cleanup.write_manifest(mine,alive)
+        thread = reco_cleanup.resume(self.dir,os.getpid())
+        thread.join()
+        self.assertFalse(any(os.path.exists(path) for path in dead))
+        self.assertTrue(all(os.path.exists(path) for path in alive))
+        self.assertEqual(sorted(os.listdir(self.dir)),\
+                sorted([os.path.basename(mine)] + \
+                [os.path.basename(path) for path in alive]))
+        self.assertTrue(reco_cleanup.resume(self.dir,os.getpid()) is None)
+
+    def test_locked_manifest_left_to_helper(self):
+        """Manifest of dead Vim which helper still works on isn't resumed"""
+        paths = self._files(3)
+        manifest = reco_cleanup.manifest_path(self.dir,_dead_pid())
+        reco_cleanup.write_manifest(manifest,paths)
+        helper = subprocess.Popen([sys.executable,'-c','import sys,fcntl,'\
+                'time; f = open(sys.argv[1]); fcntl.flock(f.fileno(),'\
+                'fcntl.LOCK_EX); print(1); sys.stdout.flush(); '\
+                'sys.stdin.read()',manifest],stdin=subprocess.PIPE,\
+                stdout=subprocess.PIPE)
+        try:
+            helper.stdout.readline()
+            self.assertEqual(reco_cleanup.interrupted(self.dir,os.getpid()),\
+                    [])
+            self.assertEqual(reco_cleanup.run(manifest),3)
+            self.assertTrue(all(os.path.exists(path) for path in paths))
+        finally:
+            helper.communicate()
+        self.assertEqual(reco_cleanup.interrupted(self.dir,os.getpid()),\
+                [manifest])
+        self.assertEqual(reco_cleanup.run(manifest),0)
+        self.assertFalse(os.path.exists(manifest))
+
+if __name__ == '__main__':
+    unittest.main()
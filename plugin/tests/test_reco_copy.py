@@ -0,0 +1,136 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_copy
+class Test_reco_copy_engine(unittest.TestCase):
+    """Background copies, no Vim needed"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = reco_copy.CopyEngine(2,4)
+
+    def tearDown(self):
+        self.engine.shutdown()
+        shutil.rmtree(self.dir)
+
+    def _file(self,name,data):
+        path = os.path.join(self.dir,name)
+        with open(path,'wb') as f:
+            f.write(data)
+        return path
+
+    def test_copy_content_and_mode(self):
+        src = self._file('src',b'x' * (reco_copy.CHUNK_SIZE + 10))
+        os.chmod(src,0o600)
+        dst = os.path.join(self.dir,'dst')
+        job = self.engine.submit(src,dst)
+        self.assertTrue(self.engine.wait(dst))
+        self.assertEqual(job.bytes_copied,reco_copy.CHUNK_SIZE + 10)
+        with open(dst,'rb') as f:
+            self.assertEqual(f.read(),b'x' * (reco_copy.CHUNK_SIZE + 10))
+        self.assertEqual(os.stat(dst).st_mode & 0o777,0o600)
+        self.assertEqual(int(os.stat(dst).st_mtime),\
+                int(os.stat(src).st_mtime))
+        #counters are final once workers are stopped
+        self.engine.shutdown()
+        self.assertEqual((self.engine.copies,self.engine.bytes_copied),\
+                (1,reco_copy.CHUNK_SIZE + 10))
+
+    def test_source_removed_after_submit(self):
+        """Swap is deleted by Vim right after SwapExists, copy must survive"""
+        src = self._file('swap',b'swap data')
+        dst = os.path.join(self.dir,'swap_copy')
+        self.engine.submit(src,dst)
+        os.remove(src)
+        self.assertTrue(self.engine.wait(dst))
+        with open(dst,'rb') as f:
+            self.assertEqual(f.read(),b'swap data')
+
+    def test_missing_source_is_failed_job(self):
+        dst = os.path.join(self.dir,'dst')
+        job = self.engine.submit(os.path.join(self.dir,'no_such'),dst)
+        self.assertTrue(job.error)
+        self.assertFalse(self.engine.wait(dst))
+        self.assertEqual(self.engine.failed(),[job])
+        self.assertEqual(self.engine.failed(),[])
+
+    def test_wait_for_unknown_path(self):
+        self.assertTrue(self.engine.wait(os.path.join(self.dir,'unknown')))
+
+    def test_same_dst_copied_in_order(self):
+        dst = os.path.join(self.dir,'dst')
+        for i in range(5):
+            self.engine.submit(self._file('src%d' % i,b'%d' % i),dst)
+        self.assertTrue(self.engine.wait(dst))
+        with open(dst,'rb') as f:
+            self.assertEqual(f.read(),b'4')
+
+    def test_cancel_removes_partial_copy(self):
+        src = self._file('src',b'data')
+        dst = os.path.join(self.dir,'dst')
+        job = reco_copy.CopyJob(src,dst)
+        job.cancel()
+        job.run()
+        self.assertTrue(isinstance(job.error,reco_copy.CopyCancelled))
+        self.assertFalse(os.path.exists(dst))
+
+class Test_reco_copy_backend(unittest.TestCase):
+    """Strategy detection and fallbacks"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = reco_copy.backend_for(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_detected_once_per_dir(self):
+        self.assertTrue(self.backend is reco_copy.backend_for(self.dir + '/'))
+        self.assertEqual(self.backend.names()[-1],'userspace')
+        self.assertFalse([f for f in os.listdir(self.dir)])
+
+    def test_each_strategy_copies_content(self):
+        data = os.urandom(3 * reco_copy.CHUNK_SIZE + 7)
+        src = os.path.join(self.dir,'src')
+        with open(src,'wb') as f:
+            f.write(data)
+        for name,copy in self.backend.strategies:
+            dst = os.path.join(self.dir,name)
+            with open(src,'rb') as source:
+                with open(dst,'wb') as target:
+                    copy(source,target,len(data),lambda: False)
+            with open(dst,'rb') as f:
+                self.assertEqual(f.read(),data,name)
+
+    def test_fallback_to_next_strategy(self):
+        def unsupported(source,target,size,cancelled):
+            target.write(b'garbage')
+            raise OSError(reco_copy.errno.EXDEV,'cross device')
+        backend = reco_copy.CopyBackend(self.dir)
+        backend.strategies.insert(0,('broken',unsupported))
+        src = os.path.join(self.dir,'src')
+        with open(src,'wb') as f:
+            f.write(b'data')
+        with open(src,'rb') as source:
+            with open(os.path.join(self.dir,'dst'),'w+b') as target:
+                name = backend.copy(source,target,4)
+                target.seek(0)
+                self.assertEqual(target.read(),b'data')
+        self.assertNotEqual(name,'broken')
+
+    def test_link_swap_of_dead_vim(self):
+        engine = reco_copy.CopyEngine()
+        src = os.path.join(self.dir,'swap')
+        with open(src,'wb') as f:
+            f.write(b'swap')
+        dst = os.path.join(self.dir,'swap_copy')
+        job = engine.submit(src,dst,link=True)
+        if self.backend.can_link:
+            self.assertTrue(job.done())
+            self.assertEqual(job.strategy,'hardlink')
+        os.remove(src)
+        self.assertTrue(engine.wait(dst))
+        with open(dst,'rb') as f:
+            self.assertEqual(f.read(),b'swap')
+        engine.shutdown()
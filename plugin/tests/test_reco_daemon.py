@@ -0,0 +1,238 @@
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+sys.path.append(PLUGIN_DIR)
+import reco_copy
+import reco_daemon
+import reco_store
+from test_reco_swap import _find_vim
+
+#one Vim: copies file through daemon, registers session and waits for copy
+CLIENT = '''
+import sys,os
+sys.path.append(%r)
+import reco_daemon
+client = reco_daemon.connect(%r)
+src,dst = sys.argv[1:]
+client.submit(src,dst)
+client.register(os.getpid(),dst + '.session')
+sys.exit(0 if client.wait(dst) else 1)
+'''
+
+def _wait_until(condition,timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class Test_reco_daemon(unittest.TestCase):
+    """Daemon in this process, clients talk to it over socket, no Vim
+needed"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backup_dir = os.path.join(self.dir,'backup')
+        self.daemon = reco_daemon.Daemon(self.backup_dir,2)
+        self.daemon.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.daemon.stop()
+        shutil.rmtree(self.dir)
+
+    def _connect(self):
+        client = reco_daemon.connect(self.backup_dir)
+        if client is not None:
+            self.clients.append(client)
+        return client
+
+    def _file(self,name,data):
+        path = os.path.join(self.dir,name)
+        with open(path,'wb') as f:
+            f.write(data)
+        return path
+
+    def _backup(self,name):
+        return os.path.join(self.backup_dir,name)
+
+    def test_copy(self):
+        client = self._connect()
+        src = self._file('src',b'x' * 100000)
+        job = client.submit(src,self._backup('dst'))
+        self.assertTrue(job.wait())
+        self.assertTrue(client.wait(self._backup('dst')))
+        with open(self._backup('dst'),'rb') as f:
+            self.assertEqual(f.read(),b'x' * 100000)
+        self.assertEqual((client.copies,client.bytes_copied),(1,100000))
+
+    def test_missing_source_fails_at_submit(self):
+        client = self._connect()
+        job = client.submit(os.path.join(self.dir,'missing'),\
+                self._backup('dst'))
+        self.assertTrue(job.error is not None)
+        self.assertFalse(job.wait())
+
+    def test_source_removed_after_submit(self):
+        """Source is opened before submit returns, same as CopyEngine"""
+        client = self._connect()
+        src = self._file('swap',b'swap data')
+        client.submit(src,self._backup('dst.swp'))
+        os.remove(src)
+        self.assertTrue(client.wait(self._backup('dst.swp')))
+        with open(self._backup('dst.swp'),'rb') as f:
+            self.assertEqual(f.read(),b'swap data')
+
+    def test_same_copy_of_two_clients_is_shared(self):
+        src = self._file('src',b'data')
+        dst = self._backup('dst')
+        #no worker yet, so first copy is still queued for second client
+        self.daemon.engine.workers = 0
+        first = self._connect()
+        second = self._connect()
+        first.submit(src,dst)
+        second.submit(src,dst)
+        self.assertEqual(self.daemon.stats['copies'],1)
+        self.assertEqual(self.daemon.stats['deduplicated'],1)
+        #first Vim quits, second one still needs the copy
+        first.cleanup([])
+        self.daemon.engine.workers = 1
+        self.daemon.engine._start_workers()
+        self.assertTrue(second.wait(dst))
+        self.assertTrue(os.path.exists(dst))
+
+    def test_dedup_store_per_session(self):
+        self.daemon.dedup = True
+        first = self._connect()
+        second = self._connect()
+        src = self._file('src',b'same content')
+        for client,name in ((first,'a'),(second,'b')):
+            self.assertTrue(client.submit(src,self._backup(name)).wait())
+        with open(reco_store.resolve(self._backup('b')),'rb') as f:
+            self.assertEqual(f.read(),b'same content')
+        stores = self.daemon._stores
+        self.assertEqual(sum(store.skipped for store in stores.values()),1)
+
+    def test_cleanup_and_sessions(self):
+        client = self._connect()
+        other = self._connect()
+        backup = self._file('backup/vim_backup.%d' % os.getpid(),b'')
+        client.register(os.getpid(),backup)
+        other.register(999999,self._backup('vim_backup.999999'))
+        sessions = client.sessions()
+        self.assertEqual([(s['pid'],s['alive']) for s in sessions],\
+                [(os.getpid(),True),(999999,False)])
+        self.assertTrue(client.cleanup([backup]))
+        self.assertTrue(_wait_until(lambda: not os.path.exists(backup)))
+        self.assertEqual([s['pid'] for s in other.sessions()],[999999])
+
+    def test_fallback_when_daemon_is_gone(self):
+        client = self._connect()
+        self.daemon.stop()
+        self.assertTrue(self._connect() is None)
+        src = self._file('src',b'local')
+        job = client.submit(src,self._backup('dst'))
+        self.assertTrue(isinstance(job,reco_copy.CopyJob))
+        self.assertTrue(client.wait(self._backup('dst')))
+        self.assertFalse(client.cleanup([self._backup('dst')]))
+        client.shutdown()
+
+    def test_fallback_when_daemon_fails(self):
+        client = self._connect()
+        def handle(request,client):
+            raise RuntimeError('broken daemon')
+        self.daemon.handle = handle
+        src = self._file('src',b'local')
+        job = client.submit(src,self._backup('dst'))
+        self.assertTrue(isinstance(job,reco_copy.CopyJob))
+        self.assertTrue(client.wait(self._backup('dst')))
+        self.assertFalse(client.connected)
+        self.assertEqual(client.failed(),[])
+        client.shutdown()
+
+    def test_stale_socket_and_second_daemon(self):
+        self.assertRaises(reco_daemon.DaemonError,\
+                reco_daemon.Daemon(self.backup_dir).start)
+        self.daemon.stop()
+        with open(reco_daemon.socket_path(self.backup_dir),'w') as f:
+            f.write('')
+        self.daemon = reco_daemon.Daemon(self.backup_dir)
+        self.daemon.start()
+        self.assertTrue(self._connect() is not None)
+
+    def test_several_processes(self):
+        """Each process is one Vim instance with its own copy"""
+        processes = []
+        for i in range(4):
+            src = self._file('src%d' % i,b'%d' % i * 1000)
+            processes.append(subprocess.Popen([sys.executable,'-c',\
+                    CLIENT % (PLUGIN_DIR,self.backup_dir),src,\
+                    self._backup('dst%d' % i)]))
+        self.assertEqual([p.wait() for p in processes],[0] * 4)
+        for i in range(4):
+            with open(self._backup('dst%d' % i),'rb') as f:
+                self.assertEqual(f.read(),b'%d' % i * 1000)
+        self.assertEqual(self.daemon.stats['clients'],4)
+        self.assertEqual(len(self.daemon.sessions),4)
+
+@unittest.skipIf(_find_vim() is None or subprocess.call([_find_vim(),'-u',\
+        'NONE','-N','-es','-i','NONE','-c',\
+        "if !has('python') | cquit | endif",'-c','qa!']) != 0,\
+        'no vim with +python in PATH')
+class Test_reco_daemon_vims(unittest.TestCase):
+    """Several headless Vims with Reco use one daemon"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backup_dir = os.path.join(self.dir,'backup')
+        self.daemon = reco_daemon.Daemon(self.backup_dir,2)
+        self.daemon.start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        shutil.rmtree(self.dir)
+
+    def _vim(self,path,result):
+        #autocommands call reco.dispatch(), instance is bound to reco as in
+        #plugin/reco.vim so VimLeave reaches it
+        commands = ['python import sys,os; sys.path.append(%r)' % PLUGIN_DIR,\
+                'python import reco as _reco_module; '\
+                'reco = _reco_module.Reco(%r); reco.daemon = 1' % \
+                self.backup_dir,'python reco._make_init_backup()',\
+                'python reco._queue_copy(%r,reco._backup_path(%r))' % \
+                (path,path),"python open(%r,'w').write(str(reco."\
+                "_wait_for_copy(reco._backup_path(%r))))" % (result,path),\
+                'qa!']
+        args = [_find_vim(),'-u','NONE','-N','-es','-i','NONE',path]
+        for command in commands:
+            args += ['-c',command]
+        return subprocess.Popen(args)
+
+    def test_vims_share_daemon(self):
+        vims = []
+        for i in range(3):
+            path = os.path.join(self.dir,'file%d.txt' % i)
+            with open(path,'w') as f:
+                f.write('file %d\n' % i)
+            vims.append((path,path + '.result',\
+                    self._vim(path,path + '.result')))
+        for path,result,process in vims:
+            process.wait()
+            with open(result) as f:
+                self.assertEqual(f.read(),'True')
+            with open(os.path.join(self.backup_dir,\
+                    path.replace('/','%'))) as f:
+                self.assertEqual(f.read(),'file %s\n' % path[-5])
+        self.assertEqual(self.daemon.stats['clients'],3)
+        self.assertEqual(self.daemon.stats['copies'],3)
+        #Vims quit, sessions are cleaned up by daemon
+        self.assertTrue(_wait_until(lambda: not self.daemon.sessions))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import sys
+import os
+import random
+import difflib
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_diff
+
+def _apply(a,b,hunks):
+    """Apply hunks to a, must give b"""
+    result = []
+    ai = 0
+    for a_start,a_count,b_start,b_count in hunks:
+        result += a[ai:a_start] + b[b_start:b_start + b_count]
+        ai = a_start + a_count
+    return result + a[ai:]
+
+class Test_reco_diff(unittest.TestCase):
+    """Linear space diff, no Vim needed"""
+    def test_hunks(self):
+        a = ['a','b','c','d','e']
+        b = ['a','x','c','d','e','f']
+        hunks,timed_out = reco_diff.diff(a,b)
+        self.assertEqual(hunks,[(1,1,1,1),(5,0,5,1)])
+        self.assertFalse(timed_out)
+
+    def test_same_and_empty(self):
+        self.assertEqual(reco_diff.diff(['a'],['a']),([],False))
+        self.assertEqual(reco_diff.diff([],['a','b']),([(0,0,0,2)],False))
+        self.assertEqual(reco_diff.diff(['a'],[]),([(0,1,0,0)],False))
+
+    def test_random_minimal(self):
+        """Hunks turn a into b and are never longer than difflib edits"""
+        rand = random.Random(7)
+        for i in range(500):
+            a = [rand.choice('abc') for j in range(rand.randint(0,25))]
+            b = [rand.choice('abc') for j in range(rand.randint(0,25))]
+            hunks,timed_out = reco_diff.diff(a,b)
+            self.assertEqual(_apply(a,b,hunks),b)
+            edits = sum(a_count + b_count for s,a_count,t,b_count in hunks)
+            opcodes = difflib.SequenceMatcher(None,a,b,False).get_opcodes()
+            self.assertTrue(edits <= sum(i2 - i1 + j2 - j1 for \
+                    tag,i1,i2,j1,j2 in opcodes if tag != 'equal'))
+
+    def test_timeout_still_correct(self):
+        rand = random.Random(3)
+        a = [str(rand.random()) for i in range(3000)]
+        b = [str(rand.random()) for i in range(3000)]
+        hunks,timed_out = reco_diff.diff(a,b,0)
+        self.assertTrue(timed_out)
+        self.assertEqual(_apply(a,b,hunks),b)
+
+    def test_summary(self):
+        lines,targets = reco_diff.summary([(0,1,0,5)],[b'a'],\
+                [b'1',b'2',b'3',b'4',b'5'],3)
+        self.assertEqual(lines,[b'@@ -1,1 +1,5 @@',b'-a',b'+1',b'+2',\
+                b'+3',b'+ ... 2 more lines'])
+        self.assertEqual(targets,[1,1,1,2,3,1])
+
+class Test_reco_diff_job(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self,name,lines):
+        path = os.path.join(self.dir,name)
+        with open(path,'wb') as f:
+            f.write(b''.join(line + b'\n' for line in lines))
+        return path
+
+    def test_job(self):
+        before = [('line %d' % i).encode('ascii') for i in range(20000)]
+        after = list(before)
+        after[100] = b'changed'
+        del after[5000]
+        job = reco_diff.DiffJob(self._write('before',before),\
+                self._write('after',after),10)
+        self.assertTrue(job.wait(30))
+        self.assertEqual(job.hunks,[(100,1,100,1),(5000,1,5000,0)])
+        lines,targets = job.summary()
+        self.assertEqual(lines[:3],[b'@@ -101,1 +101,1 @@',b'-line 100',\
+                b'+changed'])
+        self.assertEqual(targets[3],5000)
+
+    def test_job_error(self):
+        job = reco_diff.DiffJob(os.path.join(self.dir,'missing'),\
+                self._write('after',[b'a']))
+        self.assertFalse(job.wait(30))
+        self.assertTrue(job.error is not None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_index
+
+class Counter(reco_index.JsonIndex):
+    """Smallest index, name -> count"""
+    def __init__(self,backup_dir):
+        reco_index.JsonIndex.__init__(self,backup_dir,'counter.json',\
+                'counter.lock')
+
+    def read(self):
+        values = self._load()
+        return values if isinstance(values,dict) else {}
+
+    def _dump(self,entries):
+        return entries
+
+    def add(self,name):
+        with self._update() as entries:
+            entries[name] = entries.get(name,0) + 1
+
+class Test_reco_json_index(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backup_dir = os.path.join(self.dir,'backup')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_update(self):
+        index = Counter(self.backup_dir)
+        self.assertEqual(index.read(),{})
+        index.add('a')
+        index.add('a')
+        self.assertEqual(Counter(self.backup_dir).read(),{'a':2})
+        self.assertEqual(index.writes,2)
+        self.assertEqual(sorted(os.listdir(self.backup_dir)),\
+                ['counter.json','counter.lock'])
+
+    def test_broken_index(self):
+        index = Counter(self.backup_dir)
+        os.makedirs(self.backup_dir)
+        with open(index.path,'w') as f:
+            f.write('{"a":')
+        self.assertEqual(index._load(),None)
+        index.add('b')
+        self.assertEqual(index.read(),{'b':1})
+
+    def test_concurrent_updates(self):
+        """Updates of several indexes on one file don't lose entries"""
+        def add():
+            index = Counter(self.backup_dir)
+            for i in range(50):
+                index.add('a')
+        threads = [threading.Thread(target=add) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Counter(self.backup_dir).read(),{'a':200})
+
+if __name__ == '__main__':
+    unittest.main()
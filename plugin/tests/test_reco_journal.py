@@ -0,0 +1,105 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_journal
+from test_reco_swap import _find_vim
+class Test_reco_journal(unittest.TestCase):
+    """Journal records and writes, no Vim needed"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal = reco_journal.Journal(\
+                reco_journal.journal_path(os.path.join(self.dir,'backup.1')))
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.dir)
+
+    def test_vim_literal(self):
+        self.assertEqual(reco_journal.vim_literal("it's"),"'it''s'")
+        self.assertEqual(reco_journal.vim_literal(['a',['b']]),"['a',['b']]")
+
+    def test_layout_record(self):
+        record = reco_journal.layout_record('1','2',['row',[['leaf','1000'],\
+                ['leaf','1001']]],'2','1resize 5|',{'1000':'/a','1001':''})
+        self.assertEqual(record,"call s:Layout(1,2,['row',[['leaf','/a'],"\
+                "['leaf','']]],2,'1resize 5|')")
+
+    def test_append_skips_same_record(self):
+        self.assertTrue(self.journal.append('badd a'))
+        self.assertFalse(self.journal.append('badd a'))
+        self.assertTrue(self.journal.append('badd b'))
+        self.assertEqual((self.journal.records,self.journal.appended),(2,2))
+        with open(self.journal.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[-2:],['badd a','badd b'])
+        self.assertTrue(lines[0].startswith('" Reco layout journal'))
+
+    def test_sync_only_when_needed(self):
+        self.journal.sync()
+        self.assertEqual(self.journal.syncs,0)
+        for i in range(10):
+            self.journal.append('badd %d' % i)
+        self.journal.sync()
+        self.journal.sync()
+        self.assertEqual(self.journal.syncs,1)
+
+    def test_reset_compacts(self):
+        self.journal.append('badd a')
+        self.journal.reset()
+        self.assertEqual((self.journal.records,self.journal.appended),(0,1))
+        with open(self.journal.path) as f:
+            self.assertEqual(f.read(),reco_journal.HEADER)
+
+@unittest.skipIf(_find_vim() is None,'vim not in PATH')
+class Test_reco_journal_replay(unittest.TestCase):
+    """Session checkpoint with journal loaded by local Vim"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.session = os.path.join(self.dir,'backup.1')
+        self.files = [os.path.join(self.dir,name) for name in 'abc']
+        for name in self.files:
+            open(name,'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _vim(self,*commands):
+        args = [_find_vim(),'-u','NONE','-N','-es','-i','NONE']
+        for command in commands + ('qa!',):
+            args += ['-c',command]
+        subprocess.call(args)
+
+    def test_replay(self):
+        self._vim('edit %s' % self.files[0],'mksession! %s' % self.session)
+        journal = reco_journal.Journal(\
+                reco_journal.journal_path(self.session))
+        journal.reset()
+        reco_journal.append_footer(self.session,journal.path)
+        a,b,c = self.files
+        journal.append(reco_journal.buffer_record('badd',c))
+        journal.append(reco_journal.layout_record(1,1,['row',[['leaf','1'],\
+                ['col',[['leaf','2'],['leaf','3']]]]],3,'',\
+                {'1':a,'2':b,'3':c}))
+        journal.append(reco_journal.layout_record(2,2,['leaf','4'],1,'',\
+                {'4':b}))
+        journal.close()
+        result = os.path.join(self.dir,'result')
+        self._vim('source %s' % self.session,"call writefile(["\
+                "string(tabpagenr('$')),bufname(winbufnr(1)),"\
+                "string(exists('g:SessionLoad')),'x'],'%s')" % result,\
+                'tabnext 1',"call writefile([string(map(tabpagebuflist(),"\
+                "'bufname(v:val)')),string(winnr()),winlayout()[0]],'%s.1')" \
+                % result)
+        with open(result) as f:
+            self.assertEqual(f.read().splitlines(),['2',b,'0','x'])
+        with open(result + '.1') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(eval(lines[0]),[a,b,c])
+        self.assertEqual(lines[1:],['3','row'])
+
+if __name__ == '__main__':
+    unittest.main()
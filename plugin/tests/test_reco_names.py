@@ -0,0 +1,74 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_names
+BUFFER_PATTERN = r'(^[\\a-zA-Z0-9_\./]*%s\d+\.)(\d+)' % 'tmp_buf'
+BACKUP_PATTERN = r'(^[\\a-zA-Z0-9_\./]*%s\.)(\d+)' % 'reco_backup'
+class Test_reco_names(unittest.TestCase):
+    """Buffer name classification, no Vim needed"""
+    def setUp(self):
+        self.names = reco_names.NameClassifier(BUFFER_PATTERN,BACKUP_PATTERN)
+
+    def test_scratch_parts(self):
+        scratch = self.names.scratch('/home/user/tmp_buf12.345')
+        self.assertEqual(scratch.prefix,'/home/user/tmp_buf12.')
+        self.assertEqual(scratch.counter,12)
+        self.assertEqual(scratch.pid,'345')
+        self.assertEqual(scratch.name,'/home/user/tmp_buf12.345')
+
+    def test_not_scratch(self):
+        self.assertTrue(self.names.scratch('/home/user/file.txt') is None)
+        self.assertTrue(self.names.scratch('') is None)
+
+    def test_cached_by_bufnr_and_name(self):
+        first = self.names.scratch('tmp_buf1.10',3)
+        self.assertTrue(self.names.scratch('tmp_buf1.10',3) is first)
+        self.assertEqual((self.names.hits,self.names.misses),(1,1))
+        #other name for same buffer is classified again
+        self.assertEqual(self.names.scratch('tmp_buf1.11',3).pid,'11')
+        self.assertEqual(self.names.misses,2)
+        self.assertTrue(self.names.scratch('file.txt',3) is None)
+
+    def test_forget(self):
+        self.names.scratch('tmp_buf1.10',3)
+        self.names.forget(3)
+        self.names.forget(4)
+        self.assertEqual(len(self.names),0)
+        self.names.scratch('tmp_buf1.10',3)
+        self.assertEqual(self.names.misses,2)
+
+    def test_session_pid(self):
+        self.assertEqual(self.names.session_pid(\
+                '/home/user/.vim/backup/reco_backup.4242'),'4242')
+        self.assertTrue(self.names.session_pid('/home/user/Session.vim') \
+                is None)
+
+class Test_reco_buffer_index(unittest.TestCase):
+    """Buffer number lookup by name"""
+    def setUp(self):
+        self.index = reco_names.BufferIndex([(1,''),(2,'/tmp/a'),\
+                (3,'/tmp/tmp_buf1.10')])
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('/tmp/a'),2)
+        self.assertEqual(self.index.lookup('/tmp/tmp_buf1.10'),3)
+        self.assertTrue(self.index.lookup('') is None)
+        self.assertTrue(self.index.lookup('/tmp/b') is None)
+        self.assertEqual(len(self.index),3)
+
+    def test_rename(self):
+        self.index.add(1,'tmp_buf2.10')
+        self.index.add(3,'/tmp/tmp_buf1.11')
+        self.assertEqual(self.index.lookup('tmp_buf2.10'),1)
+        self.assertEqual(self.index.lookup('/tmp/tmp_buf1.11'),3)
+        self.assertTrue(self.index.lookup('/tmp/tmp_buf1.10') is None)
+
+    def test_remove(self):
+        self.index.remove(2)
+        self.index.remove(5)
+        self.assertTrue(self.index.lookup('/tmp/a') is None)
+        self.assertEqual(len(self.index),2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_recover
+from test_reco_swap import _find_vim
+
+@unittest.skipIf(_find_vim() is None,'vim not in PATH')
+class Test_reco_bulk_recovery(unittest.TestCase):
+    """Swaps of killed headless Vims are staged and recovered"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backup_dir = os.path.join(self.dir,'backup')
+        self.files = []
+        for i in range(3):
+            name = os.path.join(self.dir,'file%d.txt' % i)
+            with open(name,'w') as f:
+                f.write(''.join('line %d\n' % n for n in range(1000)))
+            self.files.append(name)
+            self._crash_vim(name,i)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _crash_vim(self,name,i):
+        """Edit file, write swap and kill Vim so swap stays behind"""
+        with open(os.devnull,'w') as null:
+            subprocess.call([_find_vim(),'-u','NONE','-N','-es','-i','NONE',\
+                    '-c','set dir=%s' % self.dir,'-c','edit %s' % name,\
+                    '-c','1,5d','-c','call append(0,["recovered %d"])' % i,\
+                    '-c','preserve',\
+                    '-c',"call system('kill -9 ' . getpid())"],\
+                    stdout=null,stderr=null)
+
+    def _check_recovered(self):
+        for i,name in enumerate(self.files):
+            with open(name) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0],'recovered %d' % i)
+            self.assertEqual(len(lines),996)
+            self.assertFalse(os.path.exists(name + '.swp'))
+            mangled = os.path.join(self.backup_dir,name.replace('/','%'))
+            with open(mangled) as f:
+                self.assertEqual(f.readline(),'line 0\n')
+            self.assertTrue(os.path.exists(mangled + '.swp'))
+
+    def test_group_by_dead_pid(self):
+        groups,skipped = reco_recover.group_swaps([self.dir],\
+                self.backup_dir,'vim_backup','scratch')
+        self.assertEqual(len(groups),3)
+        self.assertEqual(sorted(task.target for tasks in groups.values() \
+                for task in tasks),self.files)
+
+    def _main(self,args):
+        """Run main with its report kept out of test output, return exit
+status and report"""
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            code = reco_recover.main(['--dir',self.dir,\
+                    '--backup-dir',self.backup_dir] + args)
+            return code,sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_native_recovery(self):
+        code,report = self._main(['-j','2'])
+        self.assertEqual(code,0)
+        self.assertTrue('recovered 3/3 files' in report)
+        self._check_recovered()
+
+    def test_vim_recovery(self):
+        code,report = self._main(['--engine','vim','--vim',_find_vim()])
+        self.assertEqual(code,0)
+        self.assertTrue('recovered 3/3 files' in report)
+        self._check_recovered()
+
+    def test_vim_recovery_special_name(self):
+        """Target name is escaped for :write inside Vim"""
+        groups,skipped = reco_recover.group_swaps([self.dir],\
+                self.backup_dir,'vim_backup','scratch')
+        os.makedirs(self.backup_dir)
+        task = reco_recover.stage(list(groups.values())[0],1)[0]
+        task.target = os.path.join(self.dir,"it's %a #b.txt")
+        reco_recover.recover_vim(task,_find_vim())
+        with open(task.target) as f:
+            self.assertEqual(len(f.read().splitlines()),996)
+
+    def test_dry_run(self):
+        code,report = self._main(['-n'])
+        self.assertEqual(code,0)
+        for name in self.files:
+            self.assertTrue(os.path.exists(name + '.swp'))
@@ -0,0 +1,95 @@
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_registry
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable,'-c','pass'])
+    process.wait()
+    return process.pid
+
+class Test_reco_registry(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.registry = reco_registry.Registry(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _session(self,pid):
+        path = os.path.join(self.dir,'vim_backup.%d' % pid)
+        with open(path,'w') as f:
+            f.write('" session')
+        return path
+
+    def test_register_heartbeat_unregister(self):
+        pid = os.getpid()
+        session = self._session(pid)
+        self.assertEqual(self.registry.register(pid,session,['a']),[])
+        entry = self.registry.read()[pid]
+        self.assertEqual((entry.session,entry.backups),(session,['a']))
+        self.assertTrue(entry.alive())
+        self.assertTrue(self.registry.heartbeat(pid,['a','b']))
+        self.assertEqual(self.registry.read()[pid].backups,['a','b'])
+        self.registry.unregister(pid)
+        self.assertEqual(self.registry.read(),{})
+        self.assertFalse(self.registry.heartbeat(pid))
+
+    def test_orphans_newest_first(self):
+        """Dead Vims with session are offered newest first, dead without
+session are dropped at register"""
+        old,new,gone = _dead_pid(),_dead_pid(),_dead_pid()
+        now = time.time()
+        self.registry.register(old,self._session(old),start=now - 100)
+        self.registry.register(new,self._session(new),start=now - 10)
+        self.registry.register(gone,os.path.join(self.dir,'missing'))
+        sessions = self.registry.read()
+        sessions[old].heartbeat = now - 50
+        sessions[new].heartbeat = now - 5
+        self.registry._write(sessions)
+        self.assertEqual([entry.pid for entry in \
+                self.registry.orphans(os.getpid())],[new,old])
+        orphans = self.registry.register(os.getpid(),\
+                self._session(os.getpid()))
+        self.assertEqual([entry.pid for entry in orphans],[new,old])
+        self.assertEqual(sorted(self.registry.read()),\
+                sorted([old,new,os.getpid()]))
+
+    def test_reused_pid_is_dead(self):
+        """Process which started after its entry was written is not the
+Vim of entry"""
+        if reco_registry.process_start(os.getpid()) is None:
+            self.skipTest('no process start time on this system')
+        entry = reco_registry.Session(os.getpid(),time.time() - 3600,'')
+        self.assertFalse(entry.alive())
+
+    def test_broken_registry(self):
+        with open(self.registry.path,'w') as f:
+            f.write('{"1": {"start"')
+        self.assertEqual(self.registry.read(),{})
+        with open(self.registry.path,'w') as f:
+            f.write('{"x": {}, "2": {"start": 1}}')
+        self.assertEqual(self.registry.read(),{})
+        self.registry.register(os.getpid(),self._session(os.getpid()))
+        self.assertEqual(list(self.registry.read()),[os.getpid()])
+
+    def test_concurrent_updates(self):
+        """Each process adds its own entry, no update is lost"""
+        code = ('import sys; sys.path.append(%r); import reco_registry, os; '\
+                'r = reco_registry.Registry(%r)\n'\
+                'for i in range(20): r.heartbeat(os.getpid()) or '\
+                'r.register(os.getpid(),"s")' % (os.path.join(\
+                os.path.dirname(os.path.abspath(__file__)),'..'),self.dir))
+        processes = [subprocess.Popen([sys.executable,'-c',code,]) \
+                for i in range(4)]
+        pids = [process.pid for process in processes]
+        self.assertEqual([process.wait() for process in processes],[0] * 4)
+        self.assertEqual(sorted(self.registry.read()),sorted(pids))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_retention
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable,'-c','pass'])
+    process.wait()
+    return process.pid
+
+class Test_reco_retention(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = reco_retention.RetentionStore(self.dir,1000,3)
+        self.dead = _dead_pid()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _backups(self,names,size=100):
+        paths = []
+        for name in names:
+            path = os.path.join(self.dir,name)
+            with open(path,'w') as f:
+                f.write('x' * size)
+            paths.append(path)
+        return paths
+
+    def test_add_and_usage(self):
+        paths = self._backups(['a','b'])
+        self.store.add(paths + [os.path.join(self.dir,'missing')],self.dead)
+        self.assertEqual(list(self.store.read()),paths)
+        self.assertEqual(self.store.usage(),(200,2))
+        self.assertFalse(self.store.over_quota())
+
+    def test_evict_lru_of_dead_vims(self):
+        """Oldest backups of dead Vims go first, touched one is kept"""
+        paths = self._backups(['a','b','c','d','e'])
+        self.store.add(paths[:4],self.dead)
+        self.store.add(paths[4:],os.getpid())
+        self.assertTrue(self.store.touch(paths[0]))
+        self.assertEqual(self.store.evict(),2)
+        self.assertEqual(list(self.store.read()),[paths[3],paths[4],paths[0]])
+        self.assertEqual([os.path.exists(path) for path in paths],\
+                [True,False,False,True,True])
+        self.assertEqual(self.store.evict(),0)
+
+    def test_touch_claims_backup(self):
+        """Backup of dead Vim reused by this one isn't evicted anymore"""
+        self.store.max_files = 1
+        paths = self._backups(['a','b'])
+        self.store.add(paths,self.dead)
+        self.assertTrue(self.store.touch(paths[0],os.getpid()))
+        self.assertEqual(self.store.read()[paths[0]][2],os.getpid())
+        self.assertEqual(self.store.evict(),1)
+        self.assertEqual([os.path.exists(path) for path in paths],\
+                [True,False])
+
+    def test_byte_quota_and_batch(self):
+        self.store.max_files = 100
+        paths = self._backups(['%d' % i for i in range(6)],400)
+        self.store.add(paths,self.dead)
+        self.assertEqual(self.store.evict(batch=2),2)
+        self.assertEqual(self.store.evict(batch=2),2)
+        self.assertEqual(self.store.evict(batch=2),0)
+        self.assertEqual(self.store.usage(),(800,2))
+        self.assertEqual(self.store.evicted_bytes,1600)
+
+    def test_living_vims_are_not_evicted(self):
+        paths = self._backups(['a','b','c','d'])
+        self.store.add(paths,os.getpid())
+        self.assertEqual(self.store.evict(),0)
+        self.assertTrue(self.store.over_quota())
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_removed_backup_is_dropped(self):
+        paths = self._backups(['a','b','c','d'])
+        self.store.add(paths,self.dead)
+        os.remove(paths[0])
+        self.assertEqual(self.store.evict(),1)
+        self.assertEqual(list(self.store.read()),paths[1:])
+
+    def test_start_evict(self):
+        self.store.add(self._backups(['%d' % i for i in range(50)]),\
+                self.dead)
+        self.store.start_evict(batch=8).join()
+        self.assertEqual(self.store.usage(),(300,3))
+        self.assertEqual(len(os.listdir(self.dir)),5)
+
+    def test_broken_index(self):
+        with open(self.store.path,'w') as f:
+            f.write('[["a", 1, 2, 3], ["b"], 7]')
+        self.assertEqual(list(self.store.read().items()),\
+                [('a',[1,2.0,3])])
+
+if __name__ == '__main__':
+    unittest.main()
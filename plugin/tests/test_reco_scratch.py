@@ -0,0 +1,122 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_scratch
+
+class Test_reco_scratch_delta(unittest.TestCase):
+    def test_same(self):
+        self.assertEqual(reco_scratch.delta(['a','b'],['a','b']),None)
+
+    def test_changed_line(self):
+        self.assertEqual(reco_scratch.delta(['a','b','c'],['a','x','c']),\
+                (1,2,['x']))
+
+    def test_insert_and_delete(self):
+        self.assertEqual(reco_scratch.delta(['a','c'],['a','b','c']),\
+                (1,1,['b']))
+        self.assertEqual(reco_scratch.delta(['a','b','c'],['a','c']),\
+                (1,2,[]))
+        #repeated lines don't make start pass end
+        self.assertEqual(reco_scratch.delta(['a','a'],['a','a','a']),\
+                (2,2,['a']))
+
+    def test_delta_applies(self):
+        old = ['%d' % i for i in range(20)]
+        new = old[:5] + ['x','y'] + old[9:] + ['z']
+        start,end,lines = reco_scratch.delta(old,new)
+        old[start:end] = lines
+        self.assertEqual(old,new)
+
+class Test_reco_scratch_journal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = reco_scratch.journal_path(os.path.join(self.dir,\
+                'reco_session.123'))
+        self.journal = reco_scratch.ScratchJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.dir)
+
+    def test_record_and_replay(self):
+        self.assertTrue(self.journal.record('a',['1','2','3']))
+        self.assertTrue(self.journal.record('a',['1','x','3','4']))
+        self.assertFalse(self.journal.record('a',['1','x','3','4']))
+        self.journal.record('b',[''])
+        self.assertEqual(self.journal.records,3)
+        self.assertEqual(reco_scratch.replay(self.path),\
+                {'a':['1','x','3','4'],'b':['']})
+
+    def test_delta_is_small(self):
+        lines = ['line %d' % i for i in range(1000)]
+        self.journal.record('a',lines)
+        size = self.journal.bytes_written
+        lines[500] = 'changed'
+        self.journal.record('a',lines)
+        self.assertTrue(self.journal.bytes_written - size < 50)
+
+    def test_change(self):
+        self.assertFalse(self.journal.change('a',0,0,['x']))
+        self.journal.record('a',['1','2','3'])
+        size = self.journal.bytes_written
+        self.assertTrue(self.journal.change('a',1,2,['x','y']))
+        self.assertTrue(self.journal.change('a',3,4,[]))
+        self.assertTrue(self.journal.bytes_written - size < 60)
+        self.assertEqual(reco_scratch.replay(self.path),{'a':['1','x','y']})
+        #next record compares with lines after changes
+        self.assertFalse(self.journal.record('a',['1','x','y']))
+
+    def test_forget(self):
+        self.journal.record('a',['1'])
+        self.journal.forget('a')
+        self.journal.record('a',['2'])
+        self.assertEqual(reco_scratch.replay(self.path),{'a':['2']})
+
+    def test_cut_record(self):
+        self.journal.record('a',['1'])
+        self.journal.record('a',['2'])
+        self.journal.close()
+        with open(self.path,'rb') as f:
+            data = f.read()
+        with open(self.path,'wb') as f:
+            f.write(data[:-5])
+        self.assertEqual(reco_scratch.replay(self.path),{'a':['1']})
+
+    def test_missing_journal(self):
+        self.assertEqual(reco_scratch.replay(self.path),{})
+
+    def test_sync(self):
+        self.journal.sync()
+        self.journal.record('a',['1'])
+        self.journal.sync()
+        self.journal.sync()
+        self.assertEqual(self.journal.syncs,1)
+
+    def test_compact(self):
+        lines = ['x' * 100]
+        for i in range(1000):
+            lines[0] = '%d' % i + 'x' * 100
+            self.journal.record('a',lines)
+        self.assertTrue(self.journal.needs_compaction())
+        self.journal.compact()
+        self.assertFalse(self.journal.needs_compaction())
+        self.assertEqual(self.journal.compactions,1)
+        self.assertTrue(os.path.getsize(self.path) < 200)
+        #appending goes on after compaction
+        self.journal.record('a',lines + ['y'])
+        self.assertEqual(reco_scratch.replay(self.path),\
+                {'a':lines + ['y']})
+
+    def test_any_bytes(self):
+        lines = [b'\xc5\xbc\xc3\xb3\xc5\x82w'.decode('utf-8')]
+        if str is bytes:
+            #Python 2 Vim gives bytes, not always valid utf-8
+            lines = [b'\xc5\xbc\xff']
+        self.journal.record('a',lines)
+        self.assertEqual(reco_scratch.replay(self.path),{'a':lines})
+
+if __name__ == '__main__':
+    unittest.main()
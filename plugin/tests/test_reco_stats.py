@@ -0,0 +1,76 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_stats
+
+class FakeVim(object):
+    """Only eval, command and one attribute of vim module"""
+    error = Exception
+
+    def __init__(self):
+        self.commands = []
+
+    def eval(self,expr):
+        return expr
+
+    def command(self,cmd):
+        self.commands.append(cmd)
+
+class Test_reco_stats(unittest.TestCase):
+    """Handler stats and counting vim module, no Vim needed"""
+    def setUp(self):
+        self.stats = reco_stats.Stats()
+        self.vim = reco_stats.CountingVim(FakeVim(),self.stats)
+
+    def test_run_counts_calls_and_evals(self):
+        def stage():
+            self.vim.eval('1')
+            self.vim.eval('2')
+            return 'done'
+        result = self.stats.run('au BufAdd',self.stats.run,'stage',stage)
+        self.stats.run('stage',lambda: None)
+        self.assertEqual(result,'done')
+        self.assertEqual(self.stats.handlers['stage']['calls'],2)
+        self.assertEqual(self.stats.handlers['stage']['evals'],2)
+        self.assertEqual(self.stats.handlers['au BufAdd']['evals'],2)
+        self.assertEqual(self.stats.counters,{'vim.eval':2})
+
+    def test_run_records_failed_handler(self):
+        def stage():
+            raise ValueError()
+        self.assertRaises(ValueError,self.stats.run,'stage',stage)
+        self.assertEqual(self.stats.handlers['stage']['calls'],1)
+
+    def test_counting_vim(self):
+        self.vim.command('exe "mksession! /tmp/x"')
+        self.vim.command('write')
+        self.assertEqual(self.stats.counters,{'vim.command':2,\
+                'mksession!':1})
+        self.assertEqual(self.vim.module.commands[1],'write')
+        self.assertTrue(self.vim.error is Exception)
+
+    def test_report_and_dump(self):
+        self.stats.run('slow',lambda: [i for i in range(10000)])
+        self.stats.run('fast',lambda: None)
+        self.stats.count('copies',3)
+        lines = self.stats.report()
+        self.assertTrue(lines[1].startswith('slow'))
+        self.assertTrue(lines[2].startswith('fast'))
+        self.assertEqual(lines[-1].split(),['copies','3'])
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory,'stats.json')
+            self.stats.dump(path)
+            with open(path) as f:
+                data = json.load(f)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(data['handlers']['fast']['calls'],1)
+        self.assertEqual(data['counters'],{'copies':3})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_copy
+import reco_store
+class Test_reco_blob_store(unittest.TestCase):
+    """Deduplicated backups, no Vim needed"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = reco_copy.backend_for(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _put(self,store,data,name):
+        src = os.path.join(self.dir,'src')
+        with open(src,'wb') as f:
+            f.write(data)
+        ref = os.path.join(self.dir,name)
+        with open(src,'rb') as source:
+            return ref,store.put(source,ref,self.backend)
+
+    def test_ref_resolves_to_blob(self):
+        store = reco_store.BlobStore(self.dir,'1')
+        ref,strategy = self._put(store,b'data' * 1000,'%tmp%a.txt.swp')
+        blob = reco_store.resolve(ref)
+        self.assertNotEqual(blob,ref)
+        self.assertTrue(blob.endswith('.swp'))
+        with open(blob,'rb') as f:
+            self.assertEqual(f.read(),b'data' * 1000)
+
+    def test_resolve_regular_backup(self):
+        path = os.path.join(self.dir,'%etc%hosts')
+        with open(path,'w') as f:
+            f.write('127.0.0.1 localhost')
+        self.assertEqual(reco_store.resolve(path),path)
+        self.assertEqual(reco_store.resolve(path + 'missing'),\
+                path + 'missing')
+
+    def test_same_content_skipped(self):
+        first = reco_store.BlobStore(self.dir,'1')
+        second = reco_store.BlobStore(self.dir,'2')
+        ref1,strategy1 = self._put(first,b'same','%a')
+        ref2,strategy2 = self._put(second,b'same','%b')
+        self.assertNotEqual(strategy1,'dedup')
+        self.assertEqual(strategy2,'dedup')
+        self.assertEqual(second.skipped,1)
+        self.assertEqual(reco_store.resolve(ref1),reco_store.resolve(ref2))
+
+    def test_blob_removed_only_without_refs(self):
+        #sessions are pids of living processes
+        first = reco_store.BlobStore(self.dir,os.getpid())
+        second = reco_store.BlobStore(self.dir,os.getppid())
+        ref1,strategy = self._put(first,b'same','%a')
+        self._put(second,b'same','%b')
+        blob = reco_store.resolve(ref1)
+        first.release()
+        self.assertTrue(os.path.exists(blob))
+        second.release()
+        self.assertFalse(os.path.exists(blob))
+
+    def _dead_session(self,data):
+        process = subprocess.Popen([sys.executable,'-c','pass'])
+        process.wait()
+        dead = reco_store.BlobStore(self.dir,process.pid)
+        ref,strategy = self._put(dead,data,'%dead')
+        return dead,ref
+
+    def test_crashed_session_blob_kept(self):
+        """Backup of crashed Vim survives release of other session"""
+        dead,ref = self._dead_session(b'same')
+        store = reco_store.BlobStore(self.dir,os.getpid())
+        self._put(store,b'same','%a')
+        blob = reco_store.resolve(ref)
+        store.release()
+        self.assertTrue(os.path.exists(blob))
+        with open(reco_store.resolve(ref),'rb') as f:
+            self.assertEqual(f.read(),b'same')
+
+    def test_adopt(self):
+        dead,ref = self._dead_session(b'data')
+        store = reco_store.BlobStore(self.dir,os.getpid())
+        self.assertEqual(store.adopt(dead.session),1)
+        self.assertFalse(os.path.exists(os.path.join(store.sessions_dir,\
+                dead.session)))
+        blob = reco_store.resolve(ref)
+        self.assertTrue(os.path.exists(blob))
+        store.release()
+        self.assertFalse(os.path.exists(blob))
+        self.assertEqual(store.adopt(dead.session),0)
+
+    def test_hold(self):
+        first = reco_store.BlobStore(self.dir,os.getpid())
+        second = reco_store.BlobStore(self.dir,os.getppid())
+        ref,strategy = self._put(first,b'data','%a')
+        self.assertTrue(second.hold(ref))
+        self.assertFalse(second.hold(os.path.join(self.dir,'missing')))
+        self.assertFalse(second.hold(os.path.join(self.dir,'src')))
+        blob = reco_store.resolve(ref)
+        first.release()
+        self.assertTrue(os.path.exists(blob))
+        second.release()
+        self.assertFalse(os.path.exists(blob))
+
+    def test_backup_exists_needs_blob(self):
+        store = reco_store.BlobStore(self.dir,'1')
+        ref,strategy = self._put(store,b'data','%a')
+        self.assertTrue(reco_store.backup_exists(ref))
+        os.remove(reco_store.resolve(ref))
+        self.assertFalse(reco_store.backup_exists(ref))
+        self.assertFalse(reco_store.backup_exists(ref + 'missing'))
+
+class Test_reco_compression(unittest.TestCase):
+    """Compressed backups are decompressed to temp file on demand"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = b''.join(b'line %d\n' % i for i in range(100000))
+        self.src = os.path.join(self.dir,'src')
+        with open(self.src,'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _backup(self,method,name):
+        engine = reco_copy.CopyEngine()
+        dst = os.path.join(self.dir,name)
+        compressor = reco_store.Compressor(method)
+        self.assertTrue(engine.submit(self.src,dst,\
+                compressor=compressor).wait())
+        engine.shutdown()
+        return dst,compressor
+
+    def test_zlib_roundtrip(self):
+        dst,compressor = self._backup('zlib','%tmp%src.swp')
+        self.assertFalse(os.path.exists(dst))
+        self.assertTrue(os.path.getsize(dst + compressor.ext) < \
+                len(self.data) / 2)
+        real = reco_store.resolve(dst)
+        self.assertTrue(real.endswith('%tmp%src.swp'))
+        with open(real,'rb') as f:
+            self.assertEqual(f.read(),self.data)
+        #backup rewritten with same mtime isn't read from old temp file
+        st = os.stat(dst + compressor.ext)
+        self.data = b'changed\n'
+        with open(self.src,'wb') as f:
+            f.write(self.data)
+        self._backup('zlib','%tmp%src.swp')
+        os.utime(dst + compressor.ext,(st.st_atime,st.st_mtime))
+        self.assertEqual(reco_store.resolve(dst),real)
+        with open(real,'rb') as f:
+            self.assertEqual(f.read(),self.data)
+
+    @unittest.skipIf(reco_store.lzma is None,'lzma not available')
+    def test_lzma_roundtrip(self):
+        dst,compressor = self._backup('lzma','%tmp%src')
+        self.assertEqual(compressor.ext,'.reco.xz')
+        with open(reco_store.resolve(dst),'rb') as f:
+            self.assertEqual(f.read(),self.data)
+
+    def test_compressed_blob(self):
+        store = reco_store.BlobStore(self.dir,'1')
+        ref = os.path.join(self.dir,'%tmp%src.swp')
+        with open(self.src,'rb') as source:
+            store.put(source,ref,reco_copy.backend_for(self.dir),\
+                    compressor=reco_store.Compressor('zlib'))
+        real = reco_store.resolve(ref)
+        self.assertTrue(real.endswith('.swp'))
+        with open(real,'rb') as f:
+            self.assertEqual(f.read(),self.data)
+        store.release()
+        self.assertFalse(os.path.exists(real))
+
+    def test_remove_backup(self):
+        dst,compressor = self._backup('zlib','%tmp%src')
+        real = reco_store.resolve(dst)
+        self.assertTrue(reco_store.backup_exists(dst))
+        self.assertTrue(reco_store.remove_backup(dst))
+        self.assertFalse(reco_store.backup_exists(dst))
+        self.assertFalse(os.path.exists(dst + compressor.ext))
+        self.assertFalse(os.path.exists(real))
+        self.assertFalse(reco_store.remove_backup(dst))
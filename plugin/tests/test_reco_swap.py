@@ -0,0 +1,126 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_swap
+class Test_reco_swap_index(unittest.TestCase):
+    """Swap lookup by basename, no Vim needed"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.full = os.path.join(self.dir,'full')
+        os.mkdir(self.full)
+        for name in ['scratch1.123.swp','scratch2.123.swo',\
+                'scratch2.123.swp','scratch3.123.swn','other.txt']:
+            open(os.path.join(self.dir,name),'w').close()
+        open(os.path.join(self.full,'%tmp%scratch4.123.swp'),'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_lookup(self):
+        index = reco_swap.SwapIndex([self.dir,self.full + '//'])
+        self.assertEqual(index.lookup('scratch1.123'),\
+                os.path.join(self.dir,'scratch1.123.swp'))
+        self.assertEqual(index.swaps('scratch2.123'),\
+                [os.path.join(self.dir,'scratch2.123.swp'),\
+                os.path.join(self.dir,'scratch2.123.swo')])
+        self.assertEqual(index.lookup('scratch3.123'),\
+                os.path.join(self.dir,'scratch3.123.swn'))
+        self.assertEqual(index.lookup('scratch4.123'),\
+                os.path.join(self.full,'%tmp%scratch4.123.swp'))
+        self.assertEqual(index.lookup('other.txt'),None)
+        self.assertEqual(len(index),5)
+
+    def test_hidden_swaps_in_current_dir(self):
+        open(os.path.join(self.dir,'.scratch5.123.swp'),'w').close()
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            index = reco_swap.SwapIndex(['.'])
+        finally:
+            os.chdir(cwd)
+        self.assertTrue(index.lookup('scratch5.123').endswith(\
+                '.scratch5.123.swp'))
+        self.assertEqual(index.lookup('scratch1.123'),None)
+
+    def test_discard_and_add(self):
+        index = reco_swap.SwapIndex([self.dir])
+        swap = index.lookup('scratch2.123')
+        index.discard(swap)
+        self.assertEqual(index.lookup('scratch2.123'),\
+                os.path.join(self.dir,'scratch2.123.swo'))
+        index.discard(index.lookup('scratch2.123'))
+        self.assertEqual(index.lookup('scratch2.123'),None)
+        index.add(swap)
+        self.assertEqual(index.lookup('scratch2.123'),swap)
+
+    def test_missing_dir(self):
+        index = reco_swap.SwapIndex([os.path.join(self.dir,'no_such')])
+        self.assertEqual(len(index),0)
+
+def _find_vim():
+    for path in os.environ.get('PATH','').split(os.pathsep):
+        vim = os.path.join(path,'vim')
+        if os.access(vim,os.X_OK):
+            return vim
+    return None
+
+@unittest.skipIf(_find_vim() is None,'vim not in PATH')
+class Test_reco_swap_reader(unittest.TestCase):
+    """Read swaps made by local Vim and compare with what Vim had in buffer"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir,'file.txt')
+        with open(self.file,'w') as f:
+            f.write(''.join('line %d\n' % i for i in range(20000)))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _vim_swap(self,*commands):
+        """Run commands in Vim, preserve swap and copy it before Vim removes
+it. Return path of copy and file with buffer content"""
+        swap = os.path.join(self.dir,'file.txt.swp')
+        copy = os.path.join(self.dir,'copy.swp')
+        expected = os.path.join(self.dir,'expected.txt')
+        args = [_find_vim(),'-u','NONE','-N','-es','-i','NONE',\
+                '-c','set dir=%s' % self.dir,'-c','edit %s' % self.file]
+        for command in commands + ('preserve',\
+                "call writefile(readfile('%s','b'),'%s','b')" % (swap,copy),\
+                'write! %s' % expected,'qa!'):
+            args += ['-c',command]
+        subprocess.call(args)
+        return copy,expected
+
+    def _expected(self,expected):
+        with open(expected,'rb') as f:
+            return f.read().splitlines()
+
+    def test_header(self):
+        copy,expected = self._vim_swap('normal! Gdd')
+        with reco_swap.SwapFile(copy) as swap:
+            self.assertTrue(swap.version.startswith(b'VIM'))
+            self.assertTrue(swap.page_size >= 1024)
+            self.assertTrue(swap.pid > 0)
+            self.assertTrue(swap.dirty)
+            self.assertTrue(swap.fname.endswith(b'file.txt'))
+
+    def test_lines_after_edits(self):
+        copy,expected = self._vim_swap('1,10d',\
+                'call append(500,["inserted","lines"])','%s/line 19/LINE/',\
+                'normal! Goappended')
+        with reco_swap.SwapFile(copy) as swap:
+            self.assertEqual(list(swap.lines()),self._expected(expected))
+
+    def test_long_lines(self):
+        """Line longer than page is stored in data block of many pages"""
+        copy,expected = self._vim_swap(\
+                'call setline(100,repeat("x",20000))')
+        with reco_swap.SwapFile(copy) as swap:
+            self.assertEqual(list(swap.lines()),self._expected(expected))
+
+    def test_not_a_swap(self):
+        self.assertRaises(reco_swap.SwapError,reco_swap.SwapFile,self.file)
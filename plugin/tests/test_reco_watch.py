@@ -0,0 +1,151 @@
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import reco_watch
+from test_reco_swap import _find_vim
+
+def _wait_until(condition,timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def stager_counts(stager):
+    return stager.staged,stager.claimed,stager.missed
+
+class Test_reco_watchers(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _events(self,watcher):
+        path = os.path.join(self.dir,'a.swp')
+        with open(path,'w') as f:
+            f.write('x')
+        changed = watcher.read(1.0)
+        os.remove(path)
+        removed = []
+        deadline = time.time() + 5
+        while not removed and time.time() < deadline:
+            removed = [event for event in watcher.read(0.2) \
+                    if event[2] == reco_watch.REMOVED]
+        watcher.close()
+        return changed,removed
+
+    def test_poller(self):
+        changed,removed = self._events(reco_watch.Poller([self.dir]))
+        self.assertEqual(changed,[(self.dir,'a.swp',reco_watch.CHANGED)])
+        self.assertEqual(removed,[(self.dir,'a.swp',reco_watch.REMOVED)])
+
+    def test_inotify(self):
+        try:
+            watcher = reco_watch.Inotify([self.dir])
+        except OSError:
+            self.skipTest('no inotify here')
+        changed,removed = self._events(watcher)
+        self.assertTrue((self.dir,'a.swp',reco_watch.CHANGED) in changed)
+        self.assertEqual(removed,[(self.dir,'a.swp',reco_watch.REMOVED)])
+
+    def test_wake(self):
+        watcher = reco_watch.watch([self.dir])
+        watcher.wake()
+        start = time.time()
+        self.assertEqual(watcher.read(5),[])
+        self.assertTrue(time.time() - start < 1)
+        watcher.close()
+
+@unittest.skipIf(_find_vim() is None,'vim not in PATH')
+class Test_reco_swap_stager(unittest.TestCase):
+    """Swaps of killed headless Vims are staged before anyone asks"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.swap_dir = os.path.join(self.dir,'swap')
+        self.backup_dir = os.path.join(self.dir,'backup')
+        os.makedirs(self.swap_dir)
+        self.stagers = []
+
+    def tearDown(self):
+        for stager in self.stagers:
+            stager.stop()
+        shutil.rmtree(self.dir)
+
+    def _crash_vim(self,i):
+        name = os.path.join(self.dir,'file%d.txt' % i)
+        with open(name,'w') as f:
+            f.write('line\n' * 100)
+        with open(os.devnull,'w') as null:
+            subprocess.call([_find_vim(),'-u','NONE','-N','-es','-i','NONE',\
+                    '-c','set dir=%s//' % self.swap_dir,'-c','edit %s' % name,\
+                    '-c','1d','-c','preserve',\
+                    '-c',"call system('kill -9 ' . getpid())"],\
+                    stdout=null,stderr=null)
+        return os.path.join(self.swap_dir,name.replace('/','%') + '.swp')
+
+    def _stager(self,poll=False,ignore=None):
+        stager = reco_watch.SwapStager([self.swap_dir + '//'],\
+                self.backup_dir,interval=0.1,ignore=ignore,poll=poll)
+        self.stagers.append(stager)
+        stager.start()
+        self.assertTrue(stager.wait_ready(10))
+        return stager
+
+    def _claim(self,stager,swap):
+        dst = os.path.join(self.backup_dir,'dst.swp')
+        self.assertTrue(_wait_until(lambda: swap in stager._jobs and \
+                stager._jobs[swap][0].done()))
+        self.assertTrue(stager.claim(swap,dst))
+        with open(swap,'rb') as f:
+            with open(dst,'rb') as g:
+                self.assertEqual(f.read(),g.read())
+
+    def test_existing_swap(self):
+        swap = self._crash_vim(0)
+        self._claim(self._stager(),swap)
+        self.assertEqual(stager_counts(self.stagers[0]),(1,1,0))
+
+    def test_new_swap(self):
+        for poll in (False,True):
+            stager = self._stager(poll)
+            swap = self._crash_vim(int(poll))
+            self._claim(stager,swap)
+
+    def test_changed_swap_is_not_claimed(self):
+        swap = self._crash_vim(0)
+        stager = self._stager()
+        self.assertTrue(_wait_until(lambda: swap in stager._jobs and \
+                stager._jobs[swap][0].done()))
+        job,key = stager._jobs[swap]
+        stager._jobs[swap] = (job,key[:3] + (0,))
+        self.assertFalse(stager.claim(swap,os.path.join(self.backup_dir,\
+                'dst.swp')))
+        self.assertFalse(os.path.exists(job.dst))
+        self.assertFalse(stager.claim(swap,'unused'))
+
+    def test_ignore_and_stop(self):
+        swap = self._crash_vim(0)
+        stager = self._stager(ignore=lambda name: True)
+        self.assertFalse(swap in stager._jobs)
+        stager.stop()
+        self.stagers.remove(stager)
+        self.assertFalse(os.path.exists(stager.stage_dir))
+
+    def test_stale_stage_dir_removed(self):
+        process = subprocess.Popen([sys.executable,'-c','pass'])
+        process.wait()
+        stale = os.path.join(self.backup_dir,reco_watch.STAGE_DIR,\
+                str(process.pid))
+        os.makedirs(stale)
+        self._stager()
+        self.assertFalse(os.path.exists(stale))
+
+if __name__ == '__main__':
+    unittest.main()